@@ -0,0 +1,64 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory use and copying time of large graphs
+
+Run with `python -m benchmarks.graph_memory` from the repository root. For each size, this builds a
+diagram with that many boxes on a few wires, then reports the memory it takes up per vertex and per
+edge, and the time taken by `Graph.copy`, which shares the vertex and edge records, and by `copy.deepcopy`
+and a pickle round trip, which copy every record.
+"""
+
+from __future__ import annotations
+from typing import List, Optional
+import argparse
+import copy
+import gc
+import pickle
+import time
+import tracemalloc
+
+from benchmarks.layer_decomp import deep_graph
+
+def timed(f: object, *args: object) -> float:
+    start = time.perf_counter()
+    f(*args)  # type: ignore
+    return time.perf_counter() - start
+
+def main(args: Optional[List[str]] = None) -> None:
+    arg_parser = argparse.ArgumentParser(description='Measure the memory use and copying time of large graphs.')
+    arg_parser.add_argument('--width', type=int, default=10, help='number of wires (default: 10)')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                            help='approximate numbers of boxes to try (default: 10000 100000)')
+    opts = arg_parser.parse_args(args)
+
+    print(f'{"vertices":>9} {"edges":>8} {"bytes/v+e":>10} {"copy":>9} {"deepcopy":>9} {"pickle":>9}')
+    for size in opts.sizes:
+        gc.collect()
+        tracemalloc.start()
+        # deep_graph averages about 0.55 boxes per wire in each layer
+        g = deep_graph(opts.width, max(1, round(size / (0.55 * opts.width))))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        n = g.num_vertices() + g.num_edges()
+        t_copy = timed(g.copy)
+        t_deepcopy = timed(copy.deepcopy, g)
+        t_pickle = timed(lambda: pickle.loads(pickle.dumps(g)))
+        print(f'{g.num_vertices():>9} {g.num_edges():>8} {memory / n:>10.0f} {t_copy * 1e3:>7.3f}ms '
+              f'{t_deepcopy:>8.3f}s {t_pickle:>8.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scaling benchmark for `layer_decomp` on deep diagrams
+
+Run with `python -m benchmarks.layer_decomp` from the repository root. For each depth, this builds a
+diagram of the given width where every layer has boxes on a random subset of the wires (so wires skipping
+a layer need identity boxes), then times `layer_decomp` and `graph_to_term` on it. If both are linear, the
+time per box stays roughly constant as the depth grows.
+"""
+
+from __future__ import annotations
+from typing import List, Optional
+import argparse
+import random
+import time
+
+from chyp.graph import Graph
+from chyp.term import graph_to_term, layer_decomp
+
+def deep_graph(width: int, depth: int, seed: int = 0) -> Graph:
+    """Build a diagram with `width` wires and `depth` layers of 1->1 and 2->2 boxes
+
+    The graph is built directly, rather than by composing layers, since composition takes time
+    proportional to the size of the graph built so far.
+    """
+    rng = random.Random(seed)
+    g = Graph()
+    wires = [g.add_vertex() for _ in range(width)]
+    g.set_inputs(list(wires))
+    for _ in range(depth):
+        i = 0
+        while i < width:
+            r = rng.random()
+            if r < 0.3 and i + 1 < width:
+                out = [g.add_vertex(), g.add_vertex()]
+                g.add_edge(wires[i:i+2], out, 'c')
+                wires[i:i+2] = out
+                i += 2
+            elif r < 0.7:
+                out = [g.add_vertex()]
+                g.add_edge(wires[i:i+1], out, 'f')
+                wires[i:i+1] = out
+                i += 1
+            else:
+                i += 1
+    g.set_outputs(list(wires))
+    return g
+
+def main(args: Optional[List[str]] = None) -> None:
+    arg_parser = argparse.ArgumentParser(description='Time layer_decomp and graph_to_term on deep diagrams.')
+    arg_parser.add_argument('--width', type=int, default=10, help='number of wires (default: 10)')
+    arg_parser.add_argument('--depths', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000],
+                            help='numbers of layers to try (default: 250 500 1000 2000 4000)')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='take the best of this many runs (default: 3)')
+    opts = arg_parser.parse_args(args)
+
+    print(f'{"depth":>7} {"boxes":>7} {"layer_decomp":>14} {"per box":>10} {"graph_to_term":>14} {"per box":>10}')
+    for depth in opts.depths:
+        g = deep_graph(opts.width, depth)
+        t_layers = t_term = float('inf')
+        for _ in range(opts.repeat):
+            h = g.copy()
+            start = time.perf_counter()
+            layer_decomp(h)
+            t_layers = min(t_layers, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            graph_to_term(g)
+            t_term = min(t_term, time.perf_counter() - start)
+
+        n = g.num_edges()
+        print(f'{depth:>7} {n:>7} {t_layers:>13.3f}s {t_layers / n * 1e6:>8.1f}us '
+              f'{t_term:>13.3f}s {t_term / n * 1e6:>8.1f}us')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark suite for parsing, proof checking, matching, rewriting, terms and layout
+
+Run with `python -m benchmarks.run` from the repository root. This times:
+
+- `parser.parse` on each file in `examples/` that parses without errors, from scratch rather than from
+  the document cache,
+- `Tactic.run_check` on every rewrite step in those files, without the proof cache,
+- `match_rule`, `dpo`, `graph_to_term`, `layer_decomp`, `convex_layout` (if cvxpy is installed) and
+  `layered_layout` on synthetic graphs of each of the sizes given by `--sizes`, so the times for a
+  benchmark at increasing sizes give its scaling curve. These include random diagrams from
+  :mod:`benchmarks.workload`, with a rule whose LHS has one match for every 10 boxes.
+
+Each benchmark is run repeatedly until it has taken at least `--min-time` seconds, and the best time per
+run out of `--repeat` such samples is reported. Results can be saved as a JSON baseline with `--save`, and
+compared against a saved baseline with `--compare`, which flags every benchmark that got slower by more
+than `--threshold` and exits with a non-zero code if there were any. Timings depend on the machine, so a
+baseline should only be compared against runs on the same machine.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import functools
+import glob
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+
+from chyp import parser
+from chyp.graph import Graph, gen, identity
+from chyp.layout import convex_layout, layered_layout
+from chyp.matcher import match_rule
+from chyp.rewrite import dpo
+from chyp.rule import Rule
+from chyp.term import graph_to_term, layer_decomp
+from benchmarks.layer_decomp import deep_graph
+from benchmarks.workload import fold, planted_rule, random_graph, random_signature
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+BASELINE_VERSION = 1
+# convex_layout needs cvxpy, which is an optional dependency
+HAVE_CVXPY = importlib.util.find_spec('cvxpy') is not None
+
+@dataclass
+class Benchmark:
+    """A named piece of work to time
+
+    `setup` is called once, before timing starts, and its result is passed to `run` each time it is timed.
+    `size` is the size of the input (e.g. its number of edges), for reading off scaling curves.
+    """
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+    size: int = 0
+
+def const(x: Any) -> Callable[[], Any]:
+    """A setup function returning `x`"""
+    return lambda: x
+
+def f() -> Graph:
+    return gen('f', [(None, 1)], [(None, 1)])
+
+def m() -> Graph:
+    return gen('m', [(None, 1)] * 2, [(None, 1)])
+
+def chain(n: int) -> Graph:
+    """A composition of `n` copies of the generator f"""
+    return fold(lambda g, h: g >> h, [f() for _ in range(n)])
+
+def tensor(n: int) -> Graph:
+    """A tensor product of `n` copies of the generator f"""
+    return fold(lambda g, h: g * h, [f() for _ in range(n)])
+
+def comb(n: int) -> Graph:
+    """Multiply `n + 1` wires together using `n` copies of the generator m, all bracketed to the left
+
+    This is built directly, since building it from layers would need a quadratic number of identities.
+    """
+    g = Graph()
+    inputs = [g.add_vertex() for _ in range(n + 1)]
+    g.set_inputs(inputs)
+    acc = inputs[0]
+    for v in inputs[1:]:
+        out = g.add_vertex()
+        g.add_edge([acc, v], [out], 'm')
+        acc = out
+    g.set_outputs([acc])
+    return g
+
+def example_benchmarks() -> List[Benchmark]:
+    """Benchmarks for parsing the example files and checking the rewrite steps in them
+
+    Files with parse errors are skipped, since parsing stops at the first error and the time wouldn't be
+    comparable with that of parsing the whole file.
+    """
+    benchmarks = []
+    for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.chyp'))):
+        with open(path) as file:
+            code = file.read()
+        name = os.path.splitext(os.path.basename(path))[0]
+        st = parser.parse(code, path)
+        if st.errors: continue
+
+        def parse(code: str, path: str = path) -> None:
+            # parse from scratch, rather than reusing the states cached by the last run
+            parser.document_cache.clear()
+            parser.parse(code, path)
+        benchmarks.append(Benchmark(f'parse/{name}', parse, const(code), len(code)))
+
+        for step, rw in st.rewrites.items():
+            if rw.stub: continue
+            benchmarks.append(Benchmark(f'check/{name}/{step}', lambda rw: rw.tactic.run_check(), const(rw)))
+    return benchmarks
+
+def synthetic_benchmarks(sizes: List[int], width: int) -> List[Benchmark]:
+    """Benchmarks on generated graphs of each of the given sizes"""
+    ff = Rule(chain(2), f(), 'ff')
+    assoc = Rule(m() * identity() >> m(), identity() * m() >> m(), 'assoc')
+    boxes = random_signature(12, [(None, 1), ('q', 1), ('q', 2)])
+    planted = planted_rule()
+    benchmarks = []
+    for n in sizes:
+        def planted_graph(n: int = n) -> Graph:
+            # random diagrams average about 0.6 boxes per wire in each layer
+            return random_graph(boxes, width, max(1, round(n / (0.6 * width))), skew=1.0,
+                                redistribute_prob=0.05, plant=(planted.lhs, max(1, n // 10)))
+        benchmarks += [
+            Benchmark(f'match_rule/chain/{n}', lambda g: list(match_rule(ff, g)), functools.partial(chain, n), n),
+            Benchmark(f'match_rule/tensor/{n}', lambda g: list(match_rule(ff, g)), functools.partial(tensor, n), n),
+            Benchmark(f'match_rule/comb/{n}', lambda g: list(match_rule(assoc, g)), functools.partial(comb, n), n),
+            Benchmark(f'match_rule/planted/{n}', lambda g: list(match_rule(planted, g)), planted_graph, n),
+            Benchmark(f'dpo/chain/{n}', lambda g: list(dpo(ff, next(iter(match_rule(ff, g))))),
+                      functools.partial(chain, n), n),
+            Benchmark(f'graph_to_term/chain/{n}', graph_to_term, functools.partial(chain, n), n),
+            Benchmark(f'graph_to_term/tensor/{n}', graph_to_term, functools.partial(tensor, n), n),
+        ]
+
+        # the depth is chosen so that deep_graph has roughly n boxes
+        depth = max(1, round(n / (0.55 * width)))
+        # layer_decomp and layout modify the graph, so each run starts from a fresh copy
+        benchmarks += [
+            Benchmark(f'graph_to_term/deep/{n}', graph_to_term, functools.partial(deep_graph, width, depth), n),
+            Benchmark(f'layer_decomp/deep/{n}', lambda g: layer_decomp(g.copy()),
+                      functools.partial(deep_graph, width, depth), n),
+            Benchmark(f'layered_layout/deep/{n}', lambda g: layered_layout(g.copy()),
+                      functools.partial(deep_graph, width, depth), n),
+        ]
+        if HAVE_CVXPY:
+            benchmarks.append(Benchmark(f'convex_layout/deep/{n}', lambda g: convex_layout(g.copy()),
+                                        functools.partial(deep_graph, width, depth), n))
+    return benchmarks
+
+def time_benchmark(b: Benchmark, repeat: int, min_time: float) -> float:
+    """Return the best time for a single run of `b`, in seconds"""
+    arg = b.setup()
+    best = float('inf')
+    for _ in range(repeat):
+        runs = 0
+        start = time.perf_counter()
+        elapsed = 0.0
+        while runs == 0 or elapsed < min_time:
+            b.run(arg)
+            runs += 1
+            elapsed = time.perf_counter() - start
+        best = min(best, elapsed / runs)
+    return best
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    with open(path) as file:
+        j = json.load(file)
+    if j.get('version') != BASELINE_VERSION:
+        raise ValueError(f'{path}: unsupported baseline version {j.get("version")}')
+    return j['results']
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]) -> None:
+    j = {
+        'version': BASELINE_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(path, 'w') as file:
+        json.dump(j, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+def format_time(t: float) -> str:
+    if t < 1e-3: return f'{t * 1e6:.1f}us'
+    if t < 1: return f'{t * 1e3:.2f}ms'
+    return f'{t:.3f}s'
+
+def main(args: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Run the chyp benchmark suite.')
+    arg_parser.add_argument('-k', '--filter', default='',
+                            help='only run benchmarks whose names contain this string')
+    arg_parser.add_argument('--list', action='store_true', help='list the benchmarks without running them')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 400, 800],
+                            help='sizes of the synthetic graphs (default: 100 200 400 800)')
+    arg_parser.add_argument('--width', type=int, default=10,
+                            help='number of wires in the deep synthetic graphs (default: 10)')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='take the best of this many samples (default: 5)')
+    arg_parser.add_argument('--min-time', type=float, default=0.05,
+                            help='minimum time per sample, in seconds (default: 0.05)')
+    arg_parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    arg_parser.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    arg_parser.add_argument('--threshold', type=float, default=0.2,
+                            help='with --compare, the slowdown counted as a regression (default: 0.2, i.e. 20%%)')
+    opts = arg_parser.parse_args(args)
+
+    benchmarks = example_benchmarks() + synthetic_benchmarks(opts.sizes, opts.width)
+    benchmarks = [b for b in benchmarks if opts.filter in b.name]
+    if opts.list:
+        for b in benchmarks: print(b.name)
+        return 0
+
+    baseline = load_baseline(opts.compare) if opts.compare else {}
+    results: Dict[str, Dict[str, float]] = dict()
+    regressions = []
+    name_width = max((len(b.name) for b in benchmarks), default=0)
+    header = f'{"benchmark":<{name_width}} {"time":>10}'
+    if baseline: header += f' {"baseline":>10} {"ratio":>7}'
+    print(header)
+    for b in benchmarks:
+        t = time_benchmark(b, opts.repeat, opts.min_time)
+        results[b.name] = {'time': t, 'size': b.size}
+        line = f'{b.name:<{name_width}} {format_time(t):>10}'
+        if b.name in baseline:
+            ratio = t / baseline[b.name]['time']
+            line += f' {format_time(baseline[b.name]["time"]):>10} {ratio:>6.2f}x'
+            if ratio > 1 + opts.threshold:
+                regressions.append(b.name)
+                line += '  REGRESSION'
+        print(line, flush=True)
+
+    if opts.save:
+        save_baseline(opts.save, results)
+    if opts.compare:
+        missing = [name for name in baseline if name not in results and opts.filter in name]
+        if missing: print(f'{len(missing)} benchmarks in the baseline were not run: {", ".join(missing)}')
+        print(f'{len(regressions)} regressions (slower by more than {opts.threshold:.0%})')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
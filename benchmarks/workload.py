@@ -0,0 +1,239 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Random string diagrams and rules, for stress and performance testing
+
+`random_graph` builds a well-typed diagram layer by layer from a signature of boxes, using `gen`, `perm`,
+`identity` and `redistributer`, combined with `>>` and `*`. The width, depth, how unevenly the box labels
+are used and the mix of vertex types and sizes can all be controlled, and the same seed always gives the
+same diagram.
+
+`planted_rule` makes a rule whose LHS only uses labels of its own, and `random_graph` can plant a given
+number of copies of its LHS in the diagram. Since the labels of the LHS are all different, and its boxes
+are connected by interior wires, each match has to send it onto a single copy, so the LHS has exactly as
+many matches as there are copies. This gives matcher and `simp` workloads with a known amount of work.
+
+Run with `python -m benchmarks.workload` from the repository root to print the sizes of some generated
+diagrams and the number of matches of a planted rule in each.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+import argparse
+import random
+import time
+
+from chyp.graph import Graph, VType, gen, identity, perm, redistributer
+from chyp.rule import Rule
+
+WireType = Tuple[VType, int]
+
+@dataclass
+class Box:
+    """A generator in a signature, with its label, domain and codomain"""
+    name: str
+    domain: List[WireType]
+    codomain: List[WireType]
+
+    def graph(self) -> Graph:
+        return gen(self.name, self.domain, self.codomain)
+
+def fold(op: Callable[[Graph, Graph], Graph], gs: List[Graph]) -> Graph:
+    """Combine a non-empty list of graphs with `op`, as a balanced tree
+
+    Composing or tensoring onto a graph takes time proportional to its size, so combining the graphs one
+    at a time would take quadratic time.
+    """
+    while len(gs) > 1:
+        gs = [op(gs[i], gs[i+1]) if i + 1 < len(gs) else gs[i] for i in range(0, len(gs), 2)]
+    return gs[0]
+
+def random_signature(num_boxes: int = 8, wire_types: Sequence[WireType] = ((None, 1),),
+                     max_arity: int = 2, seed: int = 0) -> List[Box]:
+    """Return `num_boxes` boxes named g0, g1, ..., with between 1 and `max_arity` inputs and outputs
+
+    The type of each input is chosen uniformly from `wire_types`, and every wire type gets at least one box
+    with a single input of that type, so each wire can be the input of some box. The outputs of a box have
+    the same vertex types as its inputs, in a random order, with each of them appearing at least once, so
+    a vertex type never disappears from a diagram built from these boxes. Boxes come in pairs, where the
+    second box of each pair is the first one reversed, so anything a box does to the mix of wires can be
+    undone by another box.
+    """
+    rng = random.Random(seed)
+    boxes: List[Box] = []
+    for i in range(0, num_boxes, 2):
+        if i // 2 < len(wire_types):
+            dom = [wire_types[i // 2]]
+        else:
+            dom = [rng.choice(wire_types) for _ in range(rng.randint(1, max_arity))]
+        vtypes = list(dict.fromkeys(vtype for vtype, _ in dom))
+        vtypes += [rng.choice(vtypes) for _ in range(rng.randint(len(vtypes), max(len(vtypes), max_arity)) - len(vtypes))]
+        rng.shuffle(vtypes)
+        cod = [rng.choice([t for t in wire_types if t[0] == vtype]) for vtype in vtypes]
+        boxes.append(Box(f'g{i}', dom, cod))
+        if i + 1 < num_boxes: boxes.append(Box(f'g{i+1}', cod, dom))
+    return boxes
+
+def planted_rule(domain: Sequence[WireType] = ((None, 1),), num_boxes: int = 2, name: str = 'p') -> Rule:
+    """Return a rule whose LHS is a composition of `num_boxes` boxes from `domain` to itself
+
+    The boxes of the LHS are labelled `name`0, `name`1, ..., and the RHS is a single box labelled
+    `name`_rhs. These labels should not be used by anything else in the graphs the rule is matched in.
+    """
+    dom = list(domain)
+    lhs = fold(lambda g, h: g >> h, [gen(f'{name}{i}', dom, dom) for i in range(num_boxes)])
+    return Rule(lhs, gen(f'{name}_rhs', dom, dom), name)
+
+def random_graph(boxes: Sequence[Box], width: int, depth: int, seed: int = 0,
+                 wire_types: Optional[Sequence[WireType]] = None, type_weights: Optional[Sequence[float]] = None,
+                 skew: float = 0.0, identity_prob: float = 0.2, perm_prob: float = 0.1,
+                 redistribute_prob: float = 0.0, plant: Optional[Tuple[Graph, int]] = None) -> Graph:
+    """Build a random diagram with `depth` layers, starting from `width` wires
+
+    The input wires get types from `wire_types` (by default, the types in the domains of `boxes`),
+    chosen with the given `type_weights`. Each layer then goes along the wires, and either leaves a wire
+    alone (with probability `identity_prob`), splits a wire of size greater than 1 into wires of size 1 or
+    joins it with the next wire of the same type (with probability `redistribute_prob`), or applies a box
+    whose domain matches the next few wires. Boxes are chosen so that the number of wires stays close to
+    `width`, and the box with index i in `boxes` is chosen with weight 1/(i+1)^`skew`, so a `skew` of 0
+    uses all the labels evenly and higher values make the first few labels much more common. With
+    probability `perm_prob`, a layer is followed by a random permutation of the wires.
+
+    If `plant` is a pair of a graph and a number n, n copies of the graph are placed in random layers,
+    wherever its domain matches the wires. Copies that don't fit in the layers they were meant for go in
+    later layers, or in extra layers at the end. Raises `ValueError` if they don't fit anywhere.
+    """
+    rng = random.Random(seed)
+    if wire_types is None:
+        wire_types = list(dict.fromkeys(t for b in boxes for t in b.domain))
+    weights = [1.0 / (i + 1) ** skew for i in range(len(boxes))]
+    wires = rng.choices(list(wire_types), weights=type_weights, k=width)
+    graph_layers = [fold(lambda g, h: g * h, [identity(vtype, size) for vtype, size in wires])]
+
+    plant_graph: Optional[Graph] = None
+    plant_domain: List[WireType] = []
+    plant_layers = [0] * (depth + 1)
+    if plant is not None:
+        plant_graph, num_copies = plant
+        plant_domain = plant_graph.domain()
+        if len(plant_domain) == 0 or plant_graph.codomain() != plant_domain:
+            raise ValueError('Only graphs with the same, non-empty, domain and codomain can be planted.')
+        for _ in range(num_copies): plant_layers[rng.randrange(depth)] += 1
+
+    pending = 0
+    d = 0
+    while d < depth or pending > 0:
+        if d < depth:
+            pending += plant_layers[d]
+        out: List[WireType] = []
+        pieces: List[Graph] = []
+        i = 0
+        placed = 0
+        while i < len(wires):
+            # the number of wires after this layer, if the rest are left alone
+            projected = len(out) + len(wires) - i
+            k = len(plant_domain)
+            if (pending > 0 and wires[i:i+k] == plant_domain and
+                    (d >= depth or rng.random() < 0.5)):
+                assert plant_graph is not None
+                pieces.append(plant_graph.copy())
+                out += plant_domain
+                pending -= 1
+                placed += 1
+                i += k
+                continue
+
+            vtype, size = wires[i]
+            r = rng.random()
+            if d >= depth or r < identity_prob:
+                pieces.append(identity(vtype, size))
+                out.append(wires[i])
+                i += 1
+                continue
+            if r < identity_prob + redistribute_prob:
+                # only sizes from `wire_types` are used, so there are always boxes for the new wires
+                if size > 1 and (vtype, 1) in wire_types and projected + size - 1 <= width:
+                    split = [(vtype, 1)] * size
+                    pieces.append(redistributer([wires[i]], split))
+                    out += split
+                    i += 1
+                    continue
+                if (i + 1 < len(wires) and wires[i+1][0] == vtype and
+                        (vtype, size + wires[i+1][1]) in wire_types and projected >= width):
+                    joined = [(vtype, size + wires[i+1][1])]
+                    pieces.append(redistributer(wires[i:i+2], joined))
+                    out += joined
+                    i += 2
+                    continue
+
+            fits = [j for j, b in enumerate(boxes) if wires[i:i+len(b.domain)] == b.domain]
+            if projected > width:
+                # never add wires past `width`, so the diagram can't grow exponentially
+                fits = [j for j in fits if len(boxes[j].codomain) <= len(boxes[j].domain)]
+            elif projected < width:
+                fits = [j for j in fits if len(boxes[j].codomain) >= len(boxes[j].domain)] or fits
+            if len(fits) == 0:
+                pieces.append(identity(vtype, size))
+                out.append(wires[i])
+                i += 1
+                continue
+            b = boxes[rng.choices(fits, weights=[weights[j] for j in fits])[0]]
+            pieces.append(b.graph())
+            out += b.codomain
+            i += len(b.domain)
+
+        if d >= depth and placed == 0:
+            raise ValueError(f'{pending} copies of the planted graph do not fit anywhere in the diagram.')
+        graph_layers.append(fold(lambda g, h: g * h, pieces))
+        wires = out
+        if d < depth and rng.random() < perm_prob:
+            p = list(range(len(wires)))
+            rng.shuffle(p)
+            graph_layers.append(perm(p, wires))
+            wires = [wires[j] for j in p]
+        d += 1
+
+    return fold(lambda g, h: g >> h, graph_layers)
+
+def main(args: Optional[List[str]] = None) -> None:
+    from chyp.matcher import match_rule
+
+    arg_parser = argparse.ArgumentParser(description='Generate random diagrams and count the matches of a planted rule.')
+    arg_parser.add_argument('--width', type=int, default=10, help='number of wires (default: 10)')
+    arg_parser.add_argument('--depths', type=int, nargs='+', default=[100, 200, 400, 800],
+                            help='numbers of layers to try (default: 100 200 400 800)')
+    arg_parser.add_argument('--copies', type=int, default=50, help='copies of the planted LHS (default: 50)')
+    arg_parser.add_argument('--skew', type=float, default=1.0, help='label skew (default: 1.0)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    opts = arg_parser.parse_args(args)
+
+    wire_types: List[WireType] = [(None, 1), ('q', 1), ('q', 2)]
+    boxes = random_signature(12, wire_types, seed=opts.seed)
+    rule = planted_rule([(None, 1)])
+    print(f'{"depth":>7} {"vertices":>9} {"edges":>7} {"build":>9} {"matches":>8} {"match":>9}')
+    for depth in opts.depths:
+        start = time.perf_counter()
+        g = random_graph(boxes, opts.width, depth, seed=opts.seed, skew=opts.skew,
+                         redistribute_prob=0.05, plant=(rule.lhs, opts.copies))
+        t_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        num_matches = len(list(match_rule(rule, g)))
+        t_match = time.perf_counter() - start
+        print(f'{depth:>7} {g.num_vertices():>9} {g.num_edges():>7} {t_build:>8.3f}s {num_matches:>8} {t_match:>8.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .gui import app
+from . import cli
 
 if __name__ == '__main__':
-    app.main()
+    cli.main()
@@ -0,0 +1,188 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2022 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Headless proof checking
+
+This implements the `chyp check` command, which parses files and checks every rewrite step in them without
+starting the GUI. Rewrite steps are independent of each other, so they are checked in parallel on a pool of
+worker processes. Each worker parses a file the first time it gets a step from it, then reuses the parsed
+state for later steps.
+
+Results are cached on disk (see :mod:`chyp.proofcache`), so steps that haven't changed since the last run
+are not checked again.
+
+Nothing here imports Qt or the layout code.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+from . import matcher, parser, proofcache, trace
+from .state import RewriteState, State
+
+STATUS_NAMES = {
+    RewriteState.UNCHECKED: 'unchecked',
+    RewriteState.CHECKING: 'checking',
+    RewriteState.VALID: 'valid',
+    RewriteState.INVALID: 'invalid',
+}
+
+@dataclass
+class StepResult:
+    """The outcome of checking a single rewrite step
+
+    Line numbers are 0-based, as elsewhere in chyp, and `time` is the time spent in `RewriteState.check`,
+    in seconds.
+    """
+    file_name: str
+    name: str
+    line: int
+    status: int
+    time: float
+    errors: List[Tuple[str, int, str]] = field(default_factory=list)
+
+    def to_json(self) -> Dict:
+        return {
+            'file': self.file_name,
+            'step': self.name,
+            'line': self.line,
+            'status': STATUS_NAMES[self.status],
+            'time': self.time,
+            'errors': [{'file': f, 'line': l, 'message': msg} for f, l, msg in self.errors],
+        }
+
+# parsed files, kept per process so each worker only parses a file once
+_states: Dict[str, State] = dict()
+
+def load_file(file_name: str) -> State:
+    """Parse the given file, or return the state from an earlier call in this process"""
+    if file_name not in _states:
+        with open(file_name) as f:
+            code = f.read()
+        _states[file_name] = parser.parse(code, file_name)
+    return _states[file_name]
+
+def steps(state: State) -> List[str]:
+    """Return the names of the rewrite steps in `state` that can be checked"""
+    return [name for name, rw in state.rewrites.items() if not rw.stub]
+
+def check_step(file_name: str, name: str) -> StepResult:
+    """Check a single rewrite step of the given file
+
+    This is the unit of work sent to worker processes.
+    """
+    state = load_file(file_name)
+    rw = state.rewrites[name]
+    num_errors = len(state.errors)
+    start = time.perf_counter()
+    with trace.span('step', file=file_name, step=name, line=rw.line_number + 1):
+        rw.check()
+    elapsed = time.perf_counter() - start
+    return StepResult(file_name, name, rw.line_number, rw.status, elapsed, state.errors[num_errors:])
+
+def init_worker(cache_dir: Optional[str]) -> None:
+    """Set up the proof cache in a worker process the same way as in the parent"""
+    if cache_dir: proofcache.enable(cache_dir)
+    else: proofcache.disable()
+
+def check_files(file_names: List[str], jobs: Optional[int] = None) -> Tuple[List[Tuple[str, int, str]], List[StepResult]]:
+    """Check all of the rewrite steps in the given files
+
+    Returns the list of errors found while parsing, and the results of every rewrite step, in the order the
+    steps appear in each file. If `jobs` is 1, steps are checked in this process, otherwise they are
+    checked on a pool of `jobs` processes (by default, one per CPU).
+    """
+    parse_errors: List[Tuple[str, int, str]] = []
+    tasks: List[Tuple[str, str]] = []
+    for file_name in file_names:
+        state = load_file(file_name)
+        parse_errors += state.errors
+        tasks += [(file_name, name) for name in steps(state)]
+
+    if jobs == 1 or len(tasks) <= 1:
+        return parse_errors, [check_step(f, name) for f, name in tasks]
+
+    cache_dir = proofcache.cache.directory if proofcache.cache else None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cache_dir,)) as pool:
+        results = list(pool.map(check_step, [f for f, _ in tasks], [name for _, name in tasks]))
+    return parse_errors, results
+
+def main(args: Optional[List[str]] = None) -> int:
+    """Entry point for `chyp check`. Returns the exit code."""
+    arg_parser = argparse.ArgumentParser(prog='chyp check', description='Check all proofs in the given files.')
+    arg_parser.add_argument('files', nargs='+', metavar='FILE', help='files to check')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='number of worker processes (default: one per CPU)')
+    arg_parser.add_argument('--json', action='store_true',
+                            help='print one JSON object per rewrite step instead of a summary')
+    arg_parser.add_argument('--cache-dir', default='',
+                            help=f'directory for cached results (default: {proofcache.default_dir()})')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='check every step, without reading or writing cached results')
+    arg_parser.add_argument('--match-stats', action='store_true',
+                            help='print matching statistics for each rule (checks steps in this process)')
+    arg_parser.add_argument('--trace', metavar='FILE',
+                            help='save a Chrome trace of parsing and checking to FILE and print a flat profile '
+                                 '(checks steps in this process)')
+    opts = arg_parser.parse_args(args)
+
+    if opts.no_cache: proofcache.disable()
+    else: proofcache.enable(opts.cache_dir)
+
+    # statistics and traces are collected per process, so they need the steps to be checked here
+    if opts.match_stats:
+        matcher.enable_stats()
+        opts.jobs = 1
+    if opts.trace:
+        trace.enable()
+        opts.jobs = 1
+
+    start = time.perf_counter()
+    parse_errors, results = check_files([os.path.abspath(f) for f in opts.files], opts.jobs)
+    elapsed = time.perf_counter() - start
+
+    invalid = [r for r in results if r.status != RewriteState.VALID]
+    if opts.json:
+        for f, l, msg in parse_errors:
+            print(json.dumps({'file': f, 'line': l, 'status': 'error', 'message': msg}))
+        for r in results:
+            print(json.dumps(r.to_json()))
+    else:
+        for f, l, msg in parse_errors:
+            print(f'{f}:{l + 1}: error: {msg}')
+        for r in results:
+            print(f'{r.file_name}:{r.line + 1}: {r.name}: {STATUS_NAMES[r.status]} ({r.time:.3f}s)')
+            for f, l, msg in r.errors:
+                print(f'  {f}:{l + 1}: {msg}')
+        print(f'{len(results) - len(invalid)}/{len(results)} steps valid, '
+              f'{len(parse_errors)} parse errors ({elapsed:.3f}s)')
+
+    if matcher.match_stats is not None:
+        print(matcher.format_stats(matcher.match_stats), file=sys.stderr if opts.json else sys.stdout)
+    if opts.trace:
+        trace.write_chrome_trace(opts.trace)
+        print(trace.format_profile(), file=sys.stderr if opts.json else sys.stdout)
+
+    return 1 if parse_errors or invalid else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+#     chyp - An interactive theorem prover for string diagrams 
+#     Copyright (C) 2022 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+
+def main() -> None:
+    """Main entry point for chyp
+
+    `chyp check FILE...` checks proofs from the command line (see
+    :mod:`chyp.check`). Anything else starts the GUI. The GUI is only imported
+    when needed, so checking doesn't require Qt.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        from . import check
+        sys.exit(check.main(sys.argv[2:]))
+    else:
+        from .gui import app
+        app.main()
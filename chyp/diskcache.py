@@ -0,0 +1,104 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the on-disk caches in :mod:`chyp.layout` and :mod:`chyp.proofcache`
+
+Both caches store graphs as JSON, in a directory under the user's cache directory, and write each entry
+atomically so several processes can share a cache.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict
+import json
+import os
+import tempfile
+
+from .graph import Graph, Point
+
+def cache_dir(name: str) -> str:
+    """Return the directory for the cache called `name`, following the XDG base directory convention"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'chyp', name)
+
+def graph_to_json(g: Graph, drawing: bool = False) -> Dict[str, Any]:
+    """Serialise a graph
+
+    If `drawing` is False, this only keeps the parts of the graph that matter for checking. Otherwise, it also
+    keeps the coordinates (which are all 0 if the graph has not been laid out), colours and `hyper` flags.
+    """
+    if not drawing:
+        return {
+            'vertices': [[v, vd.vtype, vd.size] for v, vd in g.vdata.items()],
+            'edges': [[e, ed.s, ed.t, ed.value] for e, ed in g.edata.items()],
+            'inputs': g.inputs(),
+            'outputs': g.outputs(),
+        }
+
+    vpos = g.geometry.vpos if g.geometry else {}
+    epos = g.geometry.epos if g.geometry else {}
+    origin = Point()
+    return {
+        'vertices': [[v, vd.vtype, vd.size, vpos.get(v, origin).x, vpos.get(v, origin).y]
+                     for v, vd in g.vdata.items()],
+        'edges': [[e, ed.s, ed.t, ed.value, epos.get(e, origin).x, epos.get(e, origin).y, ed.fg, ed.bg, ed.hyper]
+                  for e, ed in g.edata.items()],
+        'inputs': g.inputs(),
+        'outputs': g.outputs(),
+    }
+
+def graph_from_json(j: Dict[str, Any]) -> Graph:
+    """Rebuild a graph serialised with :func:`graph_to_json`, with or without its drawing data
+
+    The coordinates are only kept if some of them are non-zero, so graphs that were never laid out don't
+    get a geometry.
+    """
+    g = Graph()
+    vpos: Dict[int, Point] = dict()
+    epos: Dict[int, Point] = dict()
+    for v, vtype, size, *xy in j['vertices']:
+        g.add_vertex(vtype=vtype, size=size, name=v)
+        if any(xy): vpos[v] = Point(*xy)
+    for e, s, t, value, *drawing in j['edges']:
+        if drawing:
+            x, y, fg, bg, hyper = drawing
+            g.add_edge(s, t, value, fg, bg, hyper, name=e)
+            if x or y: epos[e] = Point(x, y)
+        else:
+            g.add_edge(s, t, value, name=e)
+    g.set_inputs(j['inputs'])
+    g.set_outputs(j['outputs'])
+    if vpos or epos:
+        geo = g.ensure_geometry()
+        geo.vpos = vpos
+        geo.epos = epos
+    return g
+
+def write_json(path: str, data: Any) -> None:
+    """Write `data` to `path` as JSON, atomically, creating the directory if needed
+
+    The data is written to a temporary file in the same directory, which then replaces `path`, so readers
+    never see a partly written file. Raises `OSError`, `TypeError` or `ValueError` if the directory can't be
+    written or the data isn't JSON-serialisable, in which case `path` is left as it was.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
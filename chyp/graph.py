@@ -14,9 +14,9 @@
 # limitations under the License.
 
 from __future__ import annotations
-from typing import Iterable, Iterator, Any
+from typing import Callable, Iterable, Iterator, Any
 from typing import TypeAlias
-import copy
+import hashlib
 from nx_yaml import NxSafeLoader
 
 import yaml
@@ -25,11 +25,19 @@ import yaml
 # Non-default vertex types are identified by a string label
 VType: TypeAlias = str | None
 
+# The label of an edge together with the types of its inputs and outputs
+EdgeSignature: TypeAlias = tuple[Any, tuple[tuple[VType, int], ...],
+                                 tuple[tuple[VType, int], ...]]
+
 
 class GraphError(Exception):
     """An error occurred in the graph backend."""
 
 
+# The boundary indices of a vertex that is not on the boundary
+NO_INDICES: frozenset[int] = frozenset()
+
+
 class VData:
     """Data associated with a single vertex.
 
@@ -44,27 +52,31 @@ class VData:
                     Used for special generators (identities, permutations,
                     redistributers).
 
-        x: x-coordinate at which to draw the vertex.
-        y: y-coordinate at which to draw the vertex.
+        owner: Token of the :class:`Graph` allowed to modify this record
+               in-place. Records whose owner does not match are shared with
+               another graph and get copied before they are modified.
+
+    Records use `__slots__` rather than a `__dict__`, since large graphs
+    have hundreds of thousands of them. The boundary indices are frozensets,
+    which are empty for all but the boundary vertices, so most records share
+    the same empty set.
     """
+    __slots__ = ('owner', 'vtype', 'size', 'infer_type', 'infer_size',
+                 'value', 'in_edges', 'out_edges', 'in_indices', 'out_indices')
 
     def __init__(self,
                  vtype: VType = None, size: int = 1,
                  infer_type: bool = False, infer_size: bool = False,
-                 x: float = 0.0, y: float = 0.0,
-                 value: Any = None) -> None:
+                 value: Any = None, owner: object = None) -> None:
         """Initialize a VData instance."""
 
+        self.owner = owner
+
         # Graph logic attributes
         self.vtype = vtype
         self.size = size
         self.infer_type = infer_type
         self.infer_size = infer_size
-
-        # Drawing attributes
-        self.x = x
-        self.y = y
-        self.highlight = False
         self.value = value
 
         # Integer identifiers of input and output hyperedges of this vertex -
@@ -73,9 +85,28 @@ class VData:
         self.out_edges: set[int] = set()
 
         # Indices (if any) where this vertex occurs in the input and output
-        # lists of the hypergraph.
-        self.in_indices: set[int] = set()
-        self.out_indices: set[int] = set()
+        # lists of the hypergraph. These are replaced rather than modified.
+        self.in_indices: frozenset[int] = NO_INDICES
+        self.out_indices: frozenset[int] = NO_INDICES
+
+    def copy(self, owner: object = None) -> VData:
+        """Return a copy of this record, owned by `owner`.
+
+        The adjacency sets are copied, so the new record can be modified
+        without affecting this one.
+        """
+        vd = VData.__new__(VData)
+        vd.owner = owner
+        vd.vtype = self.vtype
+        vd.size = self.size
+        vd.infer_type = self.infer_type
+        vd.infer_size = self.infer_size
+        vd.value = self.value
+        vd.in_edges = self.in_edges.copy()
+        vd.out_edges = self.out_edges.copy()
+        vd.in_indices = self.in_indices
+        vd.out_indices = self.out_indices
+        return vd
 
 
 class EData:
@@ -85,37 +116,57 @@ class EData:
         sources: The source vertex list of the hyperedge.
         targets: The target vertex list of the hyperedge.
 
-        x: x-coordinate at which to draw the hyperedge.
-        y: y-coordinate at which to draw the hyperedge.
         fg: Hex code for the text and outline color of the hyperedge.
         bg: Hex code for the box fill color of the hyperedge.
         hyper: Whether to draw this hyperedge as a box or as line connecting
                two vertices (currently not implemented).
+
+        owner: Token of the :class:`Graph` allowed to modify this record
+               in-place (see :class:`VData`).
+
+    The colours and `hyper` flag are part of how a generator was declared,
+    so they stay with the edge through composition and rewriting. Positions
+    and highlighting are kept separately, in a :class:`Geometry`.
     """
+    __slots__ = ('owner', 's', 't', 'value', 'fg', 'bg', 'hyper')
 
     def __init__(self,
                  s: list[int] | None = None, t: list[int] | None = None,
                  value: Any = None,
-                 x: float = 0.0, y: float = 0.0,
                  fg: str = '', bg: str = '',
-                 hyper: bool = True) -> None:
+                 hyper: bool = True, owner: object = None) -> None:
         """Initialize an EData instance."""
 
+        self.owner = owner
+
         # Graph logic attributes
         self.s = [] if s is None else s
         self.t = [] if t is None else t
 
         # Drawing attributes
-        self.x = x
-        self.y = y
         self.fg = fg
         self.bg = bg
-        self.highlight = False
         self.hyper = hyper
         self.value = value
 
     def __repr__(self) -> str:
-        return f'Edge: {self.value} ({self.x}, {self.y})'
+        return f'Edge: {self.value}'
+
+    def copy(self, owner: object = None) -> EData:
+        """Return a copy of this record, owned by `owner`.
+
+        The source and target lists are copied, so the new record can be
+        modified without affecting this one.
+        """
+        ed = EData.__new__(EData)
+        ed.owner = owner
+        ed.s = self.s.copy()
+        ed.t = self.t.copy()
+        ed.value = self.value
+        ed.fg = self.fg
+        ed.bg = self.bg
+        ed.hyper = self.hyper
+        return ed
 
     def box_size(self) -> int:
         """Return how many width 'units' this box needs to display nicely.
@@ -128,6 +179,86 @@ class EData:
         return 1 if len(self.s) <= 1 and len(self.t) <= 1 else 2
 
 
+class Point:
+    """A position at which to draw a vertex or edge."""
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x: float = 0.0, y: float = 0.0) -> None:
+        self.x = x
+        self.y = y
+
+    def copy(self) -> Point:
+        return Point(self.x, self.y)
+
+
+class Geometry:
+    """Drawing data for a graph: where to draw it, and what to highlight.
+
+    Only graphs that are displayed need this, so it is kept out of the
+    `VData` and `EData` records, and a graph only gets one once something
+    is laid out or highlighted (see :func:`Graph.ensure_geometry`). Graphs
+    built and rewritten while checking proofs never pay for coordinates.
+
+    Vertices and edges without a position are drawn at the origin. Entries
+    for vertices and edges that are no longer in the graph are ignored, so
+    removing them (or undoing their removal) leaves the geometry as it is.
+
+    Attributes:
+        vpos: Mapping from vertex identifiers to their positions.
+        epos: Mapping from edge identifiers to their positions.
+        vhighlight: The vertices to highlight, e.g. by drawing them in bold.
+        ehighlight: The edges to highlight.
+    """
+    __slots__ = ('vpos', 'epos', 'vhighlight', 'ehighlight')
+
+    def __init__(self) -> None:
+        self.vpos: dict[int, Point] = {}
+        self.epos: dict[int, Point] = {}
+        self.vhighlight: set[int] = set()
+        self.ehighlight: set[int] = set()
+
+    def copy(self) -> Geometry:
+        """Return a copy of the geometry, which can be modified independently."""
+        geo = Geometry()
+        geo.vpos = {v: p.copy() for v, p in self.vpos.items()}
+        geo.epos = {e: p.copy() for e, p in self.epos.items()}
+        geo.vhighlight = self.vhighlight.copy()
+        geo.ehighlight = self.ehighlight.copy()
+        return geo
+
+    def vertex(self, v: int) -> Point:
+        """Return the (modifiable) position of vertex `v`."""
+        p = self.vpos.get(v)
+        if p is None:
+            p = self.vpos[v] = Point()
+        return p
+
+    def edge(self, e: int) -> Point:
+        """Return the (modifiable) position of edge `e`."""
+        p = self.epos.get(e)
+        if p is None:
+            p = self.epos[e] = Point()
+        return p
+
+    def get_vertex(self, v: int) -> Point:
+        """Return the position of vertex `v`, without adding it if it has none.
+
+        Unlike :func:`vertex`, this doesn't change the geometry, so it can be
+        used to read the geometry of a graph that shouldn't be modified. The
+        point returned shouldn't be modified either.
+        """
+        p = self.vpos.get(v)
+        return p if p is not None else Point()
+
+    def get_edge(self, e: int) -> Point:
+        """Return the position of edge `e`, without adding it if it has none.
+
+        See :func:`get_vertex`.
+        """
+        p = self.epos.get(e)
+        return p if p is not None else Point()
+
+
 class Graph:
     """A hypergraph with boundaries.
 
@@ -135,39 +266,239 @@ class Graph:
     hypergraph (which we call simply a "graph") as two dictionaries for
     vertices and (hyper)edges, respectively. Each vertex is associated with a
     `VData` object and edge edge with an `EData` object, which stores
-    information about adjacency, position, label, etc.
+    information about adjacency, label, etc.
 
     The particular flavor of hypergraphs we use associate to each hyperedge a
     list of source vertices and a list of target vertices. The hypergraph
     itself also has a list of input vertices and a list of output vertices,
     which are used for sequential composition and rewriting.
 
+    Copies are cheap: :func:`copy` shares the vertex and edge dictionaries,
+    as well as the `VData` and `EData` records they contain, with the new
+    graph. A dictionary is only copied the first time one of the graphs adds
+    or removes an element, and a record is only copied the first time one of
+    the graphs modifies it. For this reason, records read via `vdata` and
+    `edata` should be treated as read-only. Use :func:`vertex_data` and
+    :func:`edge_data` to get records that can be modified.
+
     Attributes:
         vdata: Mapping from integer identifiers of each vertex to its data.
         edata: Mapping from integer identifiers of each hyperedge to its data.
-        vindex:
-        eindex:
+        vindex: The next free vertex identifier.
+        eindex: The next free edge identifier.
+        geometry: Positions and highlighting for drawing the graph, or None
+                  if it has never been laid out or highlighted.
     """
 
     def __init__(self) -> None:
-        self.vdata: dict[int, VData] = {}
-        self.edata: dict[int, EData] = {}
+        self._vdata: dict[int, VData] = {}
+        self._edata: dict[int, EData] = {}
+        # Whether `_vdata`/`_edata` may be referenced by another graph.
+        self._shared = False
+        # Records whose `owner` is this token can be modified in-place.
+        self._token = object()
         self._inputs: list[int] = []
         self._outputs: list[int] = []
         self.vindex = 0
         self.eindex = 0
+        # Indices computed on demand from the current structure. These are
+        # never modified in-place, so copies can share them.
+        self._edge_index: dict[EdgeSignature, list[int]] | None = None
+        self._reach: tuple[dict[int, int], dict[int, int]] | None = None
+        self._hash: int | None = None
+        self._canon: tuple[list[int], list[int]] | None = None
+        # Values computed from the structure by other modules (see
+        # :func:`cached`). These aren't shared with copies.
+        self._cache: dict[str, Any] | None = None
+        # Changes made since the first call to `checkpoint`, or None if
+        # changes aren't being recorded (see :func:`undo`).
+        self._journal: list[tuple[int, int, Any]] | None = None
+        self.geometry: Geometry | None = None
 
     def copy(self) -> Graph:
-        """Return a copy of the graph."""
+        """Return a copy of the graph.
+
+        This takes constant time (up to copying the boundary lists and the
+        geometry, if any). The vertex and edge data are shared between the
+        two graphs until either of them is modified.
+        """
         g = Graph()
-        g.vdata = copy.deepcopy(self.vdata)
-        g.edata = copy.deepcopy(self.edata)
+        g._vdata = self._vdata
+        g._edata = self._edata
+        g._shared = self._shared = True
+        # Give up ownership of all records, since `g` now references them.
+        self._token = object()
         g._inputs = self._inputs.copy()
         g._outputs = self._outputs.copy()
         g.vindex = self.vindex
         g.eindex = self.eindex
+        g._edge_index = self._edge_index
+        g._reach = self._reach
+        g._hash = self._hash
+        g._canon = self._canon
+        if self.geometry is not None:
+            g.geometry = self.geometry.copy()
         return g
 
+    def __deepcopy__(self, memo: dict[int, Any]) -> Graph:
+        """Return a copy of the graph for :func:`copy.deepcopy`.
+
+        Records are copied before either graph modifies them, so a copy made
+        by :meth:`copy` is already independent of this graph.
+        """
+        return self.copy()
+
+    def is_copy_of(self, other: Graph) -> bool:
+        """Return whether this graph is an unmodified copy of `other`.
+
+        This takes constant time (up to comparing the boundary lists). It
+        can return False for graphs that happen to be equal, but if it
+        returns True, the two graphs have the same vertices, edges and
+        boundaries, with the same identifiers.
+
+        Args:
+            other: The graph to compare with.
+        """
+        return (self is other or
+                (self._vdata is other._vdata and
+                 self._edata is other._edata and
+                 self._inputs == other._inputs and
+                 self._outputs == other._outputs))
+
+    @property
+    def vdata(self) -> dict[int, VData]:
+        """Mapping from vertex identifiers to (read-only) vertex data."""
+        return self._vdata
+
+    @property
+    def edata(self) -> dict[int, EData]:
+        """Mapping from edge identifiers to (read-only) edge data."""
+        return self._edata
+
+    def _invalidate(self) -> None:
+        """Drop any indices computed from the current structure."""
+        self._edge_index = None
+        self._reach = None
+        self._hash = None
+        self._canon = None
+        self._cache = None
+
+    def _unshare(self) -> None:
+        """Prepare the vertex and edge dictionaries to be modified.
+
+        This copies the dictionaries if they might be referenced by another
+        graph.
+        """
+        self._invalidate()
+        if self._shared:
+            self._vdata = self._vdata.copy()
+            self._edata = self._edata.copy()
+            self._shared = False
+
+    def _own_vertex(self, v: int) -> VData:
+        """Return the data of vertex `v`, copying it first if it is shared."""
+        self._invalidate()
+        vd = self._vdata[v]
+        if vd.owner is not self._token:
+            self._unshare()
+            self._record(True, v)
+            vd = vd.copy(self._token)
+            self._vdata[v] = vd
+        return vd
+
+    def _own_edge(self, e: int) -> EData:
+        """Return the data of edge `e`, copying it first if it is shared."""
+        self._invalidate()
+        ed = self._edata[e]
+        if ed.owner is not self._token:
+            self._unshare()
+            self._record(False, e)
+            ed = ed.copy(self._token)
+            self._edata[e] = ed
+        return ed
+
+    def _record(self, is_vertex: bool, x: int) -> None:
+        """Journal the current record of vertex or edge `x` before it is replaced or removed."""
+        if self._journal is not None:
+            d: dict[int, Any] = self._vdata if is_vertex else self._edata
+            self._journal.append((0 if is_vertex else 1, x, d.get(x)))
+
+    def checkpoint(self) -> int:
+        """Start recording changes, so they can be undone later.
+
+        The graph can then be modified in-place, e.g. by
+        :func:`chyp.rewrite.dpo` with `in_place=True`, and restored to its
+        current state by passing the returned mark to :func:`undo`. This
+        is much cheaper than copying the graph before each modification when
+        trying out several modifications in turn. Checkpoints can be nested,
+        and changes are recorded until :func:`commit` is called.
+        """
+        if self._journal is None:
+            self._journal = []
+        mark = len(self._journal)
+        self._journal.append((2, mark, (
+            self._inputs.copy(), self._outputs.copy(),
+            self.vindex, self.eindex,
+            self._edge_index, self._reach, self._hash, self._canon)))
+        # Give up ownership of all records, so they are copied before being
+        # modified and the originals can be put back by `undo`.
+        self._token = object()
+        return mark
+
+    def undo(self, mark: int) -> None:
+        """Undo all the changes made since :func:`checkpoint` returned `mark`.
+
+        The checkpoint itself is kept, so the graph can be modified and
+        restored again, as well as any checkpoints made before it. Copies
+        of the graph made since the checkpoint are not affected.
+
+        Args:
+            mark: A value returned by :func:`checkpoint` since the last call
+                  to :func:`commit`.
+        """
+        if (self._journal is None or mark >= len(self._journal) or
+                self._journal[mark][0] != 2):
+            raise GraphError('Attempting to undo to an unknown checkpoint.')
+        self._unshare()
+        while len(self._journal) > mark + 1:
+            kind, x, old = self._journal.pop()
+            if kind == 2:
+                continue
+            d: dict[int, Any] = self._vdata if kind == 0 else self._edata
+            if old is None:
+                del d[x]
+            else:
+                d[x] = old
+        (inputs, outputs, self.vindex, self.eindex, self._edge_index,
+         self._reach, self._hash, self._canon) = self._journal[mark][2]
+        self._inputs = inputs.copy()
+        self._outputs = outputs.copy()
+        self._token = object()
+
+    def commit(self) -> None:
+        """Stop recording changes and forget all checkpoints."""
+        self._journal = None
+
+    def cached(self, key: str, compute: Callable[[Graph], Any]) -> Any:
+        """Return `compute(self)`, computing it at most once until the graph is modified.
+
+        This lets other modules attach their own indices to a graph, e.g. the
+        search plans used by the matcher. Unlike the indices the graph
+        computes itself, these aren't shared with copies, since they may be
+        filled in lazily from the graph they were computed for, which can
+        then be modified independently of its copies.
+
+        Args:
+            key: A name for the value, distinct from those used for other
+                 kinds of values.
+            compute: A function computing the value from the graph.
+        """
+        if self._cache is None:
+            self._cache = {}
+        if key not in self._cache:
+            self._cache[key] = compute(self)
+        return self._cache[key]
+
     def vertices(self) -> Iterator[int]:
         """Return an iterator over the vertices in the graph."""
         return iter(self.vdata.keys())
@@ -190,8 +521,8 @@ class Graph:
         This consists of a list of pairs (vertex type, register size)
         corresponding to each input vertex.
         """
-        domain = [(self.vertex_data(vertex).vtype,
-                   self.vertex_data(vertex).size)
+        domain = [(self._vdata[vertex].vtype,
+                   self._vdata[vertex].size)
                   for vertex in self.inputs()]
         return domain
 
@@ -201,26 +532,40 @@ class Graph:
         This consists of a list of pairs (vertex type, register size)
         corresponding to each output vertex.
         """
-        codomain = [(self.vertex_data(vertex).vtype,
-                     self.vertex_data(vertex).size)
+        codomain = [(self._vdata[vertex].vtype,
+                     self._vdata[vertex].size)
                     for vertex in self.outputs()]
         return codomain
 
     def vertex_data(self, v: int) -> VData:
         """Return the :class:`VData` associated with vertex id `v`.
 
+        The returned record belongs to this graph and can be modified. If it
+        is still shared with a copy of this graph, it is copied first. The
+        indices cached on the graph are not updated when the record is
+        modified, so use :attr:`vdata` to read vertex data and the methods
+        of the graph to change its structure.
+
         Args:
             v: Integer identifier of the vertex.
         """
-        return self.vdata[v]
+        vd = self._vdata[v]
+        return vd if vd.owner is self._token else self._own_vertex(v)
 
     def edge_data(self, e: int) -> EData:
         """Return the :class:`EData` associated with edge id `e`.
 
+        The returned record belongs to this graph and can be modified. If it
+        is still shared with a copy of this graph, it is copied first. The
+        indices cached on the graph are not updated when the record is
+        modified, so use :attr:`edata` to read edge data and the methods of
+        the graph to change its structure.
+
         Args:
             e: Integer identifier of the edge.
         """
-        return self.edata[e]
+        ed = self._edata[e]
+        return ed if ed.owner is self._token else self._own_edge(e)
 
     def edge_domain(self, edge_id: int) -> list[tuple[VType, int]]:
         """Return the domain of edge with id `edge_id`.
@@ -232,8 +577,8 @@ class Graph:
             edge_id: Integer identifier of the edge
                      whose domain will be returned.
         """
-        domain = [(self.vertex_data(vertex).vtype,
-                   self.vertex_data(vertex).size)
+        domain = [(self._vdata[vertex].vtype,
+                   self._vdata[vertex].size)
                   for vertex in self.source(edge_id)]
         return domain
 
@@ -247,18 +592,51 @@ class Graph:
             edge_id: Integer identifier of the edge
                      whose codomain will be returned.
         """
-        codomain = [(self.vertex_data(vertex).vtype,
-                     self.vertex_data(vertex).size)
+        codomain = [(self._vdata[vertex].vtype,
+                     self._vdata[vertex].size)
                     for vertex in self.target(edge_id)]
         return codomain
 
+    def edge_signature(self, e: int) -> EdgeSignature:
+        """Return the signature of edge with id `e`.
+
+        This consists of the label of the edge together with its domain and
+        codomain. A match can only send an edge to an edge with the same
+        signature.
+
+        Args:
+            e: Integer identifier of the edge.
+        """
+        ed = self._edata[e]
+        return (ed.value,
+                tuple((self._vdata[v].vtype, self._vdata[v].size)
+                      for v in ed.s),
+                tuple((self._vdata[v].vtype, self._vdata[v].size)
+                      for v in ed.t))
+
+    def edges_with_signature(self, sig: EdgeSignature) -> list[int]:
+        """Return the list of edge ids whose signature is `sig`.
+
+        The edges are indexed by signature the first time this is called
+        after the graph is modified, so subsequent calls are cheap.
+
+        Args:
+            sig: An edge signature, as returned by :func:`edge_signature`.
+        """
+        if self._edge_index is None:
+            index: dict[EdgeSignature, list[int]] = dict()
+            for e in self._edata:
+                index.setdefault(self.edge_signature(e), []).append(e)
+            self._edge_index = index
+        return self._edge_index.get(sig, [])
+
     def in_edges(self, v: int) -> set[int]:
         """Return the set of edge ids for which vertex id `v` is a target.
 
         Args:
             v: Integer identifier of the vertex.
         """
-        return self.vdata[v].in_edges
+        return self._vdata[v].in_edges
 
     def out_edges(self, v: int) -> set[int]:
         """Return the set of edge ids for which vertex id `v` is a source.
@@ -266,7 +644,7 @@ class Graph:
         Args:
             v: Integer identifier of the vertex.
         """
-        return self.vdata[v].out_edges
+        return self._vdata[v].out_edges
 
     def source(self, e: int) -> list[int]:
         """Return the list of source vertex ids of edge with id `e`.
@@ -274,7 +652,7 @@ class Graph:
         Args:
             e: Integer identifier of the edge.
         """
-        return self.edata[e].s
+        return self._edata[e].s
 
     def target(self, e: int) -> list[int]:
         """Return the list of target vertex ids of edge with id `e`.
@@ -282,12 +660,11 @@ class Graph:
         Args:
             e: Integer identifier of the edge.
         """
-        return self.edata[e].t
+        return self._edata[e].t
 
     def add_vertex(self,
                    vtype: VType = None, size: int = 1,
                    infer_type: bool = False, infer_size: bool = False,
-                   x: float = 0.0, y: float = 0.0,
                    value: Any = '', name: int = -1) -> int:
         """Add a new vertex to the graph.
 
@@ -302,9 +679,6 @@ class Graph:
                         Used for special generators (identities, permutations,
                         redistributers).
 
-            x: x-coordinate at which to draw the vertex.
-            y: y-coordinate at which to draw the vertex.
-
             value: The value carried by this vertex (currently unused).
             name: The integer identifier to use for this vertex. If this is
                   set to -1, the identifier is set automatically.
@@ -319,16 +693,17 @@ class Graph:
             max_index = max(name, self.vindex)
             self.vindex = max_index + 1
 
-        self.vdata[v] = VData(
+        self._unshare()
+        self._record(True, v)
+        self._vdata[v] = VData(
             vtype=vtype, size=size,
             infer_type=infer_type, infer_size=infer_size,
-            x=x, y=y, value=value
+            value=value, owner=self._token
         )
         return v
 
     def add_edge(self,
                  s: list[int], t: list[int], value: Any = '',
-                 x: float = 0.0, y: float = 0.0,
                  fg: str = '', bg: str = '',
                  hyper: bool = True, name: int = -1) -> int:
         """Add a new hyperedge to the graph.
@@ -338,8 +713,6 @@ class Graph:
         t: A list of target vertex ids.
         value: The value carried by this edge (currently unused).
 
-        x: x-coordinate at which to draw the hyperedge.
-        y: y-coordinate at which to draw the hyperedge.
         fg: Hex code for the text and outline color of the hyperedge.
         bg: Hex code for the box fill color of the hyperedge.
         hyper: Whether to draw this hyperedge as a box or as line connecting
@@ -358,11 +731,13 @@ class Graph:
             max_index = max(name, self.eindex)
             self.eindex = max_index + 1
 
-        self.edata[e] = EData(s, t, value, x, y, fg, bg, hyper)
+        self._unshare()
+        self._record(False, e)
+        self._edata[e] = EData(s, t, value, fg, bg, hyper, self._token)
         for v in s:
-            self.vdata[v].out_edges.add(e)
+            self._own_vertex(v).out_edges.add(e)
         for v in t:
-            self.vdata[v].in_edges.add(e)
+            self._own_vertex(v).in_edges.add(e)
         return e
 
     def remove_vertex(self, v: int, strict: bool = False) -> None:
@@ -381,23 +756,27 @@ class Graph:
                     and not be a boundary vertex.
         """
         if strict:
-            if (len(self.vertex_data(v).in_edges) > 0 or
-               len(self.vertex_data(v).out_edges) > 0):
+            if (len(self._vdata[v].in_edges) > 0 or
+               len(self._vdata[v].out_edges) > 0):
                 raise ValueError('Attempting to remove vertex with adjacent'
                                  + 'edges while strict == True.')
             if (v in self.inputs() or v in self.outputs()):
                 raise ValueError('Attempting to remove boundary vertex while'
                                  + 'strict == True.')
         else:
-            for e in self.vertex_data(v).in_edges:
-                self.edge_data(e).t = [v1 for v1 in self.edge_data(e).t
-                                       if v1 != v]
-            for e in self.vertex_data(v).out_edges:
-                self.edge_data(e).s = [v1 for v1 in self.edge_data(e).s
-                                       if v1 != v]
-            self.set_inputs([v1 for v1 in self.inputs() if v1 != v])
-            self.set_outputs([v1 for v1 in self.outputs() if v1 != v])
-        del self.vdata[v]
+            for e in self._vdata[v].in_edges:
+                ed = self._own_edge(e)
+                ed.t = [v1 for v1 in ed.t if v1 != v]
+            for e in self._vdata[v].out_edges:
+                ed = self._own_edge(e)
+                ed.s = [v1 for v1 in ed.s if v1 != v]
+            if self.is_input(v):
+                self.set_inputs([v1 for v1 in self.inputs() if v1 != v])
+            if self.is_output(v):
+                self.set_outputs([v1 for v1 in self.outputs() if v1 != v])
+        self._unshare()
+        self._record(True, v)
+        del self._vdata[v]
 
     def remove_edge(self, e: int) -> None:
         """Remove an edge from the graph.
@@ -405,11 +784,14 @@ class Graph:
         Args:
             e: Integer identifier of the edge to remove.
         """
-        for v in self.edge_data(e).s:
-            self.vertex_data(v).out_edges.remove(e)
-        for v in self.edge_data(e).t:
-            self.vertex_data(v).in_edges.remove(e)
-        del self.edata[e]
+        ed = self._edata[e]
+        for v in ed.s:
+            self._own_vertex(v).out_edges.discard(e)
+        for v in ed.t:
+            self._own_vertex(v).in_edges.discard(e)
+        self._unshare()
+        self._record(False, e)
+        del self._edata[e]
 
     # def add_simple_edge(self, s:int, t:int, value: Any="") -> int:
     #     e = self.add_edge([s], [t], value, hyper=False)
@@ -427,8 +809,8 @@ class Graph:
         self._inputs += inp
         # Register the input indices with the vertex data instances.
         for i in range(i1, i2):
-            v = self._inputs[i]
-            self.vdata[v].in_indices.add(i)
+            vd = self._own_vertex(self._inputs[i])
+            vd.in_indices = vd.in_indices | {i}
 
     def add_outputs(self, outp: list[int]) -> None:
         """Append `outp` to the outputs of the graph.
@@ -442,8 +824,8 @@ class Graph:
         self._outputs += outp
         # Register the output indices with the vertex data instances.
         for i in range(i1, i2):
-            v = self._outputs[i]
-            self.vdata[v].out_indices.add(i)
+            vd = self._own_vertex(self._outputs[i])
+            vd.out_indices = vd.out_indices | {i}
 
     def set_inputs(self, inp: list[int]) -> None:
         """Set the inputs of the graph to `inp`.
@@ -451,12 +833,15 @@ class Graph:
         Args:
             inp: The list of vertex integer identifiers of the new inputs.
         """
+        # Only the current inputs have input indices to clear.
+        for v in self._inputs:
+            if v in self._vdata and self._vdata[v].in_indices:
+                self._own_vertex(v).in_indices = NO_INDICES
         self._inputs = inp
-        for d in self.vdata.values():
-            d.in_indices.clear()
         # Register the input indices with the vertex data instances.
         for i, v in enumerate(self._inputs):
-            self.vdata[v].in_indices.add(i)
+            vd = self._own_vertex(v)
+            vd.in_indices = vd.in_indices | {i}
 
     def set_outputs(self, outp: list[int]) -> None:
         """Set the outputs of the graph to `outp`.
@@ -464,12 +849,15 @@ class Graph:
         Args:
             outp: The list of vertex integer identifiers of the new outputs.
         """
+        # Only the current outputs have output indices to clear.
+        for v in self._outputs:
+            if v in self._vdata and self._vdata[v].out_indices:
+                self._own_vertex(v).out_indices = NO_INDICES
         self._outputs = outp
-        for d in self.vdata.values():
-            d.out_indices.clear()
         # Register the output indices with the vertex data instances.
         for i, v in enumerate(self._outputs):
-            self.vdata[v].out_indices.add(i)
+            vd = self._own_vertex(v)
+            vd.out_indices = vd.out_indices | {i}
 
     def inputs(self) -> list[int]:
         """Return the list of vertex ids of the graph inputs."""
@@ -485,7 +873,7 @@ class Graph:
         Args:
             v: Integer identifier of the vertex to check.
         """
-        return len(self.vdata[v].in_indices) > 0
+        return len(self._vdata[v].in_indices) > 0
 
     def is_output(self, v: int) -> bool:
         """Return whether vertex id `v` is in the graph outputs.
@@ -493,7 +881,7 @@ class Graph:
         Args:
             v: Integer identifier of the vertex to check.
         """
-        return len(self.vdata[v].out_indices) > 0
+        return len(self._vdata[v].out_indices) > 0
 
     def is_boundary(self, v: int) -> bool:
         """Return whether vertex id `v` lies on the graph boundary.
@@ -520,6 +908,236 @@ class Graph:
                         current.append(v1)
         return succ
 
+    def _reachability(self) -> tuple[dict[int, int], dict[int, int]]:
+        """Return the transitive closure of the graph as bitsets.
+
+        This returns a pair of dictionaries. The first assigns each vertex a
+        distinct bit and the second maps each vertex to the bitwise OR of the
+        bits of its successors (in the sense of :func:`successors`). It is
+        computed the first time it is needed after the graph is modified.
+        """
+        if self._reach is None:
+            bit = {v: 1 << i for i, v in enumerate(self._vdata)}
+            succ = {v: {w for e in vd.out_edges for w in self._edata[e].t}
+                    for v, vd in self._vdata.items()}
+
+            # Sort the vertices topologically
+            indegree = dict.fromkeys(succ, 0)
+            for ws in succ.values():
+                for w in ws:
+                    indegree[w] += 1
+            order = [v for v, d in indegree.items() if d == 0]
+            for v in order:
+                for w in succ[v]:
+                    indegree[w] -= 1
+                    if indegree[w] == 0:
+                        order.append(w)
+
+            reach: dict[int, int] = dict()
+            # Vertices on or after a directed cycle can't be sorted, so
+            # find their successors by traversal instead.
+            if len(order) < len(succ):
+                placed = set(order)
+                for v in succ:
+                    if v not in placed:
+                        reach[v] = sum(bit[w] for w in self.successors([v]))
+
+            # Every other vertex only depends on vertices later in the order
+            for v in reversed(order):
+                r = 0
+                for w in succ[v]:
+                    r |= bit[w] | reach[w]
+                reach[v] = r
+            self._reach = (bit, reach)
+        return self._reach
+
+    def reaches(self, vs: Iterable[int], ws: Iterable[int]) -> bool:
+        """Return whether any of `ws` lies on a directed path from any of `vs`.
+
+        This is equivalent to checking whether any of `ws` is in
+        `successors(vs)`, but uses the transitive closure of the graph, which
+        is computed once and reused until the graph is modified.
+
+        Args:
+            vs: Integer identifiers of the vertices to start from.
+            ws: Integer identifiers of the vertices to look for.
+        """
+        bit, reach = self._reachability()
+        r = 0
+        for v in vs:
+            r |= reach[v]
+        return any(r & bit[w] for w in ws)
+
+    def _traverse_from_boundary(self) -> tuple[list[int], list[int]] | None:
+        """Number the vertices and edges by a traversal from the boundary.
+
+        The traversal starts with the inputs and then the outputs, in order.
+        From each vertex it visits its in-edge and then its out-edge, and
+        from each edge its sources and then its targets, in order. If every
+        vertex has at most one in-edge and at most one out-edge, which is
+        always the case for monogamous graphs, every step is determined by
+        the structure of the graph, so isomorphic graphs get numbered the
+        same way. This returns the vertices and the edges in the order they
+        were visited, or None if some vertex has more than one in-edge or
+        out-edge, or some part of the graph can't be reached from the
+        boundary.
+        """
+        vdata, edata = self._vdata, self._edata
+        vorder: list[int] = []
+        eorder: list[int] = []
+        vseen: set[int] = set()
+        eseen: set[int] = set()
+        for v in self._inputs + self._outputs:
+            if v not in vseen:
+                vseen.add(v)
+                vorder.append(v)
+
+        i = j = 0
+        while True:
+            while i < len(vorder):
+                vd = vdata[vorder[i]]
+                i += 1
+                in_edges, out_edges = vd.in_edges, vd.out_edges
+                if len(in_edges) > 1 or len(out_edges) > 1:
+                    return None
+                for e in in_edges:
+                    if e not in eseen:
+                        eseen.add(e)
+                        eorder.append(e)
+                for e in out_edges:
+                    if e not in eseen:
+                        eseen.add(e)
+                        eorder.append(e)
+            if j == len(eorder):
+                break
+            while j < len(eorder):
+                ed = edata[eorder[j]]
+                j += 1
+                for v in ed.s:
+                    if v not in vseen:
+                        vseen.add(v)
+                        vorder.append(v)
+                for v in ed.t:
+                    if v not in vseen:
+                        vseen.add(v)
+                        vorder.append(v)
+
+        if len(vorder) != len(vdata) or len(eorder) != len(edata):
+            return None
+        return vorder, eorder
+
+    def canonical_hash(self) -> int:
+        """Return a hash of the graph that is invariant under isomorphism.
+
+        Isomorphic graphs (in the sense of :func:`chyp.matcher.find_iso`)
+        always get the same hash, so graphs with different hashes are
+        certainly not isomorphic. The converse holds with high probability,
+        but is not guaranteed.
+
+        Most graphs can be numbered canonically by a traversal from the
+        boundary (see :meth:`canonical_order`), in which case this hashes
+        the graph written out in that numbering, which takes linear time.
+
+        Otherwise, the hash is computed by Weisfeiler-Lehman colour
+        refinement. Vertices start out coloured by their type, size and
+        positions on the boundary, and edges by their label and arity. Each
+        round, every edge is recoloured using the colours of its sources and
+        targets, then every vertex using the colours of the edges it is
+        adjacent to (and where). This stops once the number of vertex colours
+        stops growing.
+
+        The result only depends on the structure of the graph, not on vertex
+        or edge identifiers or drawing data, and it is the same in every run,
+        so it can be used as a key for caching. It is computed the first time
+        it is needed after the graph is modified.
+        """
+        if self._hash is None:
+            # Only the initial colours involve strings, which are hashed
+            # differently on each run, so use a stable digest for those.
+            labels: dict[str, int] = dict()
+
+            def label(x: Any) -> int:
+                s = repr(x)
+                if s not in labels:
+                    digest = hashlib.blake2b(s.encode(), digest_size=8)
+                    labels[s] = int.from_bytes(digest.digest(), 'big')
+                return labels[s]
+
+            self._canon = self._traverse_from_boundary()
+            if self._canon is not None:
+                vorder, eorder = self._canon
+                vnum = {v: i for i, v in enumerate(vorder)}
+                vlabels: dict[tuple[VType, int], int] = dict()
+                vcols = []
+                for v in vorder:
+                    vd = self._vdata[v]
+                    k = (vd.vtype, vd.size)
+                    if k not in vlabels:
+                        vlabels[k] = label(k)
+                    vcols.append(vlabels[k])
+                ecols = []
+                for e in eorder:
+                    ed = self._edata[e]
+                    ecols.append((label(ed.value),
+                                  tuple([vnum[v] for v in ed.s]),
+                                  tuple([vnum[v] for v in ed.t])))
+                form = (tuple(vcols), tuple(ecols),
+                        tuple([vnum[v] for v in self._inputs]),
+                        tuple([vnum[v] for v in self._outputs]))
+                self._hash = hash(form) & 0xffffffffffffffff
+                return self._hash
+
+            vcol = {v: label((vd.vtype, vd.size,
+                              sorted(vd.in_indices), sorted(vd.out_indices)))
+                    for v, vd in self._vdata.items()}
+            ecol = {e: label((ed.value, len(ed.s), len(ed.t)))
+                    for e, ed in self._edata.items()}
+
+            num_colors = len(set(vcol.values()))
+            for _ in range(len(vcol) + 1):
+                ecol = {e: hash((ecol[e],
+                                 tuple(vcol[v] for v in ed.s),
+                                 tuple(vcol[v] for v in ed.t)))
+                        for e, ed in self._edata.items()}
+                vcol = {v: hash((vcol[v],
+                                 tuple(sorted((ecol[e], i)
+                                              for e in vd.in_edges
+                                              for i, w in enumerate(
+                                                  self._edata[e].t)
+                                              if w == v)),
+                                 tuple(sorted((ecol[e], i)
+                                              for e in vd.out_edges
+                                              for i, w in enumerate(
+                                                  self._edata[e].s)
+                                              if w == v))))
+                        for v, vd in self._vdata.items()}
+                n = len(set(vcol.values()))
+                if n == num_colors:
+                    break
+                num_colors = n
+
+            self._hash = hash((tuple(sorted(vcol.values())),
+                               tuple(sorted(ecol.values())),
+                               tuple(vcol[v] for v in self._inputs),
+                               tuple(vcol[v] for v in self._outputs))
+                              ) & 0xffffffffffffffff
+        return self._hash
+
+    def canonical_order(self) -> tuple[list[int], list[int]] | None:
+        """Return the vertices and edges in a canonical order, if there is one.
+
+        If every vertex has at most one in-edge and at most one out-edge,
+        and every vertex and edge can be reached from the boundary, the
+        graph can be numbered by a deterministic traversal from the
+        boundary. Two such graphs are isomorphic exactly when listing their
+        vertices and edges in this order gives the same data, sources,
+        targets and boundary, and the isomorphism sends the n-th vertex or
+        edge of one to the n-th of the other. For other graphs, this returns
+        None.
+        """
+        self.canonical_hash()
+        return self._canon
+
     def merge_vertices(self, v: int, w: int) -> None:
         """Merge vertex `w` into vertex `v`.
 
@@ -530,18 +1148,18 @@ class Graph:
             v: Integer identifier of the vertex into which to merge `w`.
             w: Integer identifier of the vertex to merge into `v`.
         """
-        vd = self.vertex_data(v)
+        vd = self._own_vertex(v)
         # print("merging %s <- %s" % (v, w))
 
         # Where vertex `w` occurs as an edge target, replace it with `v`
         for e in self.in_edges(w):
-            ed = self.edge_data(e)
+            ed = self._own_edge(e)
             ed.t = [v if x == w else x for x in ed.t]
             vd.in_edges.add(e)
 
         # Where vertex `w` occurs as an edge source, replace it with `v`
         for e in self.out_edges(w):
-            ed = self.edge_data(e)
+            ed = self._own_edge(e)
             ed.s = [v if x == w else x for x in ed.s]
             vd.out_edges.add(e)
 
@@ -567,7 +1185,7 @@ class Graph:
             vertices, respectively.
         """
         new_vs: tuple[list[int], list[int]] = ([], [])
-        vd = self.vertex_data(v)
+        vd = self._own_vertex(v)
 
         def fresh(j: int) -> int:
             """Creates a new vertex with the same data as `v`.
@@ -582,9 +1200,10 @@ class Graph:
                    new output-like vertices.
             """
             v1 = self.add_vertex(
-                vtype=vd.vtype, size=vd.size,
-                x=vd.x, y=vd.y, value=vd.value
+                vtype=vd.vtype, size=vd.size, value=vd.value
             )
+            if self.geometry is not None:
+                self.geometry.vpos[v1] = self.geometry.get_vertex(v).copy()
             new_vs[j].append(v1)
             return v1
 
@@ -595,11 +1214,11 @@ class Graph:
         # occurence in the hyperedge's target list with a new input-like
         # vertex and register this with the new vertex's data instance.
         for e in vd.in_edges:
-            ed = self.edge_data(e)
+            ed = self._own_edge(e)
             for i in range(len(ed.t)):
                 if ed.t[i] == v:
                     ed.t[i] = fresh(0)
-                    self.vertex_data(ed.t[i]).in_edges.add(e)
+                    self._own_vertex(ed.t[i]).in_edges.add(e)
 
         # Replace any occurences of the original vertex in the graph outputs
         # with a new output-like vertex.
@@ -609,11 +1228,11 @@ class Graph:
         # occurence in the hyperedge's target list with a new output-like
         # vertex and register this with the new vertex's data instance.
         for e in vd.out_edges:
-            ed = self.edge_data(e)
+            ed = self._own_edge(e)
             for i in range(len(ed.s)):
                 if ed.s[i] == v:
                     ed.s[i] = fresh(1)
-                    self.vertex_data(ed.s[i]).out_edges.add(e)
+                    self._own_vertex(ed.s[i]).out_edges.add(e)
 
         # Register the fact that `v` no longer occurs in as a source or target
         # of any hyperedge.
@@ -640,16 +1259,13 @@ class Graph:
                      flipped. This can be used to break directed cycles, by
                      effectively introducing a cap and cup.
         """
-        vd = self.vertex_data(v)
+        vd = self._own_vertex(v)
 
         # Create a new vertex with the same vtype and size
         w = self.add_vertex(
-            vtype=vd.vtype, size=vd.size,
-            x=vd.x + 3, y=vd.y, value=vd.value
+            vtype=vd.vtype, size=vd.size, value=vd.value
         )
-        wd = self.vertex_data(w)
-        # The new vertex is highlighted whenever the orignal vertex is.
-        wd.highlight = vd.highlight
+        wd = self._own_vertex(w)
 
         # Replace any occurences of the original vertex in the graph outputs
         # with the new vertex.
@@ -658,7 +1274,7 @@ class Graph:
         # with the new vertex and register this change with the data instance
         # of each vertex.
         for e in vd.out_edges:
-            ed = self.edge_data(e)
+            ed = self._own_edge(e)
             ed.s = [x if x != v else w for x in ed.s]
             wd.out_edges.add(e)
         vd.out_edges.clear()
@@ -668,9 +1284,18 @@ class Graph:
         s, t = ([v], [w]) if not reverse else ([w], [v])
 
         # Create the new identity edge.
-        e = self.add_edge(s, t, 'id', vd.x + 1.5, vd.y)
-        # The new edge is highlighted whenever the original vertex is.
-        self.edge_data(e).highlight = vd.highlight
+        e = self.add_edge(s, t, 'id')
+
+        geo = self.geometry
+        if geo is not None:
+            p = geo.vertex(v)
+            geo.vpos[w] = Point(p.x + 3, p.y)
+            geo.epos[e] = Point(p.x + 1.5, p.y)
+            # The new vertex and edge are highlighted whenever the original
+            # vertex is.
+            if v in geo.vhighlight:
+                geo.vhighlight.add(w)
+                geo.ehighlight.add(e)
         return e
 
     def tensor(self, other: Graph, layout: bool = True) -> None:
@@ -682,56 +1307,62 @@ class Graph:
 
         Args:
             other: The graph with which to take the monoidal product.
-            layout: If `True`, compute new y-coordinates of the vertices and
-                    edges of the resulting graph so that the two graphs in the
-                    tensor product are adjacent with no overlap in the
-                    y-direction.
+            layout: If `True` and either graph has been laid out, compute
+                    new y-coordinates of the vertices and edges of the
+                    resulting graph so that the two graphs in the tensor
+                    product are adjacent with no overlap in the y-direction.
         """
         # Mapping used to match which new vertex added to this graph each
         # vertex of the other graph corresponds to.
         # Used when computing connectivity of edges copied over from the
         # other graph.
         vmap = dict()
-        # emap = dict()
 
-        if layout:
+        # Positions are only copied and shifted if there are any.
+        geo = None
+        if self._has_layout() or other._has_layout():
+            geo = self.ensure_geometry()
+            other_geo = other.geometry or Geometry()
+            min_other = 0.0
+        if geo is not None and layout:
             # Compute the max y-coordinate of the edges and vertices in this
             # graph.
             max_self = max(
-                max((self.vertex_data(v).y for v in self.vertices()),
-                    default=0),
-                max((self.edge_data(e).y for e in self.edges()), default=0)
+                max((geo.vertex(v).y for v in self._vdata), default=0),
+                max((geo.edge(e).y for e in self._edata), default=0)
             )
             # Compute the min y-coordinate of the edges and vertices in the
             # other graph.
             min_other = min(
-                min((other.vertex_data(v).y for v in other.vertices()),
-                    default=0),
-                min((other.edge_data(e).y for e in other.edges()), default=0)
+                min((other_geo.get_vertex(v).y for v in other.vdata), default=0),
+                min((other_geo.get_edge(e).y for e in other.edata), default=0)
             )
             # Shift all vertices and edges of this graph below the y-axis.
-            for v in self.vertices():
-                self.vertex_data(v).y -= max_self
-            for e in self.edges():
-                self.edge_data(e).y -= max_self
-        else:
-            min_other = 0
+            for v in self._vdata:
+                geo.vpos[v].y -= max_self
+            for e in self._edata:
+                geo.epos[e].y -= max_self
 
         # Copy the vertices and edges of the other graph to this one, with all
         # vertices and edges shifted above the y-axis if layout == True.
         for v in other.vertices():
-            vd = other.vertex_data(v)
+            vd = other.vdata[v]
             vmap[v] = self.add_vertex(
                 vtype=vd.vtype, size=vd.size,
                 infer_type=vd.infer_type, infer_size=vd.infer_size,
-                x=vd.x, y=vd.y - min_other + 1, value=vd.value
+                value=vd.value
             )
+            if geo is not None:
+                p = other_geo.get_vertex(v)
+                geo.vpos[vmap[v]] = Point(p.x, p.y - min_other + 1)
         for e in other.edges():
-            ed = other.edge_data(e)
-            self.add_edge([vmap[v] for v in ed.s],
-                          [vmap[v] for v in ed.t],
-                          ed.value, ed.x, ed.y - min_other + 1,
-                          ed.fg, ed.bg, ed.hyper)
+            ed = other.edata[e]
+            e1 = self.add_edge([vmap[v] for v in ed.s],
+                               [vmap[v] for v in ed.t],
+                               ed.value, ed.fg, ed.bg, ed.hyper)
+            if geo is not None:
+                p = other_geo.get_edge(e)
+                geo.epos[e1] = Point(p.x, p.y - min_other + 1)
 
         # self.set_inputs(self.inputs() + [vmap[v] for v in other.inputs()])
         # self.set_outputs(self.outputs() + [vmap[v] for v in other.outputs()])
@@ -770,8 +1401,8 @@ class Graph:
                 + f'match domain {other.domain()}'
             )
         for output_id, input_id in zip(self_outputs, other_inputs):
-            output_data = self.vertex_data(output_id)
-            input_data = other.vertex_data(input_id)
+            output_data = self._vdata[output_id]
+            input_data = other.vdata[input_id]
             if output_data.vtype != input_data.vtype:
                 if not (output_data.infer_type or input_data.infer_type):
                     raise GraphError(
@@ -787,41 +1418,50 @@ class Graph:
 
         vmap = dict()
 
-        # Compute the max x-coordinate of the edges and vertices
-        # in this graph.
-        max_self = max(
-            max((self.vertex_data(v).x for v in self.vertices()), default=0),
-            max((self.edge_data(e).x for e in self.edges()), default=0)
-        )
-        # Compute the min x-coordinate of the edges and vertices
-        # in the other graph.
-        min_other = min(
-            min((other.vertex_data(v).x for v in other.vertices()),
-                default=0),
-            min((other.edge_data(e).x for e in other.edges()), default=0)
-        )
-
-        # Shift all vertices and edges of this graph below the x-axis.
-        for v in self.vertices():
-            self.vertex_data(v).x -= max_self
-        for e in self.edges():
-            self.edge_data(e).x -= max_self
+        # If either graph has been laid out, place the other graph to the
+        # right of this one.
+        geo = None
+        if self._has_layout() or other._has_layout():
+            geo = self.ensure_geometry()
+            other_geo = other.geometry or Geometry()
+            # Compute the max x-coordinate of the edges and vertices
+            # in this graph.
+            max_self = max(
+                max((geo.vertex(v).x for v in self._vdata), default=0),
+                max((geo.edge(e).x for e in self._edata), default=0)
+            )
+            # Compute the min x-coordinate of the edges and vertices
+            # in the other graph.
+            min_other = min(
+                min((other_geo.get_vertex(v).x for v in other.vdata), default=0),
+                min((other_geo.get_edge(e).x for e in other.edata), default=0)
+            )
+            # Shift all vertices and edges of this graph below the x-axis.
+            for v in self._vdata:
+                geo.vpos[v].x -= max_self
+            for e in self._edata:
+                geo.epos[e].x -= max_self
 
         # Copy the vertices and edges of the other graph to this one, with all
-        # vertices and edges shifted above the x-axis.
+        # vertices and edges shifted above the x-axis if there is a layout.
         for v in other.vertices():
-            vd = other.vertex_data(v)
+            vd = other.vdata[v]
             vmap[v] = self.add_vertex(
                 vtype=vd.vtype, size=vd.size,
                 infer_type=vd.infer_type, infer_size=vd.infer_size,
-                x=vd.x - min_other, y=vd.y, value=vd.value
+                value=vd.value
             )
+            if geo is not None:
+                p = other_geo.get_vertex(v)
+                geo.vpos[vmap[v]] = Point(p.x - min_other, p.y)
         for e in other.edges():
-            ed = other.edge_data(e)
-            self.add_edge([vmap[v] for v in ed.s],
-                          [vmap[v] for v in ed.t],
-                          ed.value, ed.x - min_other, ed.y,
-                          ed.fg, ed.bg, ed.hyper)
+            ed = other.edata[e]
+            e1 = self.add_edge([vmap[v] for v in ed.s],
+                               [vmap[v] for v in ed.t],
+                               ed.value, ed.fg, ed.bg, ed.hyper)
+            if geo is not None:
+                p = other_geo.get_edge(e)
+                geo.epos[e1] = Point(p.x - min_other, p.y)
 
         # 'Plug' the two graphs together. In other words, merge the input
         # vertices of other into the corresponding output vertices of `self`.
@@ -851,8 +1491,8 @@ class Graph:
                 p2 = quotient[p2]
             # If the resulting p1 and p2 are not the same vertex, merge them.
             if p1 != p2:
-                data_1 = self.vertex_data(p1)
-                data_2 = self.vertex_data(p2)
+                data_1 = self._own_vertex(p1)
+                data_2 = self._own_vertex(p2)
                 # If both vertices have flexible types that are not equal,
                 # raise an error due to ambiguity.
                 if (data_1.infer_type and data_2.infer_type
@@ -895,8 +1535,23 @@ class Graph:
         g.compose(other)
         return g
 
+    def _has_layout(self) -> bool:
+        """Return whether any vertex or edge of the graph has a position."""
+        geo = self.geometry
+        return geo is not None and (len(geo.vpos) != 0 or len(geo.epos) != 0)
+
+    def ensure_geometry(self) -> Geometry:
+        """Return the geometry of the graph, giving it an empty one if needed.
+
+        Layouts and the GUI call this before placing or highlighting
+        anything, so only graphs that are displayed carry a geometry.
+        """
+        if self.geometry is None:
+            self.geometry = Geometry()
+        return self.geometry
+
     def highlight(self, vertices: set[int], edges: set[int]) -> None:
-        """Set the `highlight` flag for a set of vertices and edges.
+        """Highlight a set of vertices and edges.
 
         This tells the GUI to visually highlight a set of vertices/edges,
         e.g. by drawing them in bold.
@@ -906,21 +1561,26 @@ class Graph:
             vertices: A set of vertices to highlight.
             edges: A set of edges to highlight.
         """
-        for v, vd in self.vdata.items():
-            vd.highlight = v in vertices
-        for e, ed in self.edata.items():
-            ed.highlight = e in edges
+        geo = self.ensure_geometry()
+        geo.vhighlight = set(vertices)
+        geo.ehighlight = set(edges)
 
     def unhighlight(self) -> None:
-        """Clear the `highlight` flag for all vertices/edges.
+        """Clear the highlighting of all vertices/edges.
 
         This is equivalent to calling :func:`highlight` with empty sets
         of vertices/edges.
         """
-        for vd in self.vdata.values():
-            vd.highlight = False
-        for ed in self.edata.values():
-            ed.highlight = False
+        if self.geometry is not None:
+            self.geometry.vhighlight = set()
+            self.geometry.ehighlight = set()
+
+    def highlighted(self) -> tuple[set[int], set[int]]:
+        """Return the sets of highlighted vertices and edges."""
+        if self.geometry is None:
+            return (set(), set())
+        return ({v for v in self.geometry.vhighlight if v in self._vdata},
+                {e for e in self.geometry.ehighlight if e in self._edata})
 
 
 def gen(value: str,
@@ -940,13 +1600,11 @@ def gen(value: str,
     """
     g = Graph()
     inputs = [g.add_vertex(vtype=vtype, size=size,
-                           infer_type=infer_types, infer_size=infer_sizes,
-                           x=-1.5, y=i - (i-1)/2)
+                           infer_type=infer_types, infer_size=infer_sizes)
               for i, (vtype, size)
               in enumerate(domain)]
     outputs = [g.add_vertex(vtype=vtype, size=size,
-                            infer_type=infer_types, infer_size=infer_sizes,
-                            x=1.5, y=i - (i-1)/2)
+                            infer_type=infer_types, infer_size=infer_sizes)
                for i, (vtype, size)
                in enumerate(codomain)]
     g.add_edge(inputs, outputs, value, fg=fg, bg=bg)
@@ -984,9 +1642,8 @@ def perm(p: list[int], domain: list[tuple[VType, int]],
         raise GraphError(
             f'Domain {domain} does not match length of permutation.')
     inputs = [g.add_vertex(vtype=vtype, size=size,
-                           infer_type=infer_type, infer_size=infer_size,
-                           x=0, y=i - (num_wires-1)/2)
-              for i, (vtype, size) in enumerate(domain)]
+                           infer_type=infer_type, infer_size=infer_size)
+              for vtype, size in domain]
     outputs = [inputs[p[i]] for i in range(num_wires)]
     g.set_inputs(inputs)
     g.set_outputs(outputs)
@@ -1004,8 +1661,7 @@ def identity(vtype: VType = None, size: int = 1,
     """
     g = Graph()
     v = g.add_vertex(vtype=vtype, size=size,
-                     infer_type=infer_type, infer_size=infer_size,
-                     x=0, y=0)
+                     infer_type=infer_type, infer_size=infer_size)
     g.set_inputs([v])
     g.set_outputs([v])
     return g
@@ -1068,19 +1724,20 @@ def load_graph(path: str) -> Graph:
 
     j = yaml.compose(path, Loader=NxSafeLoader)
     g = Graph()
+    geo = g.ensure_geometry()
     for v, vd in j.nodes:
-        g.add_vertex(x=float(vd["x"] if "x" in vd else 0.0),
-                     y=float(vd["y"] if "y" in vd else 0.0),
-                     value=vd["value"] if "value" in vd else "",
+        g.add_vertex(value=vd["value"] if "value" in vd else "",
                      name=int(v))
+        geo.vpos[int(v)] = Point(float(vd["x"] if "x" in vd else 0.0),
+                                 float(vd["y"] if "y" in vd else 0.0))
     for e, ed in j.edges:
         g.add_edge(s=[int(v) for v in ed["s"]],
                    t=[int(v) for v in ed["t"]],
                    value=ed["value"] if "value" in ed else "",
-                   x=float(ed["x"]) if "x" in ed else 0.0,
-                   y=float(ed["y"]) if "y" in ed else 0.0,
                    hyper=bool(ed["hyper"]) if "hyper" in ed else True,
                    name=int(e))
+        geo.epos[int(e)] = Point(float(ed["x"]) if "x" in ed else 0.0,
+                                 float(ed["y"]) if "y" in ed else 0.0)
 
     g.set_inputs([int(v) for v in j["inputs"]])
     g.set_outputs([int(v) for v in j["outputs"]])
@@ -17,6 +17,8 @@ from __future__ import annotations
 import sys
 from PySide6.QtWidgets import QApplication
 
+from .. import proofcache
+from ..layout import default_dir, layout_cache
 from .colors import apply_theme
 
 from . import mainwindow
@@ -86,5 +88,7 @@ class Chyp(QApplication):
 def main() -> None:
     """Main entry point for chyp"""
 
+    proofcache.enable()
+    layout_cache.directory = default_dir()
     chyp = Chyp()
     chyp.exec_()
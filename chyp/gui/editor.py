@@ -21,7 +21,7 @@ from PySide6.QtWidgets import QHBoxLayout, QSplitter, QTreeView, QVBoxLayout, QW
 
 
 from .. import parser
-from ..layout import convex_layout
+from ..layout import LAYOUTS, incremental_layout, layout_cache, relabel_layout
 from ..graph import Graph
 from ..state import RewriteState, State
 # from ..term import graph_to_term
@@ -35,6 +35,12 @@ from .codeview import CodeView
 from .document import ChypDocument
 from .highlighter import STATUS_GOOD, STATUS_BAD
 
+def layout_backend() -> str:
+    """Return the name of the layout backend chosen in the View menu"""
+    conf = QSettings('chyp', 'chyp')
+    backend = conf.value('layout_backend')
+    return backend if isinstance(backend, str) and backend in LAYOUTS else 'layered'
+
 class Editor(QWidget):
     def __init__(self) -> None:
         super().__init__()
@@ -182,8 +188,7 @@ class Editor(QWidget):
         self.code_view.set_current_region((part[0], part[1]))
         if part[2] in ('let','gen') and part[3] in self.state.graphs:
             if i not in self.graph_cache:
-                g = self.state.graphs[part[3]].copy()
-                convex_layout(g)
+                g = layout_cache.layout(self.state.graphs[part[3]], layout_backend())
                 self.graph_cache[i] = (g, None)
             else:
                 g, _ = self.graph_cache[i]
@@ -191,10 +196,9 @@ class Editor(QWidget):
             self.lhs_view.set_graph(g)
         elif part[2] == 'rule' and part[3] in self.state.rules:
             if i not in self.graph_cache:
-                lhs = self.state.rules[part[3]].lhs.copy()
-                rhs = self.state.rules[part[3]].rhs.copy()
-                convex_layout(lhs)
-                convex_layout(rhs)
+                backend = layout_backend()
+                lhs = layout_cache.layout(self.state.rules[part[3]].lhs, backend)
+                rhs = layout_cache.layout(self.state.rules[part[3]].rhs, backend)
                 self.graph_cache[i] = (lhs, rhs)
             else:
                 lhs, rhs0 = self.graph_cache[i]
@@ -220,10 +224,16 @@ class Editor(QWidget):
                     check_thread.start()
 
             if i not in self.graph_cache:
-                lhs = rw.lhs.copy() if rw.lhs else Graph()
-                rhs = rw.rhs.copy() if rw.rhs else Graph()
-                convex_layout(lhs)
-                convex_layout(rhs)
+                backend = layout_backend()
+                lhs = layout_cache.layout(rw.lhs if rw.lhs else Graph(), backend)
+                if rw.rhs and rw.rewrite_matches and backend == 'layered':
+                    # keep the part of the picture that wasn't rewritten where it was in the LHS, and store
+                    # the result so the next step starts from the same picture
+                    m_lhs, m_rhs, iso = rw.rewrite_matches
+                    rhs = relabel_layout(rw.rhs, iso.vmap, iso.emap, incremental_layout(lhs, m_lhs, m_rhs))
+                    layout_cache.store(rw.rhs, rhs, backend)
+                else:
+                    rhs = layout_cache.layout(rw.rhs if rw.rhs else Graph(), backend)
                 self.graph_cache[i] = (lhs, rhs)
             else:
                 lhs, rhs0 = self.graph_cache[i]
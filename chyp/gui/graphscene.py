@@ -39,7 +39,7 @@ class EItem(QGraphicsRectItem):
                          1.6 * SCALE)  # height
         self.g = g
         self.e = e
-        ed = g.edge_data(e)
+        ed = g.edata[e]
         self.bg = ed.bg
         self.fg = ed.fg
         self.value = ed.value
@@ -49,7 +49,9 @@ class EItem(QGraphicsRectItem):
         self.is_redistributer = (isinstance(ed.value, str)
                                  and ed.value == '_redistributer')
 
-        self.setPos(ed.x * SCALE, ed.y * SCALE)
+        geo = g.ensure_geometry()
+        p = geo.edge(e)
+        self.setPos(p.x * SCALE, p.y * SCALE)
 
         if self.is_id:
             self.setRect(-0.2 * SCALE, -0.2 * SCALE, 0.4 * SCALE, 0.4 * SCALE)
@@ -78,7 +80,7 @@ class EItem(QGraphicsRectItem):
                 self.setBrush(QBrush(QColor(200, 200, 255)))
 
             pen = QPen(QColor(0, 0, 0))
-            if ed.highlight or self.is_redistributer:
+            if e in geo.ehighlight or self.is_redistributer:
                 pen.setWidth(3)
             self.setPen(pen)
 
@@ -98,8 +100,9 @@ class VItem(QGraphicsEllipseItem):
         self.v = v
         self.eitem = eitem
         self.i = i
-        vd = g.vertex_data(v)
-        self.setPos(vd.x * SCALE, vd.y * SCALE)
+        vd = g.vdata[v]
+        p = g.ensure_geometry().vertex(v)
+        self.setPos(p.x * SCALE, p.y * SCALE)
         self.setBrush(QBrush(QColor(0, 0, 0)))
 
         # Add text item to indicate vertex type
@@ -131,12 +134,12 @@ class TItem(QGraphicsPathItem):
         g = vitem.g
         self.vitem = vitem
         self.eitem = eitem
-        if (g.vertex_data(vitem.v).highlight or
-            g.edge_data(eitem.e).highlight):
+        geo = g.ensure_geometry()
+        if vitem.v in geo.vhighlight or eitem.e in geo.ehighlight:
             pen = QPen()
             pen.setWidth(3)
             self.setPen(pen)
-        self.size = g.vertex_data(vitem.v).size
+        self.size = g.vdata[vitem.v].size
         self.i = i
         self.src = src
         self.refresh()
@@ -213,7 +216,7 @@ class GraphScene(QGraphicsScene):
             self.addItem(vi[v].textItem)
 
         for e in self.g.edges():
-            ed = self.g.edge_data(e)
+            ed = self.g.edata[e]
             for i, v in enumerate(ed.t):
                 if not v in vi:
                     vi[v] = VItem(self.g, v, ei[e], i)
@@ -221,7 +224,7 @@ class GraphScene(QGraphicsScene):
                     self.addItem(vi[v].textItem)
 
         for e in self.g.edges():
-            ed = self.g.edge_data(e)
+            ed = self.g.edata[e]
             for i, v in enumerate(ed.s):
                 ti = TItem(vi[v], ei[e], i, src=True)
                 self.addItem(ti)
@@ -112,6 +112,30 @@ class MainWindow(QMainWindow):
         themes_group.addAction(view_themes_dark)
         themes_group.addAction(view_themes_light)
 
+    def update_layouts(self) -> None:
+        conf = QSettings('chyp', 'chyp')
+        backend = editor.layout_backend()
+
+        def set_layout(b: str) -> Callable:
+            def f() -> None:
+                conf.setValue('layout_backend', b)
+            return f
+
+        layouts_group = QActionGroup(self)
+
+        view_layout_layered = self.view_layouts.addAction("&Layered")
+        view_layout_layered.setCheckable(True)
+        view_layout_layered.setChecked(backend == 'layered')
+        view_layout_layered.triggered.connect(set_layout('layered'))
+
+        view_layout_convex = self.view_layouts.addAction("&Convex (slow)")
+        view_layout_convex.setCheckable(True)
+        view_layout_convex.setChecked(backend == 'convex')
+        view_layout_convex.triggered.connect(set_layout('convex'))
+
+        layouts_group.addAction(view_layout_layered)
+        layouts_group.addAction(view_layout_convex)
+
     def recent_files(self) -> List[str]:
         conf = QSettings('chyp', 'chyp')
         o = conf.value('recent_files', [])
@@ -375,5 +399,7 @@ class MainWindow(QMainWindow):
         view_menu.addSeparator()
         self.view_themes = view_menu.addMenu("&Themes")
         self.update_themes()
+        self.view_layouts = view_menu.addMenu("&Layout")
+        self.update_layouts()
 
         self.setMenuBar(menu)
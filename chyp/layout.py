@@ -14,54 +14,69 @@
 # limitations under the License.
 
 from __future__ import annotations
-import cvxpy as cp
-from cvxpy.expressions.variable import Variable
-from cvxpy.expressions.constants.constant import Constant
-from cvxpy.problems.objective import Minimize
-from cvxpy.problems.problem import Problem
-
-from .graph import Graph
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import os
+import numpy as np
+
+from . import trace
+from .diskcache import cache_dir, graph_from_json, graph_to_json, write_json
+from .graph import Geometry, Graph, Point
+from .matcher import Match, find_iso
 from .term import layer_decomp
 
-def convex_layout(g: Graph) -> None:
-    """A layout based on `layer_decomp` and convex optimisation
+def initial_layout(g: Graph, e_layers: List[List[int]]) -> None:
+    """Set the x-coordinates and rough y-coordinates of a graph decomposed into layers by `layer_decomp`
 
-    Vertices and edges are placed in layers according to `layer_decomp`. Their
-    y-coordinates are chosen by convex optimation to try to make connections as
-    straight as possible subject to the constraints that inputs and outputs must
-    be in order and at least 1.0 apart, and edges must be in order and not overlapping.
+    Edges in each layer, and the vertices between layers, are spaced out evenly around the x-axis.
     """
-    e_layers = layer_decomp(g)
-
-    # initialise x-coordinates and rough y-coordinates
+    geo = g.ensure_geometry()
     x = -(len(e_layers) + 1) * 1.5
     inp = list(g.inputs())
     for i, v in enumerate(inp):
-        vd = g.vertex_data(v)
-        vd.x = x + 1.5
-        vd.y = i - (len(inp)-1)/2
+        geo.vpos[v] = Point(x + 1.5, i - (len(inp)-1)/2)
 
     x += 3.0
 
     for e_layer in e_layers:
         v_layer = []
         for i, e in enumerate(e_layer):
-            ed = g.edge_data(e)
-            ed.x = x
-            ed.y = 2 * i - (len(e_layer)-1)
-            v_layer += ed.t
+            geo.epos[e] = Point(x, 2 * i - (len(e_layer)-1))
+            v_layer += g.edata[e].t
 
         for i, v in enumerate(v_layer):
-            vd = g.vertex_data(v)
-            vd.x = x + 0.7
-            vd.y = i - (len(v_layer)-1)/2
+            geo.vpos[v] = Point(x + 0.7, i - (len(v_layer)-1)/2)
         x += 3.0
 
     outp = list(g.outputs())
     for i, v in enumerate(outp):
-        vd = g.vertex_data(v)
-        vd.x = x - 1.5
-        vd.y = i - (len(outp)-1)/2
+        geo.vpos[v] = Point(x - 1.5, i - (len(outp)-1)/2)
+
+def port_shift(vs: List[int], v: int) -> float:
+    """The offset from the centre of a box to the wire of `v`, given the box's source or target list `vs`"""
+    return 0.0 if len(vs) <= 1 else ((vs.index(v) / (len(vs) - 1)) - 0.5)
+
+@trace.traced('convex_layout', lambda g: {'edges': g.num_edges()})
+def convex_layout(g: Graph) -> None:
+    """A layout based on `layer_decomp` and convex optimisation
+
+    Vertices and edges are placed in layers according to `layer_decomp`. Their
+    y-coordinates are chosen by convex optimation to try to make connections as
+    straight as possible subject to the constraints that inputs and outputs must
+    be in order and at least 1.0 apart, and edges must be in order and not overlapping.
+    """
+    # cvxpy takes a few seconds to import, so only do it if this layout is actually used
+    import cvxpy as cp
+    from cvxpy.expressions.variable import Variable
+    from cvxpy.expressions.constants.constant import Constant
+    from cvxpy.problems.objective import Minimize
+    from cvxpy.problems.problem import Problem
+
+    e_layers = layer_decomp(g)
+
+    # initialise x-coordinates and rough y-coordinates
+    initial_layout(g, e_layers)
 
     if g.num_vertices() == 0 or g.num_edges() == 0: return
 
@@ -91,7 +106,7 @@ def convex_layout(g: Graph) -> None:
             e1 = e_layer[i]
             if i+1 >= len(e_layer): break
             e2 = e_layer[i+1]
-            dist = (g.edge_data(e1).box_size() + g.edge_data(e2).box_size()) * 0.5
+            dist = (g.edata[e1].box_size() + g.edata[e2].box_size()) * 0.5
             constr.append(ey[etab[e2]] - ey[etab[e1]] >= Constant(dist))
             opt.append(Constant(0.1) * (ey[etab[e2]] - ey[etab[e1]]))
 
@@ -100,15 +115,11 @@ def convex_layout(g: Graph) -> None:
         pos2 = vy[vtab[v]]
         if len(g.in_edges(v)) >= 1:
             e = next(iter(g.in_edges(v)))
-            t = g.target(e)
-            y_shift = Constant(0.0 if len(t) <= 1 else ((t.index(v) / (len(t) - 1)) - 0.5))
-            pos1 = ey[etab[e]] + y_shift
+            pos1 = ey[etab[e]] + Constant(port_shift(g.target(e), v))
 
         if len(g.out_edges(v)) >= 1:
             e = next(iter(g.out_edges(v)))
-            s = g.source(e)
-            y_shift = Constant(0.0 if len(s) <= 1 else ((s.index(v) / (len(s) - 1)) - 0.5))
-            pos2 = ey[etab[e]] + y_shift
+            pos2 = ey[etab[e]] + Constant(port_shift(g.source(e), v))
 
         opt.append(pos1 - pos2)
 
@@ -116,6 +127,7 @@ def convex_layout(g: Graph) -> None:
     # problem = Problem(Minimize(cp.sum_squares(cp.vstack(opt))), constr)
     problem = Problem(Minimize(cp.norm1(cp.vstack(opt))), constr)
     problem.solve()
+    geo = g.ensure_geometry()
     min = None
     max = None
     for v,i in vtab.items():
@@ -123,23 +135,346 @@ def convex_layout(g: Graph) -> None:
             y = vy.value[i]
             if min is None or y < min: min = y
             if max is None or y > max: max = y
-            g.vertex_data(v).y = y
+            geo.vertex(v).y = y
 
     if not min is None and not max is None:
         yshift = (min + max) * 0.5
         for v in g.vertices():
-            g.vertex_data(v).y -= yshift
+            geo.vertex(v).y -= yshift
     else:
         yshift = 0
 
     for e,i in etab.items():
         y = ey.value[i]
-        ed = g.edge_data(e)
-        ed.y = y - yshift
+        ed = g.edata[e]
+        p = geo.edge(e)
+        p.y = y - yshift
         for j,v in enumerate(ed.t):
             if not g.is_boundary(v):
                 yshift_v = 0 if len(ed.t) <= 1 else ((j / (len(ed.t) - 1)) - 0.5)
-                g.vertex_data(v).y = ed.y + yshift_v
+                geo.vertex(v).y = p.y + yshift_v
+
+@trace.traced('layered_layout', lambda g, sweeps=4: {'edges': g.num_edges()})
+def layered_layout(g: Graph, sweeps: int = 4) -> None:
+    """A fast layout based on `layer_decomp` and barycentre placement
+
+    This makes the same trade-off as :func:`convex_layout`, i.e. connections should be as straight as
+    possible, while inputs, outputs and the edges in each layer stay in order and don't overlap. Rather than
+    solving an optimisation problem, it sweeps forwards and backwards through the layers a few times,
+    moving each edge (or input/output) to the average position of the wires it connects to. The new
+    positions in each layer are then pushed apart just enough to satisfy the ordering constraints, which
+    is done for the whole layer at once using running maxima and minima.
+    """
+    e_layers = layer_decomp(g)
+    initial_layout(g, e_layers)
+    place_layers(g, e_layers, sweeps)
+
+# a slot that can be placed by `place_layers`: ('i', n) or ('o', n) for the n-th input or output, or ('e', e)
+# for the edge e
+Slot = Tuple[str, int]
+
+def place_layers(g: Graph, e_layers: List[List[int]], sweeps: int = 4, pins: Optional[Dict[Slot, float]] = None) -> None:
+    """Choose y-coordinates for a graph decomposed into layers, as described in :func:`layered_layout`
+
+    Any slots given in `pins` are fixed at the given heights, and only the other slots are moved. If no
+    slots are pinned, the result is centred vertically.
+    """
+    if g.num_vertices() == 0: return
+    pins = pins or dict()
+    geo = g.ensure_geometry()
+
+    # Each input, output and edge gets a slot. Slots are grouped into columns (inputs, each layer of edges,
+    # outputs), and `gap[i]` is the minimum distance between slot i and the slot before it in its column.
+    columns: List[List[Tuple[str, int]]] = ([[('i', i) for i in range(len(g.inputs()))]] +
+                                           [[('e', e) for e in e_layer] for e_layer in e_layers] +
+                                           [[('o', i) for i in range(len(g.outputs()))]])
+    slot: Dict[Tuple[str, int], int] = dict()
+    bounds = []
+    gap = []
+    y0 = []
+    for column in columns:
+        start = len(slot)
+        for j, s in enumerate(column):
+            slot[s] = len(slot)
+            kind, x = s
+            if kind == 'e':
+                ed = g.edata[x]
+                y0.append(geo.edge(x).y)
+                gap.append(0.0 if j == 0 else (g.edata[column[j-1][1]].box_size() + ed.box_size()) * 0.5)
+            else:
+                v = g.inputs()[x] if kind == 'i' else g.outputs()[x]
+                y0.append(geo.vertex(v).y)
+                gap.append(0.0 if j == 0 else 1.0)
+        bounds.append((start, len(slot)))
+
+    # Each vertex connects the slots on its left (its in-edges, or its positions in the inputs) to the slots
+    # on its right (its out-edges, or its positions in the outputs). Ideally, the two ends of each such wire
+    # should be at the same height, up to the offsets of the wire on each box.
+    left_slots: Dict[int, List[Tuple[int, float]]] = {v: [] for v in g.vertices()}
+    right_slots: Dict[int, List[Tuple[int, float]]] = {v: [] for v in g.vertices()}
+    for i, v in enumerate(g.inputs()):
+        left_slots[v].append((slot[('i', i)], 0.0))
+    for i, v in enumerate(g.outputs()):
+        right_slots[v].append((slot[('o', i)], 0.0))
+    for e, ed in g.edata.items():
+        for v in ed.t:
+            left_slots[v].append((slot[('e', e)], port_shift(ed.t, v)))
+        for v in ed.s:
+            right_slots[v].append((slot[('e', e)], port_shift(ed.s, v)))
+
+    wires = [(a, oa, b, ob) for v in g.vertices() for a, oa in left_slots[v] for b, ob in right_slots[v]]
+    if len(wires) == 0: return
+    wa, woa, wb, wob = (np.array(c) for c in zip(*wires))
+    wa = wa.astype(int)
+    wb = wb.astype(int)
+
+    # for each column, the wires ending in it: local index of the end in the column, slot of the other end,
+    # and the offset from the other end's slot position to where this end's slot should be
+    ends: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+    for start, end in bounds:
+        at_a = (wa >= start) & (wa < end)
+        at_b = (wb >= start) & (wb < end)
+        ends.append((np.concatenate([wa[at_a], wb[at_b]]) - start,
+                     np.concatenate([wb[at_a], wa[at_b]]),
+                     np.concatenate([(wob - woa)[at_a], (woa - wob)[at_b]])))
+
+    y = np.array(y0, dtype=float)
+    offset = np.array(gap, dtype=float)
+    for start, end in bounds:
+        offset[start:end] = np.cumsum(offset[start:end])
+
+    # Pinned slots keep their heights, as long as they are far enough apart in their column. The other slots
+    # in the column are then kept between the pinned slots above and below them.
+    pinned = np.zeros(len(y), dtype=bool)
+    for s, i in slot.items():
+        if s in pins:
+            y[i] = pins[s]
+            pinned[i] = True
+    for start, end in bounds:
+        z = (y - offset)[start:end][pinned[start:end]]
+        if np.any(z[1:] < z[:-1]): pinned[start:end] = False
+    free = [c for c, (start, end) in enumerate(bounds) if not np.all(pinned[start:end])]
+
+    def place(c: int) -> None:
+        start, end = bounds[c]
+        if start == end: return
+        local, other, shift = ends[c]
+        target = y[start:end].copy()
+        if len(local) != 0:
+            total = np.bincount(local, weights=y[other] + shift, minlength=end-start)
+            count = np.bincount(local, minlength=end-start)
+            target = np.where(count > 0, total / np.maximum(count, 1), target)
+
+        # Spacing the slots of a column out by the gaps in `offset` is the same as asking for z below to be
+        # non-decreasing. The running maximum and (reversed) running minimum are the closest non-decreasing
+        # sequences above and below z, so their average is a fair compromise.
+        z = target - offset[start:end]
+        pin = pinned[start:end]
+        if np.any(pin):
+            z_pin = (y[start:end] - offset[start:end])[pin]
+            z[pin] = z_pin
+            lo = np.maximum.accumulate(np.where(pin, z, -np.inf))
+            hi = np.minimum.accumulate(np.where(pin, z, np.inf)[::-1])[::-1]
+            z = np.clip(z, lo, hi)
+        z = 0.5 * (np.maximum.accumulate(z) + np.minimum.accumulate(z[::-1])[::-1])
+        y[start:end] = z + offset[start:end]
+
+    for _ in range(sweeps):
+        for c in free: place(c)
+        for c in reversed(free): place(c)
+
+    # write back coordinates, centred vertically, placing each inner vertex on the wire of its in-edge
+    for (kind, x), i in slot.items():
+        if kind == 'e':
+            geo.edge(x).y = y[i]
+        else:
+            v = g.inputs()[x] if kind == 'i' else g.outputs()[x]
+            geo.vertex(v).y = y[i]
+    for e, ed in g.edata.items():
+        for v in ed.t:
+            if not g.is_boundary(v):
+                geo.vertex(v).y = geo.edge(e).y + port_shift(ed.t, v)
+
+    if pins: return
+    ys = [geo.vertex(v).y for v in g.vertices()]
+    yshift = (min(ys) + max(ys)) * 0.5
+    for v in g.vertices():
+        geo.vertex(v).y -= yshift
+    for e in g.edges():
+        geo.edge(e).y -= yshift
+
+@trace.traced('incremental_layout', lambda prev, m_g, m_h, sweeps=4: {'edges': prev.num_edges()})
+def incremental_layout(prev: Graph, m_g: Match, m_h: Match, sweeps: int = 4) -> Graph:
+    """Lay out the result of a rewrite, reusing the layout of the graph that was rewritten
+
+    Here `m_g` and `m_h` are the matches of the LHS and RHS of a rule returned by :func:`chyp.rewrite.dpo`,
+    and `prev` is a laid-out copy of the rewritten graph `m_g.cod`, with the same vertex and edge names
+    (e.g. the result of :meth:`LayoutCache.layout`). This returns a laid-out copy of `m_h.cod`, where the
+    boundary and the edges outside of the rewritten part keep their heights from `prev`, and only the new
+    edges, and whatever is needed to make room for them, are placed again using :func:`place_layers`.
+    """
+    h = m_h.cod.copy()
+    e_layers = layer_decomp(h)
+
+    prev_geo = prev.geometry or Geometry()
+    pins: Dict[Slot, float] = dict()
+    for i, v in enumerate(prev.inputs()):
+        pins[('i', i)] = prev_geo.get_vertex(v).y
+    for i, v in enumerate(prev.outputs()):
+        pins[('o', i)] = prev_geo.get_vertex(v).y
+    for e_layer in e_layers:
+        for e in e_layer:
+            if e in m_g.cod.edata and e in prev.edata and e not in m_h.eimg:
+                pins[('e', e)] = prev_geo.get_edge(e).y
+
+        # put the context edges of each layer in the same order as before, leaving the others in place
+        idx = [i for i, e in enumerate(e_layer) if ('e', e) in pins]
+        for i, e in zip(idx, sorted((e_layer[i] for i in idx), key=lambda e: pins[('e', e)])):
+            e_layer[i] = e
+
+    initial_layout(h, e_layers)
+    place_layers(h, e_layers, sweeps, pins)
+    return h
+
+LAYOUTS: Dict[str, Callable[[Graph], None]] = {
+    'layered': layered_layout,
+    'convex': convex_layout,
+}
+
+def layout_graph(g: Graph, backend: str = 'layered') -> None:
+    """Lay out a graph in-place using one of the layouts in `LAYOUTS`
+
+    The default 'layered' backend only needs NumPy and runs in a few milliseconds even for large graphs.
+    The 'convex' backend uses cvxpy and can produce slightly tidier pictures, but it is much slower.
+    """
+    if backend not in LAYOUTS:
+        raise ValueError(f'Unknown layout backend: {backend}')
+    LAYOUTS[backend](g)
+
+def default_dir() -> str:
+    """Return the default directory for storing layouts"""
+    return cache_dir('layouts')
+
+class LayoutCache:
+    """A cache of laid-out graphs, keyed by layout backend and canonical hash
+
+    Laying out a graph is much slower than checking whether it is isomorphic to one that has been laid out
+    before, so :meth:`layout` keeps the `max_size` most recently used layouts in memory and, if `directory`
+    is given, also on disk (where they are never evicted). Every entry holds the graph as it was passed in,
+    plus the laid-out copy, which can contain extra identity boxes added by `layer_decomp`. A cached layout
+    is only used if the stored graph is isomorphic to the new one, so hash collisions can't produce the
+    wrong picture.
+    """
+
+    def __init__(self, max_size: int = 512, directory: str = '') -> None:
+        self.max_size = max_size
+        self.directory = directory
+        self.__entries: OrderedDict[str, Tuple[Graph, Graph]] = OrderedDict()
+
+    def layout(self, g: Graph, backend: str = 'layered') -> Graph:
+        """Return a laid-out copy of `g`, using a cached layout if possible
+
+        The result has the same vertex and edge names as `g`, plus the identity boxes added by the layout,
+        and the labels, colours and highlighting are always taken from `g`.
+        """
+        key = f'{backend}-{g.canonical_hash():016x}'
+        entry = self.__entries.get(key) or self.__load(key)
+        if entry:
+            orig, laid_out = entry
+            iso = find_iso(orig, g)
+            if iso:
+                self.__put(key, entry)
+                return relabel_layout(g, iso.vmap, iso.emap, laid_out)
+
+        h = g.copy()
+        layout_graph(h, backend)
+        self.store(g, h, backend)
+        return h
+
+    def store(self, g: Graph, laid_out: Graph, backend: str = 'layered') -> None:
+        """Use `laid_out` as the layout of `g`, e.g. if it was computed by :func:`incremental_layout`
+
+        The vertices and edges of `g` should have the same names in `laid_out`.
+        """
+        key = f'{backend}-{g.canonical_hash():016x}'
+        self.__put(key, (g.copy(), laid_out.copy()))
+        self.__save(key, g, laid_out)
+
+    def __put(self, key: str, entry: Tuple[Graph, Graph]) -> None:
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget all layouts kept in memory"""
+        self.__entries.clear()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def __load(self, key: str) -> Optional[Tuple[Graph, Graph]]:
+        if not self.directory: return None
+        try:
+            with open(self.__path(key)) as f:
+                j = json.load(f)
+            return (graph_from_json(j['graph']), graph_from_json(j['layout']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def __save(self, key: str, g: Graph, h: Graph) -> None:
+        if not self.directory: return
+        try:
+            write_json(self.__path(key), {'graph': graph_to_json(g, drawing=True),
+                                          'layout': graph_to_json(h, drawing=True)})
+        except (OSError, TypeError, ValueError):
+            pass
+
+def relabel_layout(g: Graph, vmap: Dict[int, int], emap: Dict[int, int], laid_out: Graph) -> Graph:
+    """Return a copy of `laid_out` using the names, labels, colours and highlighting of `g`
+
+    Here `vmap` and `emap` send the vertices and edges of `laid_out` that came from the original graph to
+    the corresponding ones in `g`. The remaining vertices and edges belong to identity boxes added by
+    `layer_decomp`. These get fresh names, and are highlighted whenever the wire they extend is.
+    """
+    h = Graph()
+    h.vindex = g.vindex
+    h.eindex = g.eindex
+    geo = h.ensure_geometry()
+    laid_out_geo = laid_out.geometry or Geometry()
+    vhighlight, ehighlight = g.highlighted()
+    vnames: Dict[int, int] = dict()
+    for v, vd in laid_out.vdata.items():
+        if v in vmap:
+            wd = g.vdata[vmap[v]]
+            vnames[v] = h.add_vertex(vd.vtype, vd.size, vd.infer_type, vd.infer_size, wd.value, name=vmap[v])
+            if vmap[v] in vhighlight: geo.vhighlight.add(vnames[v])
+        else:
+            vnames[v] = h.add_vertex(vd.vtype, vd.size, vd.infer_type, vd.infer_size, vd.value)
+        geo.vpos[vnames[v]] = laid_out_geo.get_vertex(v).copy()
+
+    # identity boxes are added after the wire they extend, so handle them in order
+    for e in sorted(laid_out.edges()):
+        ed = laid_out.edata[e]
+        s = [vnames[v] for v in ed.s]
+        t = [vnames[v] for v in ed.t]
+        if e in emap:
+            fd = g.edata[emap[e]]
+            e1 = h.add_edge(s, t, fd.value, fd.fg, fd.bg, ed.hyper, name=emap[e])
+            if emap[e] in ehighlight: geo.ehighlight.add(e1)
+        else:
+            e1 = h.add_edge(s, t, ed.value, ed.fg, ed.bg, ed.hyper)
+            if len(s) == 1 and len(t) == 1 and s[0] in geo.vhighlight:
+                geo.ehighlight.add(e1)
+                geo.vhighlight.add(t[0])
+        geo.epos[e1] = laid_out_geo.get_edge(e).copy()
+
+    h.set_inputs([vnames[v] for v in laid_out.inputs()])
+    h.set_outputs([vnames[v] for v in laid_out.outputs()])
+    return h
+
+# the cache used by the editor
+layout_cache = LayoutCache()
 
 
 # def layer_layout(g: Graph) -> None:
@@ -14,8 +14,11 @@
 # limitations under the License.
 
 from __future__ import annotations
-from typing import Set, List, Dict, Iterator, Optional, Iterable
-from .graph import Graph
+from dataclasses import dataclass, field
+from typing import Any, Set, List, Dict, FrozenSet, Iterator, Optional, Iterable, Tuple
+import time
+from . import trace
+from .graph import EdgeSignature, Graph
 from .rule import Rule
 
 DEBUG_MATCH = False
@@ -24,13 +27,68 @@ def match_log(s: str) -> None:
     if DEBUG_MATCH:
         print(s)
 
+@dataclass
+class MatchStats:
+    """Counters for the searches made for the matches of one rule
+
+    `candidates` counts the edges and vertices the search tried to map, and `failures` counts the ones that
+    were rejected, by the reason stored in `Match.failure`. `matches` counts the matches returned, and
+    `non_convex` the complete matches dropped because they weren't convex. `time` is the time spent
+    searching, in seconds.
+    """
+    searches: int = 0
+    candidates: int = 0
+    failures: Dict[str, int] = field(default_factory=dict)
+    matches: int = 0
+    non_convex: int = 0
+    time: float = 0.0
+
+# statistics collected for each rule name, if enabled. While this is None, nothing is counted or timed.
+match_stats: Optional[Dict[str, MatchStats]] = None
+
+def enable_stats() -> None:
+    """Start collecting `MatchStats` for each rule, discarding any collected so far"""
+    global match_stats
+    match_stats = dict()
+
+def disable_stats() -> None:
+    """Stop collecting statistics"""
+    global match_stats
+    match_stats = None
+
+def stats_for(name: str) -> Optional[MatchStats]:
+    """Return the statistics to update when matching the rule `name`, or None if stats are disabled"""
+    if match_stats is None: return None
+    if name not in match_stats: match_stats[name] = MatchStats()
+    return match_stats[name]
+
+def format_stats(stats: Dict[str, MatchStats]) -> str:
+    """Format statistics as a table, with the rules that took the most time first"""
+    lines = [f'{"rule":<24} {"searches":>9} {"nodes":>10} {"backtracks":>10} {"matches":>8} '
+             f'{"non-convex":>10} {"time":>9}  failures']
+    for name, st in sorted(stats.items(), key=lambda item: -item[1].time):
+        failures = ', '.join(f'{reason}: {n}' for reason, n in
+                             sorted(st.failures.items(), key=lambda item: -item[1]))
+        lines.append(f'{name or "<anonymous>":<24} {st.searches:>9} {st.candidates:>10} '
+                     f'{sum(st.failures.values()):>10} {st.matches:>8} {st.non_convex:>10} '
+                     f'{st.time:>8.3f}s  {failures}')
+    return '\n'.join(lines)
+
 class Match:
+    """A partial map from the graph `dom` to the graph `cod`
+
+    Every vertex or edge added to the match is also recorded on `trail`, so the
+    match can be cheaply rolled back to an earlier state using `undo`. This lets
+    the matcher explore the search tree with a single mutable `Match`.
+    """
     dom: Graph
     cod: Graph
     vmap: Dict[int,int]
     vimg: Set[int]
     emap: Dict[int,int]
     eimg: Set[int]
+    trail: List[Tuple[bool,int,bool]]
+    failure: str
 
     def __init__(self, dom: Optional[Graph]=None, cod: Optional[Graph]=None, m: Optional[Match]=None) -> None:
         if m:
@@ -40,6 +98,7 @@ class Match:
             self.vimg = m.vimg.copy()
             self.emap = m.emap.copy()
             self.eimg = m.eimg.copy()
+            self.trail = []
         elif dom and cod:
             self.dom = dom
             self.cod = cod
@@ -47,8 +106,11 @@ class Match:
             self.vimg = set()
             self.emap = dict()
             self.eimg = set()
+            self.trail = []
         else:
             raise ValueError("Must provide either a match or a pair of graphs")
+        # why the last call to try_add_vertex or try_add_step failed, for `MatchStats`
+        self.failure = ''
 
     def __str__(self) -> str:
         return "  vmap: {}\n  emap: {}".format(str(self.vmap), str(self.emap))
@@ -56,75 +118,109 @@ class Match:
     def copy(self) -> Match:
         return Match(m=self)
 
+    def add_vertex(self, v: int, cod_v: int) -> None:
+        """Map `v` to `cod_v`, recording the change on the trail"""
+        new_img = cod_v not in self.vimg
+        self.vmap[v] = cod_v
+        if new_img: self.vimg.add(cod_v)
+        self.trail.append((True, v, new_img))
+
+    def add_edge(self, e: int, cod_e: int) -> None:
+        """Map `e` to `cod_e`, recording the change on the trail"""
+        self.emap[e] = cod_e
+        self.eimg.add(cod_e)
+        self.trail.append((False, e, True))
+
+    def undo(self, mark: int) -> None:
+        """Roll back all changes made since the trail had length `mark`"""
+        while len(self.trail) > mark:
+            is_vertex, x, new_img = self.trail.pop()
+            if is_vertex:
+                cod_v = self.vmap.pop(x)
+                if new_img: self.vimg.discard(cod_v)
+            else:
+                self.eimg.discard(self.emap.pop(x))
+
     def try_add_vertex(self, v: int, cod_v: int) -> bool:
-        match_log("trying to add vertex {} -> {} to match:".format(v, cod_v))
-        match_log(str(self))
+        if DEBUG_MATCH:
+            match_log("trying to add vertex {} -> {} to match:".format(v, cod_v))
+            match_log(str(self))
 
         # if the vertex is already mapped, only check the new mapping is consistent
         if v in self.vmap:
-            match_log("vertex already mapped to {}".format(self.vmap[v]))
-            return self.vmap[v] == cod_v
+            if DEBUG_MATCH: match_log("vertex already mapped to {}".format(self.vmap[v]))
+            if self.vmap[v] == cod_v: return True
+            self.failure = 'inconsistent'
+            return False
 
         # Ensure vertices are mapped to vertices of the same vtype and size
-        domain_vertex_type = self.dom.vertex_data(v).vtype
-        codomain_vertex_type = self.cod.vertex_data(cod_v).vtype
+        domain_vertex_type = self.dom.vdata[v].vtype
+        codomain_vertex_type = self.cod.vdata[cod_v].vtype
         if domain_vertex_type != codomain_vertex_type:
-            match_log(f'vertex failed: vtypes {domain_vertex_type} != '
-                      + f'{codomain_vertex_type} do not match.')
+            if DEBUG_MATCH: match_log(f'vertex failed: vtypes {domain_vertex_type} != '
+                                      + f'{codomain_vertex_type} do not match.')
+            self.failure = 'vtype'
             return False
-        domain_vertex_size = self.dom.vertex_data(v).size
-        codomain_vertex_size = self.cod.vertex_data(cod_v).size
+        domain_vertex_size = self.dom.vdata[v].size
+        codomain_vertex_size = self.cod.vdata[cod_v].size
         if domain_vertex_size != codomain_vertex_size:
-            match_log(f'vertex failed: sizes {domain_vertex_size} != '
-                      + f'{codomain_vertex_size} do not match.')
+            if DEBUG_MATCH: match_log(f'vertex failed: sizes {domain_vertex_size} != '
+                                      + f'{codomain_vertex_size} do not match.')
+            self.failure = 'vtype'
             return False
 
         if self.cod.is_boundary(cod_v) and not self.dom.is_boundary(v):
-            match_log("vertex failed: cod v is boundary but dom v is not")
+            if DEBUG_MATCH: match_log("vertex failed: cod v is boundary but dom v is not")
+            self.failure = 'boundary'
             return False
 
         # matches are only allowed to be non-injective on the boundary
         if cod_v in self.vimg:
             if not self.dom.is_boundary(v):
-                match_log("vertex failed: non-injective on interior vertex")
+                if DEBUG_MATCH: match_log("vertex failed: non-injective on interior vertex")
+                self.failure = 'non-injective'
                 return False
             for dv, cv in self.vmap.items():
                 if cv == cod_v and not self.dom.is_boundary(dv):
-                    match_log("vertex failed: non-injective on interior vertex")
+                    if DEBUG_MATCH: match_log("vertex failed: non-injective on interior vertex")
+                    self.failure = 'non-injective'
                     return False
-        self.vmap[v] = cod_v
-        self.vimg.add(cod_v)
+        self.add_vertex(v, cod_v)
 
         # unless v is a boundary, check that nhd(v) and nhd(vmap(v)) are the same size. Because
         # matchings are required to be injective on edges, this will guarantee that the gluing
         # conditions are satisfied.
         if not self.dom.is_boundary(v):
             if len(self.dom.in_edges(v)) != len(self.cod.in_edges(cod_v)):
-                match_log("vertex failed: in_edges cannot satisfy gluing conds")
+                if DEBUG_MATCH: match_log("vertex failed: in_edges cannot satisfy gluing conds")
+                self.failure = 'gluing'
                 return False
             if len(self.dom.out_edges(v)) != len(self.cod.out_edges(cod_v)):
-                match_log("vertex failed: out_edges cannot satisfy gluing conds")
+                if DEBUG_MATCH: match_log("vertex failed: out_edges cannot satisfy gluing conds")
+                self.failure = 'gluing'
                 return False
 
-        match_log("vertex success")
+        if DEBUG_MATCH: match_log("vertex success")
         return True
 
     def try_add_edge(self, e: int, cod_e: int) -> bool:
-        match_log("trying to add edge {} -> {} to match:".format(e, cod_e))
-        match_log(str(self))
+        if DEBUG_MATCH:
+            match_log("trying to add edge {} -> {} to match:".format(e, cod_e))
+            match_log(str(self))
 
-        e_val = self.dom.edge_data(e).value
-        cod_e_val = self.cod.edge_data(cod_e).value
+        e_val = self.dom.edata[e].value
+        cod_e_val = self.cod.edata[cod_e].value
         if e_val != cod_e_val:
-            match_log("edge failed: values {} != {}".format(e_val, cod_e_val))
+            if DEBUG_MATCH: match_log("edge failed: values {} != {}".format(e_val, cod_e_val))
+            self.failure = 'value'
             return False
 
         if cod_e in self.eimg:
-            match_log("edge failed: non-injective")
+            if DEBUG_MATCH: match_log("edge failed: non-injective")
+            self.failure = 'non-injective'
             return False
 
-        self.emap[e] = cod_e
-        self.eimg.add(cod_e)
+        self.add_edge(e, cod_e)
 
         # compare sources and targets
         s = self.dom.source(e)
@@ -134,34 +230,38 @@ class Match:
 
         # first the lengths need to be the same
         if len(s) != len(cod_s) or len(t) != len(cod_t):
-            match_log("edge failed: source or target len doesn't match image")
+            if DEBUG_MATCH: match_log("edge failed: source or target len doesn't match image")
+            self.failure = 'edge'
             return False
 
-        # Input and output vtypes of the edge must match
-        preimg_edge_domain = self.dom.edge_domain(e)
-        image_edge_domain = self.cod.edge_domain(cod_e)
-        if preimg_edge_domain != image_edge_domain:
-            match_log(f'Edge input type {preimg_edge_domain} does not '
-                      + f'match image type {image_edge_domain}.')
-
-        preimg_edge_codomain = self.dom.edge_codomain(e)
-        image_edge_codomain = self.cod.edge_codomain(cod_e)
-        if preimg_edge_codomain != image_edge_codomain:
-            match_log(f'Edge output type {preimg_edge_codomain} does not '
-                      + f'match image type {image_edge_codomain}.')
+        # Input and output vtypes of the edge must match. This is enforced when the vertices are added
+        # below, so the types are only compared here to explain failures when debugging.
+        if DEBUG_MATCH:
+            preimg_edge_domain = self.dom.edge_domain(e)
+            image_edge_domain = self.cod.edge_domain(cod_e)
+            if preimg_edge_domain != image_edge_domain:
+                match_log(f'Edge input type {preimg_edge_domain} does not '
+                          + f'match image type {image_edge_domain}.')
+
+            preimg_edge_codomain = self.dom.edge_codomain(e)
+            image_edge_codomain = self.cod.edge_codomain(cod_e)
+            if preimg_edge_codomain != image_edge_codomain:
+                match_log(f'Edge output type {preimg_edge_codomain} does not '
+                          + f'match image type {image_edge_codomain}.')
 
         # then, each vertex that is already mapped needs to be consistent
         for v1, cod_v1 in zip(s + t, cod_s + cod_t):
             if v1 in self.vmap:
                 if self.vmap[v1] != cod_v1:
-                    match_log("edge failed: inconsistent with previously mapped vertex")
+                    if DEBUG_MATCH: match_log("edge failed: inconsistent with previously mapped vertex")
+                    self.failure = 'inconsistent'
                     return False
             else:
                 if not self.try_add_vertex(v1, cod_v1):
-                    match_log("edge failed: couldn't add a vertex")
+                    if DEBUG_MATCH: match_log("edge failed: couldn't add a vertex")
                     return False
         
-        match_log("edge success")
+        if DEBUG_MATCH: match_log("edge success")
         return True
 
     def dom_nhd_mapped(self, v: int) -> bool:
@@ -181,15 +281,18 @@ class Match:
         isomorphic results under rewriting, so we don't return a list of all the possible
         matchings.
         """
+        if not any(len(ed.s) == 0 and len(ed.t) == 0 for ed in self.dom.edata.values()):
+            return True
+
         cod_sc = []
         for e in self.cod.edges():
-            ed = self.cod.edge_data(e)
+            ed = self.cod.edata[e]
             if len(ed.s) == 0 and len(ed.t) == 0:
                 cod_sc.append((e, ed.value))
 
         for e in self.dom.edges():
-            match_log("trying to map scalar edge {}".format(e))
-            ed = self.dom.edge_data(e)
+            if DEBUG_MATCH: match_log("trying to map scalar edge {}".format(e))
+            ed = self.dom.edata[e]
             if len(ed.s) != 0 or len(ed.t) != 0: continue
             found = False
             for i in range(len(cod_sc)):
@@ -199,58 +302,54 @@ class Match:
                     self.emap[e] = e1
                     self.eimg.add(e1)
                     found = True
-                    match_log("successfully mapped scalar {} -> {}".format(e, e1))
+                    if DEBUG_MATCH: match_log("successfully mapped scalar {} -> {}".format(e, e1))
                     break
             if not found:
-                match_log("match failed: could not map scalar edge {}".format(e))
+                if DEBUG_MATCH: match_log("match failed: could not map scalar edge {}".format(e))
                 return False
 
         return True
 
 
 
-    def more(self) -> List[Match]:
-        # a list of partial matches the same as this one, but matching 1 more vertex or edge
-        ms = []
-
-        # first, try to complete nhds of vertices already matched
-        for v in self.vmap:
-            # check if a vertex's nhd is already fully mapped
-            if self.dom_nhd_mapped(v): continue
-            cod_v = self.vmap[v]
-
-            # try to extend the match by mapping the next in_edge
-            for e in self.dom.in_edges(v):
-                if e in self.emap: continue
-                for cod_e in self.cod.in_edges(cod_v):
-                    m1 = self.copy()
-                    if m1.try_add_edge(e, cod_e):
-                        ms.append(m1)
-                return ms
-
-            # if there are no unmapped in_edges, try to match the next out_edge
-            for e in self.dom.out_edges(v):
-                if e in self.emap: continue
-                for cod_e in self.cod.out_edges(cod_v):
-                    m1 = self.copy()
-                    if m1.try_add_edge(e, cod_e):
-                        ms.append(m1)
-                return ms
-            
-        # if there are no more vertices with partially-mapped nhds,  try to match a new vertex
-        for v in self.dom.vertices():
-            # already looked at these
-            if v in self.vmap: continue
-            
-            # create a new match for every possible place v can go
-            for cod_v in self.cod.vertices():
-                m1 = self.copy()
-                if m1.try_add_vertex(v, cod_v):
-                    ms.append(m1)
-            return ms
-
-        return []
-    
+    def try_add_step(self, step: PlanStep, cod_e: int) -> bool:
+        """Try to map the edge of a `SearchPlan` step to `cod_e`
+
+        This does the same checks as `try_add_edge`, but using the values the plan precomputed for the edge
+        and its ports.
+        """
+        e, _, _, value, num_s, num_t, ports = step
+        ed = self.cod.edata[cod_e]
+        if ed.value != value or len(ed.s) != num_s or len(ed.t) != num_t or cod_e in self.eimg:
+            self.failure = 'edge'
+            return False
+        self.add_edge(e, cod_e)
+
+        for (v, vtype, size, interior, num_in, num_out), cod_v in zip(ports, ed.s + ed.t):
+            if v in self.vmap:
+                if self.vmap[v] != cod_v:
+                    self.failure = 'inconsistent'
+                    return False
+                continue
+            vd = self.cod.vdata[cod_v]
+            if vd.vtype != vtype or vd.size != size:
+                self.failure = 'vtype'
+                return False
+            if interior:
+                # the image of an interior vertex must be an interior vertex that isn't already in the
+                # image, with the same number of adjacent edges (see `try_add_vertex`)
+                if (vd.in_indices or vd.out_indices or cod_v in self.vimg or
+                    len(vd.in_edges) != num_in or len(vd.out_edges) != num_out):
+                    self.failure = 'interior'
+                    return False
+            elif cod_v in self.vimg:
+                for dv, cv in self.vmap.items():
+                    if cv == cod_v and not self.dom.is_boundary(dv):
+                        self.failure = 'non-injective'
+                        return False
+            self.add_vertex(v, cod_v)
+        return True
+
     def is_total(self) -> bool:
         return len(self.vmap) == self.dom.num_vertices() and len(self.emap) == self.dom.num_edges()
 
@@ -264,50 +363,557 @@ class Match:
         if not self.is_injective():
             return False
 
-        future = self.cod.successors([self.vmap[v] for v in self.dom.outputs() if v in self.vmap])
-        for v in self.dom.inputs():
-            if v in self.vmap and self.vmap[v] in future:
-                return False
-        return True
+        # no path may leave the image of the outputs and come back into the image of the inputs
+        outputs = [self.vmap[v] for v in self.dom.outputs() if v in self.vmap]
+        inputs = [self.vmap[v] for v in self.dom.inputs() if v in self.vmap]
+        return not self.cod.reaches(outputs, inputs)
+
 
 
+# A step of a search plan: the edge to map, the vertex already mapped to find candidates from (or -1 to use
+# all edges with the right signature) and whether the edge is an in-edge of that vertex, then the label and
+# numbers of sources and targets of the edge, and for each port the vertex, its type and size, whether it
+# is interior and if so its numbers of in- and out-edges.
+PlanStep = Tuple[int, int, bool, Any, int, int, List[Tuple[int, Any, int, bool, int, int]]]
+
+class SearchPlan:
+    """A compiled order in which to match the edges of `dom`
+
+    Each connected component of `dom` is matched by first choosing an edge (the root) and then visiting
+    the rest of the component, always taking next the unvisited edge with the most ports that are already
+    mapped, breaking ties by arity. So every edge after the root is found by looking at the edges around a
+    mapped vertex, rather than at all of the edges of the graph, and the steps that are most likely to fail
+    are taken first. The checks for each step are computed once, when the plan for a root is first used.
+
+    Plans only depend on `dom`, so `search_plan` caches them on the graph until it is modified. They aren't
+    shared with copies of `dom`, since the steps are read from `dom` itself when they are first used.
+    """
+    dom: Graph
+
+    def __init__(self, dom: Graph) -> None:
+        self.dom = dom
+        self.signatures: Dict[int, EdgeSignature] = dict()
+        # the connected components of the edges that aren't scalars, and the vertices with no edges
+        self.components: List[List[int]] = []
+        self.component_of: Dict[int, int] = dict()
+        self.isolated: List[int] = []
+        self.__orders: Dict[Tuple[bool, int], List[PlanStep]] = dict()
+
+        seen: Set[int] = set()
+        for v in dom.vertices():
+            if v in seen: continue
+            seen.add(v)
+            if len(dom.in_edges(v)) + len(dom.out_edges(v)) == 0:
+                self.isolated.append(v)
+                continue
+            component: List[int] = []
+            edges_seen: Set[int] = set()
+            stack = [v]
+            while len(stack) > 0:
+                v1 = stack.pop()
+                for e in list(dom.in_edges(v1)) + list(dom.out_edges(v1)):
+                    if e in edges_seen: continue
+                    edges_seen.add(e)
+                    component.append(e)
+                    for v2 in dom.source(e) + dom.target(e):
+                        if v2 not in seen:
+                            seen.add(v2)
+                            stack.append(v2)
+            self.components.append(component)
+
+        for i, component in enumerate(self.components):
+            for e in component:
+                self.component_of[e] = i
+                self.signatures[e] = dom.edge_signature(e)
+
+    def __step(self, e: int, via: int, via_in: bool) -> PlanStep:
+        dom = self.dom
+        ed = dom.edata[e]
+        ports = []
+        for v in ed.s + ed.t:
+            vd = dom.vdata[v]
+            ports.append((v, vd.vtype, vd.size, not dom.is_boundary(v), len(vd.in_edges), len(vd.out_edges)))
+        return (e, via, via_in, ed.value, len(ed.s), len(ed.t), ports)
+
+    def order(self, root_is_vertex: bool, root: int) -> List[PlanStep]:
+        """Return the steps for matching the component containing `root`, which is a vertex or an edge
+
+        If the root is an edge, it is the first step. Otherwise, the root vertex should be mapped before
+        the steps are taken.
+        """
+        key = (root_is_vertex, root)
+        if key in self.__orders: return self.__orders[key]
+
+        dom = self.dom
+        steps: List[PlanStep] = []
+        mapped: Set[int] = set()
+        if root_is_vertex:
+            mapped.add(root)
+            component = self.components[self.component_of[next(iter(dom.in_edges(root) | dom.out_edges(root)))]]
+        else:
+            component = self.components[self.component_of[root]]
+            steps.append(self.__step(root, -1, False))
+            mapped.update(dom.source(root) + dom.target(root))
+        remaining = [e for e in component if root_is_vertex or e != root]
+
+        while len(remaining) > 0:
+            best = -1
+            best_score = (0, 0)
+            for i, e in enumerate(remaining):
+                ports = dom.source(e) + dom.target(e)
+                score = (sum(1 for v in ports if v in mapped), len(ports))
+                if score[0] > 0 and score > best_score:
+                    best, best_score = i, score
+            e = remaining.pop(best)
+            via = next(v for v in dom.target(e) + dom.source(e) if v in mapped)
+            steps.append(self.__step(e, via, via in dom.target(e)))
+            mapped.update(dom.source(e) + dom.target(e))
+
+        self.__orders[key] = steps
+        return steps
+
+    def schedule(self, m: Match) -> List[PlanStep]:
+        """Return the steps for extending `m` to a match of all of the edges of `dom`
+
+        Components that `m` already maps part of are matched first, starting from what is mapped. For the
+        rest, the root is the edge with the fewest candidates in `m.cod`, then the highest arity, and
+        components with fewer candidates for their root are matched first, so searches that can't succeed
+        fail quickly.
+        """
+        rooted: List[PlanStep] = []
+        anchored: List[Tuple[int, List[PlanStep]]] = []
+        for component in self.components:
+            root_edge = next((e for e in component if e in m.emap), None)
+            if root_edge is not None:
+                rooted += self.order(False, root_edge)
+                continue
+            root_vertex = next((v for e in component for v in self.dom.source(e) + self.dom.target(e)
+                                if v in m.vmap), None)
+            if root_vertex is not None:
+                rooted += self.order(True, root_vertex)
+                continue
+
+            best = min(component, key=lambda e: (len(m.cod.edges_with_signature(self.signatures[e])),
+                                                 -len(self.dom.source(e)) - len(self.dom.target(e))))
+            anchored.append((len(m.cod.edges_with_signature(self.signatures[best])), self.order(False, best)))
+        anchored.sort(key=lambda x: x[0])
+        for _, steps in anchored: rooted += steps
+        return rooted
+
+def search_plan(dom: Graph) -> SearchPlan:
+    """Return the search plan for `dom`, compiling it the first time it is needed"""
+    return dom.cached('search_plan', SearchPlan)
 
 class Matches(Iterable):
-    def __init__(self, dom: Graph, cod: Graph, initial_match: Optional[Match] = None, convex: bool=True) -> None:
+    """An iterator over all the matches of `dom` in `cod` extending `initial_match`
+
+    The search is a depth-first backtracking search, which maps the edges of `dom` in the order given by
+    its `SearchPlan`, then any vertices with no edges. It keeps a single mutable `Match` along with a stack
+    of choice points, each of which remembers the length of the match's trail when it was created.
+    Backtracking to a choice point rolls the match back using `Match.undo`, so memory use grows with the
+    size of `dom` rather than with the number of branches explored. Each match found is returned as a
+    fresh copy, so it remains valid as the search continues.
+
+    If `name` is given, it should be the name of the rule whose LHS is `dom`, and the search is counted in
+    the statistics for that rule, if they are enabled (see `MatchStats`). Each step of the search is also
+    traced as a span, if tracing is enabled (see :mod:`chyp.trace`).
+    """
+    def __init__(self, dom: Graph, cod: Graph, initial_match: Optional[Match] = None, convex: bool=True,
+                 name: Optional[str] = None) -> None:
         if initial_match is None: initial_match = Match(dom=dom, cod=cod) 
         self.convex = convex
-
-        if initial_match.map_scalars():
-            self.match_stack = [initial_match]
-        else:
-            self.match_stack = []
+        self.match = initial_match.copy()
+        self.stats = stats_for(name) if name is not None else None
+        self.search = self.__search()
+        if self.stats is not None:
+            self.stats.searches += 1
+            self.search = self.__timed(self.search, self.stats)
+        if trace.tracer is not None:
+            self.search = self.__traced(self.search, name or '')
 
     def __iter__(self) -> Iterator:
         return self
 
     def __next__(self) -> Match:
-        while len(self.match_stack) > 0:
-            m = self.match_stack.pop()
-            if m.is_total():
-                match_log("got successful match:\n" + str(m))
-                if self.convex:
-                    if m.is_convex():
-                        match_log("match is convex, returning")
-                        return m
-                    else:
-                        match_log("match is not convex, dropping")
-                else:
-                    return m
+        return next(self.search)
+
+    @staticmethod
+    def __timed(search: Iterator[Match], stats: MatchStats) -> Iterator[Match]:
+        # only the time spent inside the search is counted, not the time the caller spends between matches
+        while True:
+            start = time.perf_counter()
+            m = next(search, None)
+            stats.time += time.perf_counter() - start
+            if m is None: return
+            yield m
+
+    @staticmethod
+    def __traced(search: Iterator[Match], name: str) -> Iterator[Match]:
+        while True:
+            with trace.span('match', rule=name):
+                m = next(search, None)
+            if m is None: return
+            yield m
+
+    def __accept(self, m: Match) -> bool:
+        if DEBUG_MATCH: match_log("got successful match:\n" + str(m))
+        if self.convex:
+            if m.is_convex():
+                if DEBUG_MATCH: match_log("match is convex, returning")
+            else:
+                if DEBUG_MATCH: match_log("match is not convex, dropping")
+                if self.stats is not None: self.stats.non_convex += 1
+                return False
+        if self.stats is not None: self.stats.matches += 1
+        return True
+
+    def __search(self) -> Iterator[Match]:
+        m = self.match
+        if not m.map_scalars(): return
+
+        # steps are edges from the plan, or vertices with no edges, which can be sent anywhere
+        plan = search_plan(m.dom)
+        steps: List[Tuple[bool, Any]] = [(False, step) for step in plan.schedule(m)]
+        steps += [(True, v) for v in plan.isolated if v not in m.vmap]
+
+        def candidates(k: int) -> Iterator[int]:
+            is_vertex, step = steps[k]
+            if is_vertex:
+                return reversed(list(m.cod.vdata.keys()))
+            e, via, via_in = step[0], step[1], step[2]
+            if via == -1:
+                return iter(m.cod.edges_with_signature(plan.signatures[e]))
+            cod_v = m.vmap[via]
+            return reversed(list(m.cod.in_edges(cod_v) if via_in else m.cod.out_edges(cod_v)))
+
+        def next_step(k: int) -> int:
+            # skip the edges already mapped by the initial match
+            while k < len(steps) and not steps[k][0] and steps[k][1][0] in m.emap: k += 1
+            return k
+
+        k = next_step(0)
+        if k == len(steps):
+            if m.is_total() and self.__accept(m): yield m.copy()
+            return
+
+        # choice points: the step, the remaining candidates, and the trail length
+        stack = [(k, candidates(k), len(m.trail))]
+        stats = self.stats
+        while len(stack) > 0:
+            k, cands, mark = stack[-1]
+            m.undo(mark)
+            c = next(cands, None)
+            if c is None:
+                stack.pop()
+                continue
+
+            is_vertex, step = steps[k]
+            if stats is not None: stats.candidates += 1
+            if not (m.try_add_vertex(step, c) if is_vertex else m.try_add_step(step, c)):
+                if stats is not None: stats.failures[m.failure] = stats.failures.get(m.failure, 0) + 1
+                continue
+
+            k1 = next_step(k + 1)
+            if k1 == len(steps):
+                if self.__accept(m): yield m.copy()
             else:
-                self.match_stack += m.more()
-        raise StopIteration
+                stack.append((k1, candidates(k1), len(m.trail)))
 
 def match_graph(dom: Graph, cod: Graph, convex: bool=True) -> Iterable[Match]:
     return Matches(dom, cod, convex=convex)
 
 def match_rule(r: Rule, g: Graph, convex: bool=True) -> Iterable[Match]:
-    return Matches(r.lhs, g, convex=convex)
+    return Matches(r.lhs, g, convex=convex, name=r.name)
+
+class Pattern:
+    """The LHS of a rule, compiled so graphs and places where it can't match are ruled out quickly
+
+    A graph can only contain a match if it has at least as many edges with each signature as the LHS, which
+    can be checked using the graph's signature index without looking at the graph itself.
+
+    One edge of the LHS is also chosen as the anchor, and every match has to send it to an edge of the
+    target with the same signature. If the anchor is attached to an interior vertex of the LHS, the image
+    of that vertex must be an interior vertex with the same number of in- and out-edges, carrying edges
+    with the same labels. These checks are precomputed for each port of the anchor, so most candidate
+    edges can be rejected without starting a search.
+    """
+    lhs: Graph
+    counts: Dict[EdgeSignature, int]
+    anchor: Optional[int]
+    signature: Optional[EdgeSignature]
+    shape: List[Tuple[bool, int, int, int, FrozenSet[Any], FrozenSet[Any]]]
+
+    def __init__(self, lhs: Graph) -> None:
+        self.lhs = lhs
+        self.counts = dict()
+        for e in lhs.edges():
+            sig = lhs.edge_signature(e)
+            self.counts[sig] = self.counts.get(sig, 0) + 1
+        self.anchor = None
+        self.signature = None
+        self.shape = []
+
+        # anchor on the edge with the most interior vertices around it, then the most ports. Scalars are
+        # matched separately by `Match.map_scalars`, so they can't be anchors.
+        def interior_ports(e: int) -> int:
+            return sum(1 for v in lhs.source(e) + lhs.target(e) if not lhs.is_boundary(v))
+        edges = [e for e in lhs.edges() if len(lhs.source(e)) + len(lhs.target(e)) != 0]
+        if len(edges) == 0: return
+        self.anchor = max(edges, key=lambda e: (interior_ports(e), len(lhs.source(e)) + len(lhs.target(e))))
+        self.signature = lhs.edge_signature(self.anchor)
+
+        for is_target, vs in ((False, lhs.source(self.anchor)), (True, lhs.target(self.anchor))):
+            for i, v in enumerate(vs):
+                if lhs.is_boundary(v): continue
+                self.shape.append((is_target, i, len(lhs.in_edges(v)), len(lhs.out_edges(v)),
+                                   frozenset(lhs.edata[e].value for e in lhs.in_edges(v)),
+                                   frozenset(lhs.edata[e].value for e in lhs.out_edges(v))))
+
+    def candidates(self, g: Graph) -> Iterator[int]:
+        """Return the edges of `g` the anchor could be sent to by a match"""
+        if self.signature is None: return
+        for e in g.edges_with_signature(self.signature):
+            ed = g.edata[e]
+            for is_target, i, num_in, num_out, in_values, out_values in self.shape:
+                v = ed.t[i] if is_target else ed.s[i]
+                vd = g.vdata[v]
+                if (len(vd.in_edges) != num_in or len(vd.out_edges) != num_out or g.is_boundary(v) or
+                    frozenset(g.edata[e1].value for e1 in vd.in_edges) != in_values or
+                    frozenset(g.edata[e1].value for e1 in vd.out_edges) != out_values):
+                    break
+            else:
+                yield e
+
+    def may_match(self, g: Graph) -> bool:
+        """Return False if there are certainly no matches of the LHS in `g`"""
+        for sig, n in self.counts.items():
+            if len(g.edges_with_signature(sig)) < n: return False
+        return self.anchor is None or next(self.candidates(g), None) is not None
 
+    def matches(self, g: Graph, convex: bool=True, name: Optional[str] = None) -> Iterator[Match]:
+        """Return all the matches of the LHS in `g`, searching from each candidate for the anchor in turn
+
+        This finds the same matches as `match_graph`, but possibly in a different order.
+        """
+        if self.anchor is None:
+            yield from Matches(self.lhs, g, convex=convex, name=name)
+            return
+
+        stats = stats_for(name) if name is not None else None
+        for e in self.candidates(g):
+            m0 = Match(dom=self.lhs, cod=g)
+            if stats is not None: stats.candidates += 1
+            if not m0.try_add_edge(self.anchor, e):
+                if stats is not None: stats.failures[m0.failure] = stats.failures.get(m0.failure, 0) + 1
+                continue
+            yield from Matches(self.lhs, g, initial_match=m0, convex=convex, name=name)
+
+class RuleSet:
+    """A set of rules whose LHSs are compiled into `Pattern`s and indexed by the signatures of their anchors
+
+    `matches` finds the matches of all the rules in a graph at once. Each signature that doesn't occur in
+    the graph rules out all the rules anchored on it in one step, and the rest only get searched from
+    edges that pass their pattern's local checks.
+
+    `may_match` compiles the LHS of any rule it is given, so it can be used to skip rules that can't match
+    before starting a full search. Compiled patterns are cached by the canonical hash of the LHS, so
+    copies of a rule (e.g. those returned by `Tactic.lookup_rule`) share a pattern.
+    """
+    def __init__(self, rules: Iterable[Rule] = ()) -> None:
+        self.__patterns: Dict[int, List[Pattern]] = dict()
+        self.__rules: Dict[str, Tuple[Rule, Pattern]] = dict()
+        for r in rules: self.add(r)
+
+    def pattern(self, lhs: Graph) -> Pattern:
+        """Return the compiled pattern for `lhs`, compiling it if no isomorphic graph has been seen yet"""
+        patterns = self.__patterns.setdefault(lhs.canonical_hash(), [])
+        # copies share their vertex and edge dictionaries until one of them is modified, so the common
+        # case of a copy of a rule that was seen before doesn't need an isomorphism check
+        for p in patterns:
+            if p.lhs.is_copy_of(lhs): return p
+        for p in patterns:
+            if find_iso(p.lhs, lhs): return p
+        p = Pattern(lhs.copy())
+        patterns.append(p)
+        return p
+
+    def add(self, rule: Rule) -> None:
+        """Add a rule to the set, replacing any rule with the same name"""
+        self.__rules[rule.name] = (rule, Pattern(rule.lhs))
+
+    def may_match(self, rule: Rule, g: Graph) -> bool:
+        """Return False if the LHS of `rule` certainly has no matches in `g`"""
+        return self.pattern(rule.lhs).may_match(g)
+
+    def matches(self, g: Graph, convex: bool=True) -> Iterator[Tuple[Rule, Match]]:
+        """Return pairs of a rule in the set and a match of its LHS in `g`, e.g. for passing to `dpo`"""
+        by_signature: Dict[Optional[EdgeSignature], List[Tuple[Rule, Pattern]]] = dict()
+        for rule, p in self.__rules.values():
+            by_signature.setdefault(p.signature, []).append((rule, p))
+
+        for sig, entries in by_signature.items():
+            if sig is not None and len(g.edges_with_signature(sig)) == 0: continue
+            for rule, p in entries:
+                for m in p.matches(g, convex=convex, name=rule.name):
+                    yield (rule, m)
+
+class LiveMatches:
+    """The matches of `lhs` in a graph, kept up to date as the graph is rewritten
+
+    All the matches are found once, when this is created. After a rewrite, a match is still valid unless
+    it uses a vertex that was in the image of the rewritten LHS or of the new RHS, since only those vertices
+    can be removed or get new edges. So `update` drops the matches using those vertices, then searches for
+    new matches from the edges on the vertices that are left, which only looks at the neighbourhood of the
+    rewritten region.
+
+    Matches are stored whether or not they are convex, since rewriting elsewhere can change that, and
+    convexity is checked when a match is asked for.
+
+    If statistics are enabled, searches are counted under `name` (see `MatchStats`).
+    """
+    lhs: Graph
+    graph: Graph
+    convex: bool
+    name: str
+
+    def __init__(self, lhs: Graph, g: Graph, convex: bool=True, name: str='') -> None:
+        self.lhs = lhs
+        self.graph = g
+        self.convex = convex
+        self.name = name
+        self.__vertices = list(lhs.vertices())
+        self.__edges = list(lhs.edges())
+        self.__by_signature: Dict[EdgeSignature, List[int]] = dict()
+        for e in self.__edges:
+            self.__by_signature.setdefault(lhs.edge_signature(e), []).append(e)
+        # new matches are found by searching from the edges around the rewritten region, so this only works
+        # if every vertex of the LHS is on an edge and there are no scalars. Otherwise, every update
+        # searches the whole graph again.
+        self.__local = (len(self.__edges) != 0 and
+            all(len(lhs.source(e)) + len(lhs.target(e)) != 0 for e in self.__edges) and
+            all(len(lhs.in_edges(v)) + len(lhs.out_edges(v)) != 0 for v in self.__vertices))
+        self.__matches: Dict[Tuple[int, ...], Match] = dict()
+        self.__by_vertex: Dict[int, Set[Tuple[int, ...]]] = dict()
+        self.__search_all()
+
+    def __search_all(self) -> None:
+        self.__matches.clear()
+        self.__by_vertex.clear()
+        for m in Matches(self.lhs, self.graph, convex=False, name=self.name):
+            self.__add(m)
+
+    def __add(self, m: Match) -> None:
+        key = tuple(m.vmap[v] for v in self.__vertices) + tuple(m.emap[e] for e in self.__edges)
+        if key in self.__matches: return
+        self.__matches[key] = m
+        for v in m.vimg:
+            self.__by_vertex.setdefault(v, set()).add(key)
+
+    def __remove(self, key: Tuple[int, ...]) -> None:
+        m = self.__matches.pop(key)
+        for v in m.vimg:
+            keys = self.__by_vertex[v]
+            keys.discard(key)
+            if len(keys) == 0: del self.__by_vertex[v]
+
+    def __len__(self) -> int:
+        return len(self.__matches)
+
+    def update(self, g: Graph, touched: Set[int]) -> None:
+        """Bring the matches up to date after the graph has been rewritten to `g`
+
+        Here, `touched` should contain every vertex that was in the image of a rewritten LHS or of a new RHS.
+        """
+        self.graph = g
+        if not self.__local or 2 * len(touched) > g.num_vertices():
+            self.__search_all()
+            return
+
+        for v in touched:
+            for key in list(self.__by_vertex.get(v, ())):
+                self.__remove(key)
+        for m in self.__matches.values():
+            m.cod = g
+
+        # every new match sends some edge of the LHS to an edge on one of the touched vertices
+        seeds: Set[int] = set()
+        for v in touched:
+            if v not in g.vdata: continue
+            seeds.update(g.in_edges(v))
+            seeds.update(g.out_edges(v))
+        stats = stats_for(self.name)
+        for cod_e in seeds:
+            for e in self.__by_signature.get(g.edge_signature(cod_e), ()):
+                m0 = Match(dom=self.lhs, cod=g)
+                if stats is not None: stats.candidates += 1
+                if not m0.try_add_edge(e, cod_e):
+                    if stats is not None: stats.failures[m0.failure] = stats.failures.get(m0.failure, 0) + 1
+                    continue
+                for m in Matches(self.lhs, g, initial_match=m0, convex=False, name=self.name):
+                    self.__add(m)
+
+    def first(self) -> Optional[Match]:
+        """Return a copy of the first match that is still valid, or None if there are none"""
+        stats = stats_for(self.name)
+        for m in self.__matches.values():
+            if not self.convex or m.is_convex():
+                return m.copy()
+            if stats is not None: stats.non_convex += 1
+        return None
+
+    def all(self) -> List[Match]:
+        """Return copies of all the matches that are still valid"""
+        ms = [m.copy() for m in self.__matches.values() if not self.convex or m.is_convex()]
+        stats = stats_for(self.name)
+        if stats is not None: stats.non_convex += len(self.__matches) - len(ms)
+        return ms
+
+class IncrementalMatcher:
+    """Finds matches of rules in a graph that is repeatedly rewritten, e.g. by the `simp` tactic
+
+    This keeps a `LiveMatches` for each rule it is asked about, along with a log of the vertices touched by
+    each rewrite. A rule's matches are only brought up to date when it is next asked for, so rules that are
+    tried rarely don't cost anything while other rules are being applied.
+    """
+    graph: Graph
+
+    def __init__(self, g: Graph) -> None:
+        self.graph = g
+        self.__log: List[Set[int]] = []
+        self.__live: Dict[str, Tuple[LiveMatches, int]] = dict()
+
+    def first_match(self, rule: Rule, convex: bool=True) -> Optional[Match]:
+        """Return a match of the LHS of `rule` in the current graph, or None if there are none"""
+        return self.__live_matches(rule, convex).first()
+
+    def matches(self, rule: Rule, convex: bool=True) -> List[Match]:
+        """Return all the matches of the LHS of `rule` in the current graph"""
+        return self.__live_matches(rule, convex).all()
+
+    def __live_matches(self, rule: Rule, convex: bool) -> LiveMatches:
+        live: Optional[LiveMatches] = None
+        if rule.name in self.__live:
+            live, seen = self.__live[rule.name]
+            if not live.lhs.is_copy_of(rule.lhs) or live.convex != convex:
+                live = None
+            elif seen < len(self.__log):
+                live.update(self.graph, set().union(*self.__log[seen:]))
+
+        if live is None:
+            live = LiveMatches(rule.lhs, self.graph, convex=convex, name=rule.name)
+        self.__live[rule.name] = (live, len(self.__log))
+        return live
+
+    def rewritten(self, m_g: Match, m_h: Match, g: Graph) -> None:
+        """Record that the graph has been rewritten to `g`
+
+        Here, `m_g` is the match of the rule's LHS that was rewritten and `m_h` is the match of its RHS into
+        the result, as returned by `dpo`. The graph `g` should be the result itself, or a copy of it.
+        """
+        self.__log.append(set(m_g.vmap.values()) | set(m_h.vmap.values()))
+        self.graph = g
+
+@trace.traced('find_iso')
 def find_iso(g: Graph, h: Graph) -> Optional[Match]:
     g_in = g.inputs()
     g_out = g.outputs()
@@ -315,6 +921,18 @@ def find_iso(g: Graph, h: Graph) -> Optional[Match]:
     h_out = h.outputs()
     if len(g_in) != len(h_in) or len(g_out) != len(h_out): return None
 
+    # rule out most non-isomorphic pairs before searching, first with cheap invariants and then with the
+    # canonical hashes, which are cached on each graph
+    if g.num_vertices() != h.num_vertices() or g.num_edges() != h.num_edges(): return None
+    if g.canonical_hash() != h.canonical_hash(): return None
+
+    # if both graphs can be numbered canonically, they are isomorphic exactly when they look the same in
+    # that numbering, so there is no need to search
+    g_order = g.canonical_order()
+    h_order = h.canonical_order()
+    if g_order and h_order:
+        return iso_from_orders(g, h, g_order, h_order)
+
     m0 = Match(dom=g, cod=h)
     for i in range(len(g_in)):
         if not m0.try_add_vertex(g_in[i], h_in[i]): return None
@@ -325,3 +943,32 @@ def find_iso(g: Graph, h: Graph) -> Optional[Match]:
         if m.is_surjective(): return m
 
     return None
+
+def iso_from_orders(g: Graph, h: Graph, g_order: Tuple[List[int], List[int]],
+                    h_order: Tuple[List[int], List[int]]) -> Optional[Match]:
+    """Return the isomorphism sending the vertices and edges of `g` to those of `h` in the given orders
+
+    If this is not an isomorphism, e.g. because the labels or connectivity differ, return None.
+    """
+    (g_verts, g_edges), (h_verts, h_edges) = g_order, h_order
+    if len(g_verts) != len(h_verts) or len(g_edges) != len(h_edges): return None
+
+    gv, hv = g.vdata, h.vdata
+    for v, w in zip(g_verts, h_verts):
+        if gv[v].vtype != hv[w].vtype or gv[v].size != hv[w].size: return None
+
+    vmap = dict(zip(g_verts, h_verts))
+    ge, he = g.edata, h.edata
+    for e, f in zip(g_edges, h_edges):
+        ed, fd = ge[e], he[f]
+        if ed.value != fd.value or [vmap[v] for v in ed.s] != fd.s or [vmap[v] for v in ed.t] != fd.t:
+            return None
+    if [vmap[v] for v in g.inputs()] != h.inputs() or [vmap[v] for v in g.outputs()] != h.outputs():
+        return None
+
+    m = Match(dom=g, cod=h)
+    m.vmap = vmap
+    m.vimg = set(h_verts)
+    m.emap = dict(zip(g_edges, h_edges))
+    m.eimg = set(h_edges)
+    return m
@@ -13,21 +13,112 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os.path
-from typing import Dict, Optional, Tuple
-import networkx as nx
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
 from nx_yaml import NxSafeLoader
 import yaml
 
-from . import state
+from . import state, trace
 
 
-# cache parse trees for imported files and only re-parse if the file changes
-parse_cache: Dict[str, Tuple[float, nx.Graph]] = dict()
+# cache the contents of imported files and only re-read them if the file changes. This holds the text
+# rather than the token stream returned by `yaml.scan`, which is a generator and can only be used once.
+parse_cache: Dict[str, Tuple[float, str]] = dict()
+
+# for each (file name, namespace) parsed from code, the hash of each document in the last version of the
+# code, along with a copy of the state right after that document was transformed
+document_cache: Dict[Tuple[str, str], List[Tuple[str, state.State]]] = dict()
+
+# a '---' marker in column 0 always starts a new document, even inside a multi-line scalar
+DOCUMENT_START_RE = re.compile(r'^---(?=[ \t\r\n]|\Z)', re.MULTILINE)
+# text before the first document marker with no content of its own
+PREAMBLE_RE = re.compile(r'\A(?:[ \t]*(?:[#%].*)?(?:\r?\n|\Z))*\Z')
+
+def split_documents(code: str) -> List[Tuple[int, int, str]]:
+    """Split a YAML stream into chunks that can be scanned and transformed one at a time
+
+    Every chunk but the first starts with a '---' marker. The first chunk holds the first document of the
+    stream, which includes the first marker if nothing but comments and directives come before it. Returns
+    a list of triples, giving the position, line number and text of each chunk.
+    """
+    starts = [0] + [m.start() for m in DOCUMENT_START_RE.finditer(code) if m.start() != 0]
+    if len(starts) > 1 and PREAMBLE_RE.match(code, 0, starts[1]):
+        del starts[1]
+    ends = starts[1:] + [len(code)]
+
+    chunks = []
+    line = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        if i > 0: line += code.count('\n', starts[i-1], start)
+        chunks.append((start, line, code[start:end]))
+    return chunks
+
+def shift_marks(tokens: Iterator[yaml.Token], index: int, line: int) -> Iterator[yaml.Token]:
+    """Move the positions of tokens scanned from a chunk of a file to their positions in the whole file"""
+    for token in tokens:
+        if index != 0 or line != 0:
+            m = token.start_mark
+            token.start_mark = yaml.Mark(m.name, m.index + index, m.line + line, m.column, None, None)
+            m = token.end_mark
+            token.end_mark = yaml.Mark(m.name, m.index + index, m.line + line, m.column, None, None)
+        yield token
+
+@trace.traced('parse', lambda code, file_name='', namespace='': {'file': file_name})
+def parse_documents(code: str, file_name: str='', namespace: str='') -> state.State:
+    """Parse a YAML stream, only transforming the documents that changed since the last call
+
+    This keeps a copy of the state after each document of `code`. On the next call with the same file name
+    and namespace, parsing resumes from the state after the longest unchanged prefix of documents, so
+    re-parsing after an edit only costs as much as the documents after the first one that changed. Rewrite
+    steps from the unchanged prefix are copied into the new state, along with their status and errors.
+    """
+    global document_cache
+
+    chunks = split_documents(code)
+    hashes = [hashlib.sha1(text.encode('utf-8')).hexdigest() for _, _, text in chunks]
+
+    cached = document_cache.get((file_name, namespace), [])
+    k = 0
+    while k < len(cached) and k < len(chunks) and cached[k][0] == hashes[k]:
+        k += 1
+    snapshots = cached[:k]
+
+    if k > 0:
+        parse_data = cached[k-1][1].copy()
+        # the old state keeps its own rewrite steps, so the new one gets copies, along with the errors from
+        # checking them. The snapshots are only ever copied, so they can share the new steps, which keeps
+        # the results of checking them for the next call.
+        copies = {id(rw): rw.copy(parse_data) for rw in parse_data.rewrites.values()}
+        for name, rw in parse_data.rewrites.items():
+            parse_data.rewrites[name] = copies[id(rw)]
+            parse_data.errors += rw.errors
+        for _, snapshot in snapshots:
+            for name, rw in snapshot.rewrites.items():
+                if id(rw) in copies: snapshot.rewrites[name] = copies[id(rw)]
+    else:
+        parse_data = state.State(namespace, file_name)
+
+    line = 0
+    try:
+        for (index, line, text), h in zip(chunks[k:], hashes[k:]):
+            with trace.span('transform', file=file_name, line=line + 1):
+                parse_data.transform(shift_marks(yaml.scan(text, Loader=NxSafeLoader), index, line))
+            snapshots.append((h, parse_data.copy()))
+        parse_data.parsed = True
+    except yaml.MarkedYAMLError as e:
+        parse_data.errors += [(file_name, e.problem_mark.line + line, e.problem)]
+
+    document_cache[(file_name, namespace)] = snapshots
+    return parse_data
 
 def parse(code: str='', file_name: str='', namespace: str='', parent: Optional[state.State] = None) -> state.State:
     global parse_cache
 
+    if code and not parent:
+        return parse_documents(code, file_name, namespace)
+
     if parent and parent.namespace:
         if namespace != '':
             namespace = parent.namespace + '.' + namespace
@@ -46,19 +137,18 @@ def parse(code: str='', file_name: str='', namespace: str='', parent: Optional[s
         parse_data.import_depth = parent.import_depth + 1
         if parse_data.import_depth > 255:
             parse_data.errors += [(parent.file_name, -1, "Maximum import depth (255) exceeded. Probably a cyclic import.")]
+            return parse_data
 
     try:
         if file_name and not code:
             mtime = os.path.getmtime(file_name)
             if file_name in parse_cache and parse_cache[file_name][0] == mtime:
-                tree = parse_cache[file_name][1]
+                code = parse_cache[file_name][1]
             else:
                 with open(file_name) as f:
-                    tree = yaml.scan(f, Loader=NxSafeLoader)
-                parse_cache[file_name] = (mtime, tree)
-        else:
-            tree = yaml.scan(code, Loader=NxSafeLoader)
-        parse_data.transform(tree)
+                    code = f.read()
+                parse_cache[file_name] = (mtime, code)
+        parse_data.transform(yaml.scan(code, Loader=NxSafeLoader))
         parse_data.parsed = True
     except yaml.MarkedYAMLError as e:
         parse_data.errors += [(file_name, e.problem_mark.line, e.problem)]
@@ -67,4 +157,3 @@ def parse(code: str='', file_name: str='', namespace: str='', parent: Optional[s
         parent.sequence = parse_data.sequence
 
     return parse_data
-
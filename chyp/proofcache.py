@@ -0,0 +1,183 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2022 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent cache of proof checking results
+
+Every time a file is parsed, its rewrite steps start out unchecked, so without a cache the same steps get
+checked over and over, both in the editor and across runs of `chyp check`. This module stores the outcome
+of each check in a directory of small JSON files, keyed by a hash of everything the outcome depends on: the
+canonical hashes of the LHS and RHS, the tactic name and arguments, the names and canonical hashes of all
+the rules in scope at the rewrite step, and a hash of the source code of the checker itself (see
+:func:`checker_hash`), so results computed by an older version of a tactic, the matcher or the rewriting
+code are never reused.
+
+Canonical hashes can collide for non-isomorphic graphs, so an entry also stores the LHS and RHS it was
+computed for, along with the rules the tactic actually looked up. A cached result is only used if all of
+these are isomorphic to the current ones, so a collision costs a re-check but can never produce a bogus
+VALID.
+"""
+
+from __future__ import annotations
+from typing import List, Optional, TYPE_CHECKING
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+
+from .diskcache import cache_dir, graph_from_json, graph_to_json, write_json
+from .matcher import find_iso
+
+if TYPE_CHECKING:
+    from .state import RewriteState
+
+# bump this whenever the key or the format of entries changes
+CACHE_VERSION = 2
+
+# the modules whose code decides whether a rewrite step is valid, relative to the package directory
+CHECKER_SOURCES = ['graph.py', 'matcher.py', 'rewrite.py', 'rule.py', 'state.py', 'term.py',
+                   'tactic/__init__.py', 'tactic/ruletac.py', 'tactic/simptac.py']
+
+@functools.lru_cache(maxsize=None)
+def checker_hash() -> str:
+    """Return a hash of the source code of the modules used to check rewrite steps
+
+    This is part of every cache key, so changing how tactics, matching or rewriting behave invalidates
+    the results cached by the old code without having to remember to bump `CACHE_VERSION`. The package
+    version is included too, in case the sources can't be read (e.g. when installed as a zip).
+    """
+    h = hashlib.sha256()
+    try:
+        h.update(importlib.metadata.version('chyp').encode('utf-8'))
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in CHECKER_SOURCES:
+        h.update(name.encode('utf-8'))
+        try:
+            with open(os.path.join(package_dir, name), 'rb') as f:
+                h.update(f.read())
+        except OSError:
+            pass
+    return h.hexdigest()
+
+def default_dir() -> str:
+    """Return the default cache directory"""
+    return cache_dir('proofs')
+
+class ProofCache:
+    """A directory of proof checking results
+
+    Entries are written atomically, so several processes (e.g. the workers of `chyp check`) can share a
+    cache directory. The cache is best-effort: entries that can't be read or written are ignored.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def key(self, rw: RewriteState) -> Optional[str]:
+        """Return the cache key for a rewrite step, or None if the step can't be cached"""
+        if not rw.lhs or not rw.rhs: return None
+
+        state = rw.state
+        scope = [(name, state.rules[name].lhs.canonical_hash(), state.rules[name].rhs.canonical_hash(),
+                  state.rules[name].equiv)
+                 for name, j in sorted(state.rule_sequence.items())
+                 if j <= rw.sequence and name in state.rules]
+        data = (CACHE_VERSION, checker_hash(), rw.lhs.canonical_hash(), rw.rhs.canonical_hash(),
+                rw.tactic.name(), rw.tactic.args, rw.equiv, scope)
+        return hashlib.sha256(repr(data).encode('utf-8')).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def restore(self, rw: RewriteState) -> bool:
+        """Try to set the status of `rw` from the cache
+
+        If there is a matching entry, this sets the status, highlights and errors of the rewrite step exactly
+        as checking it would have, and returns True. Otherwise, it leaves `rw` unchanged and returns False.
+        """
+        key = self.key(rw)
+        if not key or not rw.lhs or not rw.rhs: return False
+
+        try:
+            with open(self.__path(key)) as f:
+                entry = json.load(f)
+            lhs = graph_from_json(entry['lhs'])
+            rhs = graph_from_json(entry['rhs'])
+            rules = {name: (graph_from_json(r_lhs), graph_from_json(r_rhs))
+                     for name, (r_lhs, r_rhs) in entry['rules'].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        iso_lhs = find_iso(lhs, rw.lhs)
+        iso_rhs = find_iso(rhs, rw.rhs)
+        if not iso_lhs or not iso_rhs: return False
+
+        state = rw.state
+        for name, (r_lhs, r_rhs) in rules.items():
+            if (name not in state.rules or
+                not find_iso(r_lhs, state.rules[name].lhs) or
+                not find_iso(r_rhs, state.rules[name].rhs)):
+                return False
+
+        (lhs_verts, lhs_edges), (rhs_verts, rhs_edges) = entry['highlight']
+        if lhs_verts or lhs_edges:
+            rw.lhs.highlight(set(iso_lhs.vmap[v] for v in lhs_verts), set(iso_lhs.emap[e] for e in lhs_edges))
+        if rhs_verts or rhs_edges:
+            rw.rhs.highlight(set(iso_rhs.vmap[v] for v in rhs_verts), set(iso_rhs.emap[e] for e in rhs_edges))
+
+        for message in entry['errors']:
+            state.errors.append((state.file_name, rw.line_number, message))
+
+        rw.status = rw.VALID if entry['valid'] else rw.INVALID
+        return True
+
+    def store(self, rw: RewriteState, errors: List[str]) -> None:
+        """Record the result of checking `rw`, along with the error messages it produced"""
+        key = self.key(rw)
+        if not key or not rw.lhs or not rw.rhs: return
+        if rw.status not in (rw.VALID, rw.INVALID): return
+
+        state = rw.state
+        entry = {
+            'valid': rw.status == rw.VALID,
+            'lhs': graph_to_json(rw.lhs),
+            'rhs': graph_to_json(rw.rhs),
+            'rules': {name: (graph_to_json(state.rules[name].lhs), graph_to_json(state.rules[name].rhs))
+                      for name in sorted(rw.tactic.used_rules()) if name in state.rules},
+            'highlight': [[sorted(s) for s in rw.lhs.highlighted()],
+                          [sorted(s) for s in rw.rhs.highlighted()]],
+            'errors': errors,
+        }
+
+        try:
+            write_json(self.__path(key), entry)
+        except (OSError, TypeError, ValueError):
+            # e.g. an unwritable directory, or edge values that aren't JSON-serialisable
+            pass
+
+# the cache used by RewriteState.check, if any
+cache: Optional[ProofCache] = None
+
+def enable(directory: str = '') -> None:
+    """Cache the results of proof checking in `directory` (by default, :func:`default_dir`)"""
+    global cache
+    cache = ProofCache(directory or default_dir())
+
+def disable() -> None:
+    """Stop caching the results of proof checking"""
+    global cache
+    cache = None
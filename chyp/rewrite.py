@@ -15,16 +15,22 @@
 
 from __future__ import annotations
 from typing import Set, List, Dict, Iterator, Any, Optional, Iterable, Tuple
+from . import trace
 from .graph import Graph
 from .matcher import Match
 from .rule import Rule
 
 
-def dpo(r: Rule, m: Match) -> Iterable[Match]:
+@trace.traced('dpo', lambda r, m, in_place=False: {'rule': r.name})
+def dpo(r: Rule, m: Match, in_place: bool=False) -> Iterable[Match]:
     """Do double-pushout rewriting
 
     Given a rule r and match of r.lhs into a graph, return a match
     of r.rhs into the rewritten graph.
+
+    If in_place is True, the graph m.cod is rewritten itself, rather than
+    a copy of it. Use Graph.checkpoint and Graph.undo to get the original
+    graph back.
     """
     # if not r.is_left_linear():
     #     raise NotImplementedError("Only left linear rules are supported for now")
@@ -34,14 +40,14 @@ def dpo(r: Rule, m: Match) -> Iterable[Match]:
     out_map: Dict[int, int] = dict()
 
     # compute the pushout complement
-    ctx = m.cod.copy()
+    ctx = m.cod if in_place else m.cod.copy()
     for e in r.lhs.edges():
         ctx.remove_edge(m.emap[e])
     for v in r.lhs.vertices():
         v1 = m.vmap[v]
         if r.lhs.is_boundary(v):
-            in_c = len(r.lhs.vertex_data(v).in_indices)
-            out_c = len(r.lhs.vertex_data(v).out_indices)
+            in_c = len(r.lhs.vdata[v].in_indices)
+            out_c = len(r.lhs.vdata[v].out_indices)
             if in_c == 1 and out_c == 1:
                 v1i, v1o = ctx.explode_vertex(v1)
                 if len(v1i) == 1 and len(v1o) == 1:
@@ -77,19 +83,18 @@ def dpo(r: Rule, m: Match) -> Iterable[Match]:
     # then map the interior to new, fresh vertices
     for v in r.rhs.vertices():
         if not r.rhs.is_boundary(v):
-            vd = r.rhs.vertex_data(v)
+            vd = r.rhs.vdata[v]
             v1 = h.add_vertex(
-                vtype=vd.vtype, size=vd.size,
-                x=vd.x, y=vd.y, value=vd.value)
+                vtype=vd.vtype, size=vd.size, value=vd.value)
             m1.vmap[v] = v1
             m1.vimg.add(v1)
 
     # now add the edges from rhs to h and connect them using vmap1
     for e in r.rhs.edges():
-        ed = r.rhs.edge_data(e)
+        ed = r.rhs.edata[e]
         e1 = h.add_edge([m1.vmap[v] for v in ed.s],
                         [m1.vmap[v] for v in ed.t],
-                        ed.value, ed.x, ed.y, ed.fg, ed.bg, ed.hyper)
+                        ed.value, ed.fg, ed.bg, ed.hyper)
         m1.emap[e] = e1
         m1.eimg.add(e1)
 
@@ -107,3 +112,58 @@ def rewrite(r: Rule, m: Match) -> Graph:
     except StopIteration:
         raise RuntimeError("Rewrite has no valid context")
 
+
+def boundary_paths(g: Graph) -> Set[Tuple[int, int]]:
+    """Return the pairs of positions (i, j) in g.inputs() + g.outputs() where there is a path from i to j
+
+    This includes the case where i and j are the same vertex.
+    """
+    bd = g.inputs() + g.outputs()
+    paths = set()
+    for i, v in enumerate(bd):
+        succ = g.successors([v])
+        succ.add(v)
+        for j, w in enumerate(bd):
+            if w in succ: paths.add((i, j))
+    return paths
+
+def disjoint_matches(ms: Iterable[Match]) -> List[Match]:
+    """Greedily choose matches, in order, that don't share any vertices or edges with those already chosen"""
+    chosen: List[Match] = []
+    used_v: Set[int] = set()
+    used_e: Set[int] = set()
+    for m in ms:
+        if used_v.isdisjoint(m.vimg) and used_e.isdisjoint(m.eimg):
+            chosen.append(m)
+            used_v.update(m.vimg)
+            used_e.update(m.eimg)
+    return chosen
+
+@trace.traced('dpo_parallel', lambda r, ms, convex=True, in_place=False: {'rule': r.name, 'matches': len(ms)})
+def dpo_parallel(r: Rule, ms: List[Match], convex: bool=True, in_place: bool=False) -> List[Tuple[Match, Match]]:
+    """Rewrite at several matches at once
+
+    The matches should all be into the same graph and must not share any vertices or edges, e.g. they can
+    be chosen by `disjoint_matches`. Then rewriting at one of them leaves the others unchanged, so they
+    can all be rewritten one after the other in a single copy of the graph (or in the graph itself, if
+    in_place is True), instead of searching again and copying the graph after each rewrite.
+
+    If convex is True and the RHS of r connects boundary vertices that the LHS doesn't, rewriting at one
+    match can create a path that makes a later match non-convex. Such matches are skipped.
+
+    Returns a list of pairs of a match of r.lhs and the corresponding match of r.rhs, for each rewrite
+    done. The RHS matches are all into the rewritten graph. The LHS matches share the same graph as their
+    codomain, so the parts they matched have been rewritten away.
+    """
+    if len(ms) == 0: return []
+    h = ms[0].cod if in_place else ms[0].cod.copy()
+    check_convex = convex and not boundary_paths(r.rhs).issubset(boundary_paths(r.lhs))
+
+    result: List[Tuple[Match, Match]] = []
+    for m in ms:
+        m1 = m.copy()
+        m1.cod = h
+        if check_convex and len(result) != 0 and not m1.is_convex(): continue
+        for m_h in dpo(r, m1, in_place=True):
+            result.append((m1, m_h))
+    return result
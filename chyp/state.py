@@ -20,9 +20,11 @@ import os.path
 from typing import Any, Dict, List, Optional, Tuple
 from .transformer import Meta, YamlTransformer, v_args
 
-from . import parser
+from . import parser, proofcache
 from .graph import Graph, GraphError, gen, perm, identity, redistributer
+from .matcher import Match, RuleSet
 from .rule import Rule, RuleError
+from .term import TermCache
 from .tactic import Tactic
 from .tactic.simptac import SimpTac
 from .tactic.ruletac import RuleTac
@@ -63,6 +65,15 @@ class RewriteState:
         self.lhs_match = lhs_match
         self.rhs_match = rhs_match
 
+        # if the step was closed by a single rewrite, the matches of the rule's LHS and RHS returned by dpo,
+        # and the isomorphism from the rewritten LHS to the RHS of the step. The editor uses these to lay out
+        # the RHS incrementally from the LHS.
+        self.rewrite_matches: Optional[Tuple[Match, Match, Match]] = None
+
+        # the errors produced by the last check of this step, so they can be shown again in a state that
+        # carries it over
+        self.errors: List[Tuple[str, int, str]] = list()
+
         tactic_args = [] if tactic_args is None else tactic_args
 
         self.tactic : Tactic
@@ -75,7 +86,28 @@ class RewriteState:
         self.stub = stub
 
     def check(self) -> None:
-        self.tactic.run_check()
+        cache = proofcache.cache
+        num_errors = len(self.state.errors)
+        if not (cache and cache.restore(self)):
+            self.tactic.run_check()
+            if cache:
+                cache.store(self, [msg for _, _, msg in self.state.errors[num_errors:]])
+        self.errors = self.state.errors[num_errors:]
+
+    def copy(self, state: State) -> RewriteState:
+        """Return a copy of this step belonging to `state`, along with the status and errors of its last check
+
+        The copy gets a fresh tactic. A step that is still being checked is copied as unchecked, since its
+        result will only be recorded on this step.
+        """
+        rw = RewriteState(self.sequence, state, self.line_number, self.term_pos, self.equiv,
+                          self.tactic.name(), self.tactic.args, self.lhs, self.rhs, self.lhs_match,
+                          self.rhs_match, self.stub)
+        if self.status in (RewriteState.VALID, RewriteState.INVALID):
+            rw.status = self.status
+            rw.rewrite_matches = self.rewrite_matches
+            rw.errors = self.errors
+        return rw
 
 
 class State(YamlTransformer):
@@ -90,8 +122,34 @@ class State(YamlTransformer):
         self.rewrites: Dict[str, RewriteState] = dict()
         self.errors: List[Tuple[str, int, str]] = list()
         self.parts: List[Tuple[int, int, str, str]] = list()
+        # terms of graphs produced by tactics, shared with copies of this state
+        self.term_cache = TermCache()
+        # compiled LHSs of the rules used by tactics, also shared with copies
+        self.rule_set = RuleSet()
         self.parsed = False
 
+    def copy(self) -> State:
+        """Return a shallow copy of this state
+
+        The containers are copied, so transforming more code into the copy leaves this state unchanged, but
+        the graphs, rules and rewrite steps in them are shared.
+        """
+        s = State(self.namespace, self.file_name)
+        s.import_depth = self.import_depth
+        s.sequence = self.sequence
+        s.graphs = self.graphs.copy()
+        s.rules = self.rules.copy()
+        s.rule_sequence = self.rule_sequence.copy()
+        s.rewrites = self.rewrites.copy()
+        s.errors = self.errors.copy()
+        s.parts = self.parts.copy()
+        s.term_cache = self.term_cache
+        s.rule_set = self.rule_set
+        s.parsed = self.parsed
+        s.document = self.document
+        s.num_documents = self.num_documents
+        return s
+
     def part_with_index_at(self, pos: int) -> Optional[Tuple[int, Tuple[int,int,str,str]]]:
         p0 = (0, self.parts[0]) if len(self.parts) >= 1 else None
         for (i,p) in enumerate(self.parts):
@@ -17,12 +17,11 @@ from __future__ import annotations
 from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 import re
 
-from ..term import graph_to_term
 from ..graph import Graph
-from ..rewrite import dpo
+from ..rewrite import dpo, dpo_parallel, disjoint_matches
 from ..rule import Rule
-from ..matcher import Match, match_rule, find_iso
-from .. import state
+from ..matcher import IncrementalMatcher, Match, match_rule, find_iso
+from .. import state, trace
 
 RULE_NAME_RE = re.compile('(-)?\\s*([a-zA-Z_][\\.a-zA-Z0-9_]*)')
 
@@ -33,20 +32,27 @@ class Tactic:
     class and only interact with the prover state via its public methods.
     """
 
-    __state: state.State
     __local_state: state.RewriteState
 
     def __init__(self, local_state: state.RewriteState, args: List[str]) -> None:
         self.__local_state = local_state
-        self.__state = local_state.state
         self.__context: Dict[str, Rule] = dict()
         self.__goal_lhs: Optional[Graph] = None
         self.__goal_rhs: Optional[Graph] = None
         self.__errors: Set[str] = set()
+        self.__used_rules: Set[str] = set()
+        # incremental matchers for the graphs rewritten by rewrite_lhs1/rewrite_rhs1, keyed by side and target
+        self.__matchers: Dict[Tuple[bool, str], IncrementalMatcher] = dict()
         # self.__goal_stack: List[Tuple[Graph,Graph]] = []
         self.args = args
 
 
+    @property
+    def __state(self) -> state.State:
+        # look this up every time, since a rewrite step can be moved to a new state when a file is
+        # re-parsed incrementally
+        return self.__local_state.state
+
     def repeat(self, rw: Callable[[str], bool], rules: List[str], max_iter: int=255, bound_lhs: int=-1, bound_rhs: int=-1) -> None:
         got_match = True
         i = 0
@@ -119,6 +125,7 @@ class Tactic:
                 self.error(f'Attempting to use rule {rule_name} before it is defined/proven.')
                 return (None, False)
             rule = self.__state.rules[rule_name]
+            self.__used_rules.add(rule_name)
 
         if not rule:
             self.error(f'Rule {rule_name} not defined.')
@@ -129,6 +136,10 @@ class Tactic:
         else:
             return (rule.copy(), False)
 
+    def used_rules(self) -> Set[str]:
+        """Return the names of the global rules looked up since the last check started"""
+        return self.__used_rules.copy()
+
     def add_refl_to_context(self, graph: Graph, ident: str) -> None:
         """Adds a trivial (reflexivity) rule to the local context, using the provided graph as LHS and RHS
         """
@@ -198,10 +209,11 @@ class Tactic:
         if not target_graph:
             return None
 
-        for m_g in match_rule(rule, target_graph):
-            for m_h in dpo(rule, m_g):
-                self.__set_lhs(target, m_h.cod.copy())
-                yield (m_g, m_h)
+        # most rules tried by e.g. simp don't match at all, so rule those out before searching
+        if not self.__state.rule_set.may_match(rule, target_graph):
+            return None
+
+        yield from self.__rewrite_all(True, rule, target, target_graph)
 
     def rewrite_rhs(self, rule_expr: str, target: str='') -> Iterator[Tuple[Match,Match]]:
         """Rewrite the RHS of the goal or a rule in the local context using the provided rule
@@ -225,20 +237,94 @@ class Tactic:
         if not target_graph:
             return None
 
-        for m_g in match_rule(rule, target_graph):
-            for m_h in dpo(rule, m_g):
-                self.__set_rhs(target, m_h.cod.copy())
-                yield (m_g, m_h)
+        # most rules tried by e.g. simp don't match at all, so rule those out before searching
+        if not self.__state.rule_set.may_match(rule, target_graph):
+            return None
 
-    def rewrite_lhs1(self, rule_expr: str, target: str='') -> bool:
-        for _ in self.rewrite_lhs(rule_expr, target):
+        yield from self.__rewrite_all(False, rule, target, target_graph)
+
+    def __rewrite_all(self, lhs: bool, rule: Rule, target: str, target_graph: Graph) -> Iterator[Tuple[Match,Match]]:
+        """Rewrite `target_graph` at each match of `rule` in turn, setting the LHS or RHS of `target` to the result
+
+        Rather than building each result from scratch, this rewrites a single working copy in place and
+        undoes the rewrite before moving on to the next match. The matches returned are into `target_graph`,
+        which is left unchanged, and into a copy of the result, which stays valid after the next match is
+        asked for. The LHS or RHS of `target` is set to another copy. When the matches run out, `target` is
+        left as it was.
+        """
+        work = target_graph.copy()
+        mark = work.checkpoint()
+        try:
+            for m_g in match_rule(rule, target_graph):
+                m_w = m_g.copy()
+                m_w.cod = work
+                for m_h in dpo(rule, m_w, in_place=True):
+                    m_c = m_h.copy()
+                    m_c.cod = work.copy()
+                    if lhs: self.__set_lhs(target, work.copy())
+                    else: self.__set_rhs(target, work.copy())
+                    yield (m_g, m_c)
+                work.undo(mark)
+            if lhs: self.__set_lhs(target, target_graph)
+            else: self.__set_rhs(target, target_graph)
+        finally:
+            work.commit()
+
+    @trace.traced('rewrite', lambda self, lhs, rule_expr, target, parallel=False: {'rule': rule_expr})
+    def __rewrite1(self, lhs: bool, rule_expr: str, target: str, parallel: bool=False) -> bool:
+        """Rewrite the LHS or RHS of the goal or a rule in the local context once, if the rule matches
+
+        Tactics like simp call this over and over on the same graph, so rather than searching the whole
+        graph for each call, this keeps an `IncrementalMatcher` for each graph it rewrites and only searches
+        around the parts of the graph changed since the rule was last tried.
+
+        If `parallel` is True, this rewrites at a maximal set of non-overlapping matches instead of one.
+        """
+        variance = (target == '') if lhs else (target != '')
+        if not (self.__goal_lhs if lhs else self.__goal_rhs): return False
+        rule, converse = self.lookup_rule(rule_expr)
+        if not rule: return False
+        if not rule.equiv and converse == variance:
+            self.error(f'Attempting to use converse of rule {rule_expr} without proof.')
+            return False
+
+        target_graph = self.__lhs(target) if lhs else self.__rhs(target)
+        if not target_graph:
+            return False
+
+        # the goal can also be changed by other means, e.g. rewrite_lhs, so start again if it has
+        matcher = self.__matchers.get((lhs, target))
+        if not matcher or matcher.graph is not target_graph:
+            matcher = IncrementalMatcher(target_graph)
+            self.__matchers[(lhs, target)] = matcher
+
+        # the goal is only referenced from here, so it can be rewritten in place
+        if parallel:
+            rewrites = dpo_parallel(rule, disjoint_matches(matcher.matches(rule)), in_place=True)
+            for m_g, m_h in rewrites:
+                matcher.rewritten(m_g, m_h, target_graph)
+            return len(rewrites) != 0
+
+        m = matcher.first_match(rule)
+        if not m: return False
+        for m_h in dpo(rule, m, in_place=True):
+            matcher.rewritten(m, m_h, target_graph)
             return True
         return False
 
+    def rewrite_lhs1(self, rule_expr: str, target: str='') -> bool:
+        return self.__rewrite1(True, rule_expr, target)
+
     def rewrite_rhs1(self, rule_expr: str, target: str='') -> bool:
-        for _ in self.rewrite_rhs(rule_expr, target):
-            return True
-        return False
+        return self.__rewrite1(False, rule_expr, target)
+
+    def rewrite_lhs_parallel(self, rule_expr: str, target: str='') -> bool:
+        """Like `rewrite_lhs1`, but rewrite at as many non-overlapping matches as possible at once"""
+        return self.__rewrite1(True, rule_expr, target, parallel=True)
+
+    def rewrite_rhs_parallel(self, rule_expr: str, target: str='') -> bool:
+        """Like `rewrite_rhs1`, but rewrite at as many non-overlapping matches as possible at once"""
+        return self.__rewrite1(False, rule_expr, target, parallel=True)
 
     def validate_goal(self) -> Optional[Match]:
         if not self.__goal_lhs or not self.__goal_rhs: return None
@@ -274,9 +360,19 @@ class Tactic:
         if self.__local_state.rhs:
             self.__local_state.rhs.highlight(vertices, edges)
 
+    def record_rewrite(self, m_lhs: Match, m_rhs: Match, iso: Match) -> None:
+        """Record that the goal was closed by the rewrite `m_lhs`, `m_rhs` of its LHS
+
+        Here `iso` is the isomorphism from the rewritten LHS to the RHS of the goal, as returned by
+        :meth:`validate_goal`.
+        """
+        self.__local_state.rewrite_matches = (m_lhs, m_rhs, iso)
+
     def __reset(self) -> None:
         self.__errors.clear()
         self.__context.clear()
+        self.__used_rules.clear()
+        self.__matchers.clear()
         self.__goal_lhs = self.__local_state.lhs.copy() if self.__local_state.lhs else None
         self.__goal_rhs = self.__local_state.rhs.copy() if self.__local_state.rhs else None
         # self.__goal_stack = []
@@ -289,7 +385,7 @@ class Tactic:
         found_prev = (current == '?')
         next_term = None
         for g in self.make_rhs():
-            t = graph_to_term(g)
+            t = self.__state.term_cache.term(g)
             if found_prev and not t in seen:
                 next_term = t
                 break
@@ -302,8 +398,10 @@ class Tactic:
 
     def run_check(self) -> None:
         self.__local_state.status = state.RewriteState.CHECKING
-        self.__reset()
-        self.check()
+        self.__local_state.rewrite_matches = None
+        with trace.span('tactic', tactic=self.name(), line=self.__local_state.line_number + 1):
+            self.__reset()
+            self.check()
         if self.__local_state.status != state.RewriteState.VALID:
             self.__local_state.status = state.RewriteState.INVALID
 
@@ -43,5 +43,6 @@ class RuleTac(Tactic):
                 rhs_edges = set(iso.emap[e] for e in m_rhs.eimg)
                 self.highlight_lhs(m_lhs.vimg, m_lhs.eimg)
                 self.highlight_rhs(rhs_verts, rhs_edges)
+                self.record_rewrite(m_lhs, m_rhs, iso)
                 return
 
@@ -13,8 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List
+from collections import OrderedDict
+from typing import List, Tuple
+from . import trace
 from .graph import Graph
+from .matcher import find_iso
 
 # def ready_edges(g: Graph, edges: Set[int], v_pos: Mapping[int,float]) -> Set[int]:
 #     ready = set()
@@ -31,50 +34,60 @@ def layer_decomp(g: Graph) -> List[List[int]]:
     can modify `g` by introducing extra vertices and identity boxes.
     """
 
-    e_layers = []
-    v_layer = []
-    v_placed = set()
-
+    e_layers: List[List[int]] = []
+    v_layer: List[int] = []
 
     # first, mark all of the inputs as 'placed' and add dummy edges for any input that is also an output
     outputs = set(g.outputs())
     for v in g.inputs():
         if v in outputs: g.insert_id_after(v)
         v_layer.append(v)
+    outputs = set(g.outputs())
+
+    # Next, place edges in layers. Rather than scanning all of the remaining edges for ones whose sources
+    # have been placed, keep count of the unplaced sources of each edge, and collect the edges whose count
+    # drops to zero as vertices get placed. Each vertex is placed once, so this takes linear time.
+    unplaced = { e : len(set(g.source(e))) for e in g.edges() }
+    ready = [e for e, n in unplaced.items() if n == 0]
+    remaining = len(unplaced) - len(ready)
+    v_placed = set()
+
+    def place(v: int) -> None:
+        nonlocal remaining
+        if v in v_placed: return
         v_placed.add(v)
-    
-    new_ids = set()
-    edges = set(g.edges())
-
-    # next, place edges in layers
-    while len(edges) > 0:
-        ready = set()
-        for e in edges:
-            if all(v in v_placed for v in g.source(e)):
-                ready.add(e)
-        outputs = set(g.outputs())
-        for v in v_layer:
-            if v in outputs or any(e not in ready for e in g.out_edges(v)):
-                id = g.insert_id_after(v)
-                new_ids.add(id)
-                ready.add(id)
-        
-        e_layer = []
-        for e in ready:
-            src = g.source(e)
-            e_layer.append(e)
-            edges.discard(e)
-        if all(e in new_ids for e in e_layer):
+        for e in g.out_edges(v):
+            unplaced[e] -= 1
+            if unplaced[e] == 0:
+                ready.append(e)
+                remaining -= 1
+
+    for v in v_layer: place(v)
+
+    while len(ready) + remaining > 0:
+        if len(ready) == 0:
             raise ValueError("Could not make progress. Is graph acyclic?")
 
+        # vertices that are still needed later get extended by an identity, whose target takes over as the
+        # source of their out-edges (and output), and so counts as placed already
+        e_layer = sorted(ready)
+        for v in v_layer:
+            if v in outputs or any(unplaced[e] != 0 for e in g.out_edges(v)):
+                id = g.insert_id_after(v)
+                w = g.target(id)[0]
+                v_placed.add(w)
+                if v in outputs:
+                    outputs.discard(v)
+                    outputs.add(w)
+                e_layer.append(id)
         e_layers.append(e_layer)
 
-        if len(edges) > 0:
-            v_layer = []
-            for e in e_layer:
-                for v in g.target(e):
-                    v_placed.add(v)
-                    v_layer.append(v)
+        ready = []
+        v_layer = []
+        for e in e_layer:
+            for v in g.target(e):
+                place(v)
+                v_layer.append(v)
 
     # finally attempt to minimise crossings by sorting edges according to the ideal positions of their source and
     # target vertices. This is done in a forward (it=0) and backward (it=1) pass.
@@ -130,6 +143,7 @@ def split_perm(perm: List[int]) -> List[List[int]]:
     return perms
 
 
+@trace.traced('graph_to_term', lambda g: {'edges': g.num_edges()})
 def graph_to_term(g: Graph) -> str:
     """Convert a graph to a term
 
@@ -156,7 +170,7 @@ def graph_to_term(g: Graph) -> str:
             seq.append(' * '.join([perm_to_s(p) for p in perms]))
 
         # append the parallel composition of the current edge layer
-        par = [str(g.edge_data(e).value) for e in e_layers[i]]
+        par = [str(g.edata[e].value) for e in e_layers[i]]
         seq.append(' * '.join(par))
 
         # compute the permutation from the outputs of the edge layer to the next vertex layer
@@ -175,3 +189,36 @@ def graph_to_term(g: Graph) -> str:
 
     return ' ; '.join(seq)
 
+
+class TermCache:
+    """A cache of the terms computed by :func:`graph_to_term`, keyed by canonical hash
+
+    Isomorphic graphs show up over and over again, e.g. when `Tactic.next_rhs` runs through the
+    rewrites of a goal each time the user asks for the next one, and computing the hash of a graph and
+    checking that it is isomorphic to a cached one is much cheaper than converting it to a term. This keeps
+    the terms of the `max_size` most recently used graphs. As with the other caches, a cached term is only
+    used if the graph it was computed for is isomorphic to the new one.
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.__entries: OrderedDict[int, Tuple[Graph, str]] = OrderedDict()
+
+    def term(self, g: Graph) -> str:
+        """Return a term for `g`, using a cached term for an isomorphic graph if possible"""
+        key = g.canonical_hash()
+        entry = self.__entries.get(key)
+        if entry and find_iso(entry[0], g):
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+        t = graph_to_term(g)
+        self.__entries[key] = (g.copy(), t)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+        return t
+
+    def clear(self) -> None:
+        """Forget all cached terms"""
+        self.__entries.clear()
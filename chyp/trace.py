@@ -0,0 +1,158 @@
+#     chyp - An interactive theorem prover for string diagrams
+#     Copyright (C) 2023 - Aleks Kissinger
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in tracing of where the time goes when parsing and checking proofs
+
+Code that can be slow is wrapped in spans, using the `span` context manager or the `traced` decorator.
+Spans nest, and carry arguments such as the name of the rule being matched or the line of the rewrite
+step being checked. While tracing is disabled, which is the default, `span` returns a shared object that
+does nothing and `traced` functions only check a global variable before calling the function they wrap,
+so spans cost a fraction of a microsecond.
+
+Call `enable` to start recording spans. The spans recorded can be saved in the Chrome trace event format
+with `write_chrome_trace`, and opened in Perfetto (https://ui.perfetto.dev) or chrome://tracing, or
+summarised as a flat profile with `format_profile`.
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, TypeVar, cast
+import functools
+import json
+import os
+import threading
+import time
+
+class Tracer:
+    """Records spans as Chrome trace events, along with a flat profile of the time spent in each kind of span
+
+    The profile maps the name of each kind of span to the number of spans, their total time and their self
+    time, i.e. the time not spent in nested spans, in seconds. The total time of a span that is nested
+    inside a span with the same name is counted twice.
+    """
+    events: List[Dict[str, Any]]
+    profile: Dict[str, List[float]]
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.events = []
+        self.profile = dict()
+        # for each open span, the time spent in the spans nested in it so far
+        self.__nested: List[float] = []
+
+    def begin(self) -> float:
+        """Open a span, returning its start time"""
+        self.__nested.append(0.0)
+        return time.perf_counter()
+
+    def end(self, name: str, start: float, args: Dict[str, Any]) -> None:
+        """Close the innermost open span, which was called `name` and started at `start`"""
+        duration = time.perf_counter() - start
+        nested = self.__nested.pop()
+        if len(self.__nested) != 0: self.__nested[-1] += duration
+
+        entry = self.profile.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] += duration - nested
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.start) * 1e6,
+            'dur': duration * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+class Span:
+    """A context manager recording the time spent in its body as a span of `tracer`"""
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer: Tracer, name: str, args: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> Span:
+        self.start = self.tracer.begin()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.tracer.end(self.name, self.start, self.args)
+
+class NullSpan:
+    """A context manager that does nothing, used for all spans while tracing is disabled"""
+    __slots__ = ()
+
+    def __enter__(self) -> NullSpan:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+NULL_SPAN = NullSpan()
+
+# the tracer spans are recorded in, if tracing is enabled
+tracer: Optional[Tracer] = None
+
+def enable() -> None:
+    """Start recording spans, discarding any recorded so far"""
+    global tracer
+    tracer = Tracer()
+
+def disable() -> None:
+    """Stop recording spans"""
+    global tracer
+    tracer = None
+
+def span(name: str, **args: Any) -> Span | NullSpan:
+    """Return a context manager recording its body as a span with the given name and arguments"""
+    if tracer is None: return NULL_SPAN
+    return Span(tracer, name, args)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+def traced(name: str, describe: Optional[Callable[..., Dict[str, Any]]] = None) -> Callable[[F], F]:
+    """Decorate a function so each call to it is recorded as a span called `name`
+
+    If `describe` is given, it is called with the same arguments as the function to get the arguments of
+    the span. It is only called while tracing is enabled.
+    """
+    def decorate(f: F) -> F:
+        @functools.wraps(f)
+        def wrapper(*a: Any, **kw: Any) -> Any:
+            if tracer is None: return f(*a, **kw)
+            with Span(tracer, name, describe(*a, **kw) if describe else {}):
+                return f(*a, **kw)
+        return cast(F, wrapper)
+    return decorate
+
+def write_chrome_trace(path: str, t: Optional[Tracer] = None) -> None:
+    """Save the spans recorded by `t` (by default, the current tracer) in the Chrome trace event format"""
+    t = t or tracer
+    if t is None: raise ValueError('Tracing is not enabled.')
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': t.events, 'displayTimeUnit': 'ms'}, f)
+
+def format_profile(t: Optional[Tracer] = None) -> str:
+    """Format the flat profile of `t` (by default, the current tracer) as a table, sorted by self time"""
+    t = t or tracer
+    if t is None: raise ValueError('Tracing is not enabled.')
+    lines = [f'{"span":<20} {"count":>8} {"total":>10} {"self":>10} {"self/call":>10}']
+    for name, (count, total, self_time) in sorted(t.profile.items(), key=lambda item: -item[1][2]):
+        lines.append(f'{name:<20} {int(count):>8} {total:>9.3f}s {self_time:>9.3f}s '
+                     f'{self_time / count * 1e3:>8.3f}ms')
+    return '\n'.join(lines)
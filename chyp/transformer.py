@@ -24,17 +24,24 @@ class Meta:
 
 
 class YamlTransformer:
+    # the first document of the stream, which the later documents rewrite
+    document = None
+    # how many documents have been transformed so far. If this is non-zero when `transform` is called, the
+    # tokens continue a stream whose first document has already been transformed.
+    num_documents = 0
+
     def transform(self, tokens):
         """documents give rewriting rules"""
         tokens: Iterator[yaml.Token] = iter(tokens)
-        document = None
         # the very first rule rewrites 0 to the file name
         while token := next(tokens, None):
             match token:
                 case yaml.StreamEndToken():
                     return
                 case yaml.StreamStartToken():
-                    document = self.transform_document(tokens)
+                    if self.num_documents == 0:
+                        self.document = self.transform_document(tokens)
+                        self.num_documents += 1
                 case yaml.DocumentStartToken():
                     meta = Meta(token, token)
                     tokens = itertools.chain([token], tokens)
@@ -42,7 +49,8 @@ class YamlTransformer:
                     rw_part = self.rewrite_part(meta, [
                          False, [0, 0, rw_term], None])
                     rw_name = ""
-                    self.rewrite(meta, [False, rw_name, document, rw_part])
+                    self.rewrite(meta, [False, rw_name, self.document, rw_part])
+                    self.num_documents += 1
 
     def transform_document(self, tokens: Iterator[yaml.Token]):
         document_name = None